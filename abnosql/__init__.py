@@ -2,6 +2,7 @@ import logging
 
 from abnosql.kms import kms
 from abnosql.table import table
+from abnosql.table import transact_write
 
 
 logger = logging.getLogger(__name__)
@@ -9,5 +10,6 @@ logger.addHandler(logging.NullHandler())
 
 __all__ = [  # type: ignore
     kms,
-    table
+    table,
+    transact_write
 ]
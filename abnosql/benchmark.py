@@ -0,0 +1,128 @@
+import copy
+import os
+import tempfile
+import time
+import typing as t
+
+from abnosql.kms import DEK_MODES
+from abnosql.kms import get_keys
+from abnosql.kms import kms
+from abnosql.plugins.kms.local import create_key
+from abnosql.table import kms_decrypt_items
+from abnosql.table import kms_encrypt_items
+
+
+def get_items(count: int, item_size: int, attr_count: int) -> t.List[t.Dict]:
+    # items with attr_count string attributes totalling item_size bytes,
+    # prefixed so values aren't decrypted as JSON numbers
+    attr_size = max(item_size // attr_count, 2)
+    return [
+        dict(
+            {'hk': str(i), 'rk': 'a'},
+            **{
+                f'attr{j}': 'v' + os.urandom(attr_size // 2).hex()[
+                    :attr_size - 1
+                ]
+                for j in range(attr_count)
+            }
+        )
+        for i in range(count)
+    ]
+
+
+def kms_benchmark(
+    provider: str = 'local',
+    config: t.Optional[t.Dict] = None,
+    item_sizes: t.Optional[t.List[int]] = None,
+    attr_counts: t.Optional[t.List[int]] = None,
+    modes: t.Optional[t.List[str]] = None,
+    items: int = 100
+) -> t.List[t.Dict]:
+    """Measure encrypt/decrypt throughput of the KMS encryption pipeline
+
+    Items are encrypted and decrypted the same way tables do (via the
+    provider encrypt_many() and decrypt_many()), for each combination of
+    item size, attribute count and data key (DEK) mode, see get_dek_mode().
+    The cached mode also enables the DEK cache for decrypt.  If provider
+    is local and no key_ids are configured, a temporary key is created.
+
+    Args:
+
+        provider: kms provider, eg 'local' (default) or 'azure'
+        config: optional kms config
+        item_sizes: plaintext bytes per item, default [100, 1000, 10000]
+        attr_counts: encrypted attributes per item, default [1, 5, 10]
+        modes: DEK modes, default all
+        items: number of items per run
+
+    Returns:
+
+        list of result dicts containing `mode`, `item_size`, `attrs`,
+        `encrypt_ops` and `decrypt_ops` (values per second),
+        `encrypt_mbps` and `decrypt_mbps` (plaintext MB per second) and
+        `overhead` (serialized bytes / plaintext bytes)
+
+    """
+    config = dict(config or {})
+    # allow the largest values the pack_bytes envelope supports
+    config.setdefault('pack_bytes_maxlen', 65535)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if (
+            provider == 'local'
+            and 'key_ids' not in config
+            and get_keys() is None
+        ):
+            config['key_ids'] = [os.path.join(tmpdir, 'benchmark.key')]
+            create_key(config['key_ids'][0])
+        results = []
+        for item_size in item_sizes or [100, 1000, 10000]:
+            for attr_count in attr_counts or [1, 5, 10]:
+                _items = get_items(items, item_size, attr_count)
+                for mode in modes or DEK_MODES:
+                    results.append(kms_benchmark_run(
+                        provider, config, _items, mode
+                    ))
+                    results[-1].update({
+                        'item_size': item_size,
+                        'attrs': attr_count
+                    })
+    return results
+
+
+def kms_benchmark_run(
+    provider: str, config: t.Dict, items: t.List[t.Dict], mode: str
+) -> t.Dict:
+    kcfg = dict(config, dek_mode=mode, dek_cache=mode == 'cached')
+    attrs = [_ for _ in items[0].keys() if _ not in ['hk', 'rk']]
+    _config = {
+        'kms': dict(
+            kcfg,
+            key_attrs=['hk', 'rk'],
+            attrs=attrs,
+            pm=kms(kcfg, provider)
+        )
+    }
+    values = len(items) * len(attrs)
+    plaintext_bytes = sum(len(item[attr]) for item in items for attr in attrs)
+
+    start = time.perf_counter()
+    encrypted = kms_encrypt_items(_config, copy.deepcopy(items))
+    encrypt_secs = time.perf_counter() - start
+    serialized_bytes = sum(
+        len(item[attr]) for item in encrypted for attr in attrs
+    )
+
+    start = time.perf_counter()
+    decrypted = kms_decrypt_items(_config, encrypted)
+    decrypt_secs = time.perf_counter() - start
+    if decrypted != items:
+        raise ValueError('decrypted items do not match')
+
+    return {
+        'mode': mode,
+        'encrypt_ops': round(values / encrypt_secs),
+        'decrypt_ops': round(values / decrypt_secs),
+        'encrypt_mbps': round(plaintext_bytes / encrypt_secs / 1e6, 2),
+        'decrypt_mbps': round(plaintext_bytes / decrypt_secs / 1e6, 2),
+        'overhead': round(serialized_bytes / plaintext_bytes, 2)
+    }
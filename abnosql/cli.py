@@ -6,6 +6,7 @@ import os
 import click
 from tabulate import tabulate  # type: ignore
 
+from abnosql.benchmark import kms_benchmark as _kms_benchmark
 from abnosql import table as _table
 
 
@@ -131,6 +132,21 @@ def query(table, partition_key, id_key, filters, database, config):
     )['items'])
 
 
+@click.command()
+@click.argument('table')
+@click.option('--partition-key', '-p')
+@click.option('--id-key', '-k')
+@click.option('--filters', '-f')
+@click.option('--database', '-d')
+@click.option('--config', '-c')
+def count(table, partition_key, id_key, filters, database, config):
+    tb = _table(table, get_config(config), database=database)
+    click.echo(tb.count(
+        key=get_key(partition_key, id_key) if partition_key else None,
+        filters=parse_dict_arg(filters)
+    ))
+
+
 @click.command()
 @click.argument('table')
 @click.argument('statement')
@@ -146,12 +162,35 @@ def query_sql(table, statement, parameters, database, config):
     )['items'])
 
 
+@click.command()
+@click.option('--provider', '-p', default='local')
+@click.option('--config', '-c')
+@click.option('--item-sizes', '-s', default='100,1000,10000')
+@click.option('--attr-counts', '-a', default='1,5,10')
+@click.option('--modes', '-m', default='attr,item,cached')
+@click.option('--items', '-n', default=100)
+def kms_benchmark(
+    provider, config, item_sizes, attr_counts, modes, items
+):
+    config = get_config(config) or {}
+    dump(_kms_benchmark(
+        provider,
+        config.get('kms', config),
+        item_sizes=[int(_) for _ in item_sizes.split(',')],
+        attr_counts=[int(_) for _ in attr_counts.split(',')],
+        modes=modes.split(','),
+        items=items
+    ))
+
+
 cli.add_command(get_item)
 cli.add_command(put_item)
 cli.add_command(put_items)
 cli.add_command(delete_item)
 cli.add_command(query)
+cli.add_command(count)
 cli.add_command(query_sql)
+cli.add_command(kms_benchmark)
 
 if __name__ == '__main__':
     cli()
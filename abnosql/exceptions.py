@@ -59,3 +59,10 @@ class ValidationException(NoSQLException):
         super(ValidationException, self).__init__(
             title or 'validation exception', detail, status
         )
+
+
+class TransactionException(NoSQLException):
+    def __init__(self, title=None, detail=None, status=409):
+        super(TransactionException, self).__init__(
+            title or 'transaction cancelled', detail, status
+        )
@@ -1,7 +1,12 @@
 from abc import ABCMeta  # type: ignore
 from abc import abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import json
 import os
 import struct
+import threading
+import time
 import typing as t
 
 import pluggy  # type: ignore
@@ -60,6 +65,448 @@ class KmsBase(metaclass=ABCMeta):
         """
         pass
 
+    def encrypt_many(
+        self,
+        plaintexts: t.List[str],
+        contexts: t.List[t.Dict],
+        key: t.Optional[bytes] = None
+    ) -> t.List[str]:
+        """encrypt multiple plaintext strings concurrently
+
+        Remote key operations are run on a bounded thread pool, see
+        get_max_workers().  Providers can override this to batch or
+        dedupe remote calls.
+
+        Args:
+
+            plaintexts: list of plaintext strings
+            contexts: list of encryption context / AAD dictionaries,
+                one per plaintext
+            key: optional data key
+
+        Returns:
+
+            list of serialized encrypted strings, same order as plaintexts
+
+        """
+        return map_concurrent(
+            lambda plaintext, context: self.encrypt(
+                plaintext, context, key=key
+            ),
+            list(zip(plaintexts, contexts)),
+            get_max_workers(getattr(self, 'config', None))
+        )
+
+    def decrypt_many(
+        self,
+        serialized: t.List[str],
+        contexts: t.List[t.Dict]
+    ) -> t.List[str]:
+        """decrypt multiple serialized encrypted strings concurrently
+
+        Args:
+
+            serialized: list of serialized encrypted strings
+            contexts: list of encryption context / AAD dictionaries,
+                one per serialized string
+
+        Returns:
+
+            list of plaintexts, same order as serialized
+
+        """
+        return map_concurrent(
+            self.decrypt,
+            list(zip(serialized, contexts)),
+            get_max_workers(getattr(self, 'config', None))
+        )
+
+
+class DekCache:
+    """Thread safe LRU cache of plaintext data encryption keys (DEKs)
+
+    Keyed by the wrapped/encrypted DEK so that repeat decrypts of the same
+    envelope don't need a remote unwrap.  Entries expire after max_age
+    seconds.  Plaintext DEKs are held in memory, so only enable if that
+    is acceptable.
+    """
+
+    def __init__(
+        self, max_items: int = 1000, max_age: float = 300
+    ) -> None:
+        self.max_items = max_items
+        self.max_age = max_age
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, enc_dek: bytes) -> t.Optional[bytes]:
+        with self._lock:
+            entry = self._cache.get(enc_dek)
+            if entry is None:
+                return None
+            (expires, dek) = entry
+            if expires < time.monotonic():
+                self._cache.pop(enc_dek, None)
+                return None
+            self._cache.move_to_end(enc_dek)
+            return dek
+
+    def put(self, enc_dek: bytes, dek: bytes) -> None:
+        with self._lock:
+            self._cache[enc_dek] = (time.monotonic() + self.max_age, dek)
+            self._cache.move_to_end(enc_dek)
+            while len(self._cache) > self.max_items:
+                self._cache.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+
+def get_dek_cache(config: t.Optional[t.Dict] = None) -> t.Optional[DekCache]:
+    """Get DEK cache if enabled via `dek_cache` kms config
+
+    `dek_cache` can be True to use defaults, or dictionary containing
+    optional `max_items` and `max_age` (seconds)
+
+    Args:
+
+        config: kms config dict
+
+    Returns:
+
+        DekCache or None if not enabled
+
+    """
+    dcfg = (config or {}).get('dek_cache')
+    if dcfg is True:
+        dcfg = {}
+    if not isinstance(dcfg, dict):
+        return None
+    return DekCache(**{
+        k: v for k, v in dcfg.items() if k in ['max_items', 'max_age']
+    })
+
+
+DEK_MODES = ['attr', 'item', 'cached']
+
+
+class DekReuse:
+    """Thread safe reuse of one wrapped data encryption key (DEK)
+
+    Used by the `cached` DEK mode so that a DEK is generated and wrapped
+    (a remote KMS call) once and reused across values until it is max_age
+    seconds old or has been used max_uses times.  As with the DEK cache,
+    the plaintext DEK is held in memory.
+    """
+
+    def __init__(
+        self, max_age: float = 300, max_uses: int = 10000
+    ) -> None:
+        self.max_age = max_age
+        self.max_uses = max_uses
+        self._dek: t.Optional[t.Tuple[bytes, t.Any, float]] = None
+        self._uses = 0
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        uses: int,
+        generate: t.Callable[[], bytes],
+        wrap: t.Callable[[bytes], t.Any]
+    ) -> t.Tuple[bytes, t.Any]:
+        with self._lock:
+            if (
+                self._dek is None
+                or self._dek[2] < time.monotonic()
+                or self._uses + uses > self.max_uses
+            ):
+                dek = generate()
+                self._dek = (dek, wrap(dek), time.monotonic() + self.max_age)
+                self._uses = 0
+            self._uses += uses
+            return (self._dek[0], self._dek[1])
+
+
+def get_dek_mode(config: t.Optional[t.Dict] = None) -> str:
+    """Get data encryption key (DEK) mode from `dek_mode` kms config
+
+    - `attr`: new DEK per attribute value (default)
+    - `item`: one DEK per item, ie values sharing the same context
+    - `cached`: reuse one DEK across values and calls, see DekReuse and
+      `dek_reuse` kms config dict containing `max_age` and `max_uses`
+
+    Args:
+
+        config: kms config dict
+
+    Returns:
+
+        DEK mode
+
+    """
+    mode = (config or {}).get('dek_mode', 'attr')
+    if mode not in DEK_MODES:
+        raise ex.ConfigException(f'kms dek_mode must be one of {DEK_MODES}')
+    return mode
+
+
+def get_dek_reuse(config: t.Optional[t.Dict] = None) -> t.Optional[DekReuse]:
+    if get_dek_mode(config) != 'cached':
+        return None
+    rcfg = (config or {}).get('dek_reuse')
+    if not isinstance(rcfg, dict):
+        rcfg = {}
+    return DekReuse(**{
+        k: v for k, v in rcfg.items() if k in ['max_age', 'max_uses']
+    })
+
+
+def wrap_deks(
+    contexts: t.List[t.Dict],
+    key: t.Optional[bytes],
+    mode: str,
+    reuse: t.Optional[DekReuse],
+    generate: t.Callable[[], bytes],
+    wrap: t.Callable[[bytes], t.Any],
+    max_workers: int
+) -> t.List[t.Tuple[bytes, t.Any]]:
+    """Get DEK and wrapped DEK for each value to encrypt, as per DEK mode
+
+    Each distinct DEK is wrapped once, concurrently
+
+    Args:
+
+        contexts: encryption context for each value
+        key: optional DEK to use for all values
+        mode: DEK mode, see get_dek_mode()
+        reuse: DekReuse if cached mode
+        generate: callable returning new DEK
+        wrap: callable taking DEK returning wrapped DEK
+        max_workers: max number of concurrent wrap operations
+
+    Returns:
+
+        list of (DEK, wrapped DEK) tuples, one per context
+
+    """
+    if key is None and reuse is not None:
+        dek = reuse.get(len(contexts), generate, wrap)
+        return [dek for _ in contexts]
+    if key is not None:
+        deks = [key for _ in contexts]
+    elif mode == 'item':
+        by_context: t.Dict[str, bytes] = {}
+        deks = []
+        for context in contexts:
+            _context = json.dumps(sorted(context.items()), default=str)
+            if _context not in by_context:
+                by_context[_context] = generate()
+            deks.append(by_context[_context])
+    else:
+        deks = [generate() for _ in contexts]
+    unique = list(dict.fromkeys(deks))
+    wrapped = dict(zip(unique, map_concurrent(
+        wrap, [(_,) for _ in unique], max_workers
+    )))
+    return [(dek, wrapped[dek]) for dek in deks]
+
+
+def get_max_workers(config: t.Optional[t.Dict] = None) -> int:
+    """Get max number of concurrent remote KMS operations
+
+    Taken from `max_workers` kms config or `ABNOSQL_KMS_MAX_WORKERS` env var,
+    defaults to 10
+
+    Args:
+
+        config: kms config dict
+
+    Returns:
+
+        max workers
+
+    """
+    max_workers = (config or {}).get(
+        'max_workers', os.environ.get('ABNOSQL_KMS_MAX_WORKERS', '10')
+    )
+    return max(int(max_workers), 1)
+
+
+def map_concurrent(
+    func: t.Callable,
+    args_list: t.List[t.Tuple],
+    max_workers: int
+) -> t.List:
+    # run func(*args) for each args on bounded thread pool, preserving order
+    # and raising first exception.  Don't bother with threads if only one
+    if len(args_list) <= 1 or max_workers <= 1:
+        return [func(*args) for args in args_list]
+    with ThreadPoolExecutor(
+        max_workers=min(max_workers, len(args_list))
+    ) as executor:
+        return list(executor.map(lambda args: func(*args), args_list))
+
+
+class KeySelector:
+    """Thread safe latency/error aware ordering of KMS key ids
+
+    Tracks an exponentially weighted moving average (EWMA) of latency and
+    error rate per key id (eg per region or replica).  Keys are ordered
+    fastest healthy first, so encrypt uses the fastest healthy key and
+    decrypt fails over to the next key.  A key is unhealthy while its
+    error rate is above max_error_rate and its last error was less than
+    cooldown seconds ago.  Keys not yet measured are tried in configured
+    order before measured keys so each gets measured.
+    """
+
+    def __init__(
+        self,
+        key_ids: t.List[str],
+        alpha: float = 0.3,
+        max_error_rate: float = 0.5,
+        cooldown: float = 30
+    ) -> None:
+        self.key_ids = list(key_ids)
+        self.alpha = alpha
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self._stats: t.Dict[str, t.Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        key_id: str,
+        latency: t.Optional[float] = None,
+        error: bool = False
+    ) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(key_id, {'errors': 0.0})
+            if latency is not None:
+                stats['latency'] = (
+                    latency if 'latency' not in stats
+                    else self.alpha * latency
+                    + (1 - self.alpha) * stats['latency']
+                )
+            stats['errors'] = (
+                self.alpha * (1.0 if error else 0.0)
+                + (1 - self.alpha) * stats['errors']
+            )
+            if error:
+                stats['error_at'] = time.monotonic()
+
+    def healthy(self, key_id: str) -> bool:
+        stats = self._stats.get(key_id, {})
+        return not (
+            stats.get('errors', 0) > self.max_error_rate
+            and time.monotonic() - stats.get('error_at', 0) < self.cooldown
+        )
+
+    def ordered(self, key_ids: t.Optional[t.List[str]] = None) -> t.List[str]:
+        key_ids = key_ids or self.key_ids
+        with self._lock:
+            return sorted(key_ids, key=lambda key_id: (
+                not self.healthy(key_id),
+                key_id in self._stats and 'latency' in self._stats[key_id],
+                self._stats.get(key_id, {}).get('latency', 0),
+                key_ids.index(key_id)
+            ))
+
+    def call(
+        self,
+        func: t.Callable,
+        key_ids: t.Optional[t.List[str]] = None,
+        is_error: t.Optional[t.Callable] = None,
+        preferred: t.Optional[str] = None
+    ) -> t.Any:
+        """Call func(key_id) for each key id in order until one succeeds
+
+        Args:
+
+            func: callable taking key id
+            key_ids: optional key ids to try, defaults to all
+            is_error: optional callable taking exception, returning False
+                if the exception shouldn't count against key health (eg
+                key can't decrypt the data)
+            preferred: optional key id to always try first (eg the key
+                version that encrypted the data)
+
+        Returns:
+
+            func return value, if all keys fail last exception is raised
+
+        """
+        last_ex = None
+        key_ids = self.ordered(key_ids)
+        if preferred is not None:
+            key_ids = [preferred] + [_ for _ in key_ids if _ != preferred]
+        for key_id in key_ids:
+            start = time.monotonic()
+            try:
+                resp = func(key_id)
+            except Exception as e:
+                if is_error is None or is_error(e):
+                    self.record(key_id, error=True)
+                last_ex = e
+                continue
+            self.record(key_id, latency=time.monotonic() - start)
+            return resp
+        if last_ex is not None:
+            raise last_ex
+        raise ex.ConfigException('kms key_ids required')
+
+
+def get_key_selector(
+    key_ids: t.List[str],
+    config: t.Optional[t.Dict] = None
+) -> KeySelector:
+    """Get KeySelector for key ids, configured via `key_selection` kms config
+
+    `key_selection` is an optional dictionary containing `alpha` (EWMA
+    weight), `max_error_rate` and `cooldown` (seconds)
+
+    Args:
+
+        key_ids: list of key ids
+        config: kms config dict
+
+    Returns:
+
+        KeySelector
+
+    """
+    kscfg = (config or {}).get('key_selection')
+    if not isinstance(kscfg, dict):
+        kscfg = {}
+    return KeySelector(key_ids, **{
+        k: v for k, v in kscfg.items()
+        if k in ['alpha', 'max_error_rate', 'cooldown']
+    })
+
+
+def get_key_replicas(config: t.Optional[t.Dict] = None) -> bool:
+    """Get whether kms key ids are replicas of the same key (so any key
+    can decrypt data encrypted by another) from `key_replicas` kms config
+    or `ABNOSQL_KMS_KEY_REPLICAS` env var, default False
+
+    Only replicas are ordered by latency for encrypt, otherwise the first
+    key id encrypts and the other keys are only used to decrypt
+
+    Args:
+
+        config: kms config dict
+
+    Returns:
+
+        True if key ids are replicas
+
+    """
+    replicas = (config or {}).get(
+        'key_replicas',
+        os.environ.get('ABNOSQL_KMS_KEY_REPLICAS', 'FALSE') == 'TRUE'
+    )
+    return replicas is True
+
 
 def get_keys():
     return (
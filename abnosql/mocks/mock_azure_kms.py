@@ -13,6 +13,9 @@ import abnosql.mocks.mock_azure_auth as auth
 # also couldnt get it to work)
 AESGCM_KEY = 'qaIQJKZjpemmOBhKvEln6w=='  # some random made up b64 AESGCM key
 
+# version returned when getting key without version (ie latest)
+LATEST_KEY_VERSION = '8b3ab5e1e5d04b6f9d5c0e3b1a2f4c6d'
+
 
 def mock_azure_kms(f):
 
@@ -42,11 +45,13 @@ def mock_azure_kms(f):
         if len(parts) >= 3 and parts[0] == 'keys':
             kid = host + '/' + '/'.join(parts[0:3])
             kid = kid.split('?')[0]
+        elif len(parts) == 2 and parts[0] == 'keys':
+            kid = f'{host}/keys/{parts[1]}/{LATEST_KEY_VERSION}'
 
         epoch = int(time.time())
 
-        # /keys/bar/45e36a1024a04062bd489db0d9004d09
-        if method == 'GET' and len(parts) == 3 and parts[0] == 'keys':
+        # /keys/bar/45e36a1024a04062bd489db0d9004d09 or /keys/bar (latest)
+        if method == 'GET' and len(parts) in [2, 3] and parts[0] == 'keys':
             return _response(
                 200,
                 {
@@ -90,6 +95,17 @@ def mock_azure_kms(f):
                         'value': 'g6omIiikuF9OnNRmJlj6+hLe4sKC6c/94kfluSa6mZx9KiGPvlyvQXq6AcqQpXU1co6JoG7Numq4YCrZiAqzHpyyMMFrTuostGlWA3py9CwW9TLFFYNXzozwrBTbg32De4DPq5EiWvmLGjOVktEPKDz44ZgO49jrKljcJCpdVHdSYJKHy2XyV7UO/Xik463UAT19c/4ObGRb9yXylcMR5oayArAJuxJV2MPeM4BaZapU/rhrLAOLNEcVTSKGkhBc6zXBdKsznhZJ9C6vm53eUDZjgFgaMARMKg0VZJELYi47Cuxanlz41GTVj35f5rxq1c103exHZ5b79cR0f7LqQA=='  # noqa
                     }
                 )
+            elif parts[-1] == 'unwrapkey' and parts[1] == 'wrong':
+                # key that didn't wrap the DEK
+                return _response(
+                    400,
+                    {
+                        'error': {
+                            'code': 'BadParameter',
+                            'message': 'The parameter is incorrect.'
+                        }
+                    }
+                )
             elif parts[-1] == 'unwrapkey':
                 # response from https://learn.microsoft.com/en-us/rest/api/keyvault/keys/unwrap-key/unwrap-key  # noqa
                 return _response(
@@ -1,18 +1,26 @@
+import copy
 import functools
+import hashlib
 import json
 import re
 import typing as t
 from urllib import parse as urlparse
 
+from azure.cosmos.partition_key import PartitionKey  # type: ignore
 import responses  # type: ignore
 
 import abnosql.mocks.mock_azure_auth as auth
+import abnosql.plugins.table.memory as memory
 from abnosql.plugins.table.memory import get_table_count
+from abnosql.plugins.table.memory import query_items
 from abnosql import table
 
 
 KEY_ATTRS: t.Dict[str, t.List[str]] = {}
 CRYPTO_ATTRS: t.Dict[str, t.List[str]] = {}
+SESSION_LSN = 0
+WRITE_TS = 0
+PARTITION_KEY_RANGES = 1
 COSMOS_POST_PATCH_VALS = {
     '_rid': '2pFqAMMTYY8BAAAAAAAAAA==',
     '_self': 'dbs/2pFqAA==/colls/2pFqAMMTYY8=/docs/2pFqAMMTYY8BAAAAAAAAAA==/'
@@ -29,6 +37,35 @@ def set_crypto_attrs(attrs: t.Dict[str, t.List[str]]):
     CRYPTO_ATTRS = attrs
 
 
+def set_partition_key_ranges(count: int):
+    # number of physical partitions (pkranges) containers are split into
+    global PARTITION_KEY_RANGES
+    PARTITION_KEY_RANGES = count
+
+
+def get_partition_key_ranges() -> t.List[t.Dict]:
+    # effective partition key (EPK) hash space split evenly
+    bounds = [''] + [
+        '%02X' % (256 * i // PARTITION_KEY_RANGES)
+        for i in range(1, PARTITION_KEY_RANGES)
+    ] + ['FF']
+    return [
+        {
+            'id': str(i),
+            'minInclusive': bounds[i],
+            'maxExclusive': bounds[i + 1],
+            'parents': []
+        }
+        for i in range(PARTITION_KEY_RANGES)
+    ]
+
+
+def get_etag(item: t.Dict) -> str:
+    return '"' + hashlib.md5(
+        json.dumps(item, sort_keys=True, default=str).encode()
+    ).hexdigest() + '"'
+
+
 def mock_cosmos(f):
 
     def _get_key(headers, key_attrs, doc_id):
@@ -46,11 +83,130 @@ def mock_cosmos(f):
             key[rk] = doc_id
         return key
 
+    def _put(tb, item):
+        # writes update the document _ts (and so the _etag)
+        global WRITE_TS
+        WRITE_TS += 1
+        return tb.put_item(dict(item, _ts=WRITE_TS))
+
+    def _in_scope(headers, key_attrs, item):
+        # query partition key or feed range (pkrange and optional EPKs)
+        _part_keys = headers.get('x-ms-documentdb-partitionkey')
+        if _part_keys:
+            return item.get(key_attrs[0]) == json.loads(_part_keys)[0]
+        range_id = headers.get('x-ms-documentdb-partitionkeyrangeid')
+        if range_id is None:
+            return True
+        pk_range = get_partition_key_ranges()[int(range_id)]
+        epk = PartitionKey(
+            path='/' + key_attrs[0], kind='Hash'
+        )._get_effective_partition_key_string([item.get(key_attrs[0])])
+        start = headers.get('x-ms-start-epk', pk_range['minInclusive'])
+        end = headers.get('x-ms-end-epk', pk_range['maxExclusive'])
+        return start <= epk and (end == 'FF' or epk < end)
+
+    def _page(headers, items):
+        # pages of x-ms-max-item-count with continuation (offset) tokens
+        max_items = int(headers.get('x-ms-max-item-count', '-1'))
+        if max_items <= 0:
+            return (items, None)
+        start = int(headers.get('x-ms-continuation') or '0')
+        end = start + max_items
+        return (items[start:end], str(end) if end < len(items) else None)
+
+    def _patch(tb, key, data):
+        current = tb.get_item(**key)
+        if current is None:
+            return (404, None)
+        condition = data.get('condition')
+        if condition and not len(
+            query_items(f'SELECT * {condition}', [current])
+        ):
+            return (412, {'message': 'Precondition Failed'})
+        # apply operations in order, failing like cosmos if invalid
+        item = copy.deepcopy(current)
+        for _op in data['operations']:
+            (path, val) = (_op['path'][1:], _op.get('value'))
+            if _op['op'] == 'remove':
+                if path not in item:
+                    return (400, {'message': 'Bad Request'})
+                item.pop(path)
+            elif path.endswith('/-'):
+                path = path[:-2]
+                if not isinstance(item.get(path), list):
+                    return (400, {'message': 'Bad Request'})
+                item[path].append(val)
+            elif _op['op'] == 'incr':
+                item[path] = item.get(path, 0) + val
+            else:
+                item[path] = val
+        item = _put(tb, item)
+        item.update(COSMOS_POST_PATCH_VALS)
+        return (200, item)
+
+    def _batch_operation(tb, key_attrs, partition_key, op):
+        body = op.get('resourceBody')
+        _id = op.get('id', (body or {}).get(key_attrs[-1]))
+        key = {key_attrs[0]: partition_key}
+        if len(key_attrs) > 1:
+            key[key_attrs[1]] = _id
+        current = tb.get_item(**key)
+        if_match = op.get('ifMatch')
+        if if_match is not None and (
+            current is None or get_etag(current) != if_match
+        ):
+            return (412, None)
+        _type = op['operationType']
+        if _type == 'Create':
+            if current is not None:
+                return (409, None)
+            return (201, _put(tb, body))
+        elif _type == 'Upsert':
+            return (200, _put(tb, body))
+        elif current is None:
+            return (404, None)
+        elif _type == 'Read':
+            return (200, current)
+        elif _type == 'Replace':
+            return (200, _put(tb, body))
+        elif _type == 'Delete':
+            tb.delete_item(**key)
+            return (204, None)
+        return _patch(tb, key, body)
+
+    def _batch(tb, table_name, key_attrs, headers, operations):
+        # apply operations to memory table, restoring it on any failure
+        partition_key = json.loads(
+            headers['x-ms-documentdb-partitionkey']
+        )[0]
+        snapshot = copy.deepcopy(memory.TABLES.get(table_name, {}))
+        results = []
+        for op in operations:
+            (code, body) = _batch_operation(
+                tb, key_attrs, partition_key, op
+            )
+            results.append({'statusCode': code, 'resourceBody': body})
+            if code >= 400:
+                memory.TABLES[table_name] = snapshot
+                return (207, [
+                    _ if _ is results[-1] else {'statusCode': 424}
+                    for _ in results
+                ] + [{'statusCode': 424}] * (len(operations) - len(results)))
+        return (200, results)
+
     def _callback(request):
         path = urlparse.urlsplit(request.url).path
         headers = dict(request.headers)
 
         def _response(code=404, body=None, _headers=None):
+            if _headers is None and request.method != 'GET':
+                # writes return the session token for session consistency
+                global SESSION_LSN
+                SESSION_LSN += 1
+                _headers = {
+                    'Content-Type': 'application/json',
+                    'x-ms-session-token': f'0:-1#{SESSION_LSN}'
+                }
             return (
                 code, _headers or {
                     'Content-Type': 'application/json'
@@ -65,6 +221,8 @@ def mock_cosmos(f):
             )
 
         parts = [_ for _ in path.split('/') if _ != '']
+        # writes with no_response=True don't return the document
+        minimal = headers.get('Prefer') == 'return=minimal'
         # print(f'REQ: {request.method} {path} H: {headers} B: {request.body}')
 
         # required for CosmosClient
@@ -77,6 +235,15 @@ def mock_cosmos(f):
                 }
             )
 
+        # requests can't be stronger than the (Session) account default
+        levels = [
+            'Eventual', 'ConsistentPrefix', 'Session', 'BoundedStaleness',
+            'Strong'
+        ]
+        level = headers.get('x-ms-consistency-level', 'Session')
+        if levels.index(level) > levels.index('Session'):
+            return _response(400, {'message': 'Bad Request'})
+
         if len(parts) < 4 or parts[0] != 'dbs':
             return _response(404)
 
@@ -107,52 +274,93 @@ def mock_cosmos(f):
             if request.method == 'GET':
                 item = tb.get_item(**key)
                 if item is not None:
-                    return _response(200, item)
+                    return _response(200, dict(item, _etag=get_etag(item)))
             elif request.method == 'DELETE':
                 tb.delete_item(**key)
                 return _response(204, None)
+            elif request.method == 'PUT':
+                current = tb.get_item(**key)
+                if current is None:
+                    return _response(404)
+                if_match = headers.get('If-Match')
+                if if_match is not None and get_etag(current) != if_match:
+                    return _response(412, {'message': 'Precondition Failed'})
+                item = _put(tb, json.loads(request.body))
+                return _response(200, dict(item, _etag=get_etag(item)))
             elif request.method == 'PATCH':
-                data = json.loads(request.body)
-                item = {
-                    _['path'][1:]: _['value']
-                    for _ in data['operations']
-                }
-                item.update(key)
-                item = tb.put_item(item, update=True)
-                item.update(COSMOS_POST_PATCH_VALS)
-                return _response(200, item)
+                (code, item) = _patch(tb, key, json.loads(request.body))
+                return _response(
+                    code, None if minimal and code < 300 else item
+                )
 
         # /dbs/{database}/colls/{table}/docs
         elif len(parts) == 5 and parts[-1] == 'docs':
             if request.method == 'POST':
                 is_query = headers.get('x-ms-documentdb-isquery') == 'true'
                 item = json.loads(request.body)
-                if is_query is True:
-                    items = tb.query_sql(
+                if headers.get('x-ms-cosmos-is-batch-request') == 'True':
+                    (code, results) = _batch(
+                        tb, table_name, key_attrs, headers, item
+                    )
+                    return _response(code, results)
+                elif is_query is True:
+                    items = query_items(
                         item['query'],
-                        {
-                            _['name']: _['value']
-                            for _ in item.get('parameters', {})
-                        }
+                        [
+                            _ for _ in tb._items()
+                            if _in_scope(headers, key_attrs, _)
+                        ],
+                        item.get('parameters', []),
+                        table_name
                     )
-                    headers = {
+                    (items, continuation) = _page(headers, items)
+                    _headers = {
+                        'Content-Type': 'application/json',
                         'x-ms-resource-usage': 'documentsCount=%s' % (
                             get_table_count(table_name)
                         )
                     }
+                    if continuation is not None:
+                        _headers['x-ms-continuation'] = continuation
                     return _response(
-                        200, {'Documents': items}, headers
+                        200, {'Documents': items}, _headers
                     )
                 else:
-                    item = tb.put_item(item)
+                    item = _put(tb, item)
                     item.update(COSMOS_POST_PATCH_VALS)
-                    return _response(201, item)
+                    return _response(201, None if minimal else item)
+
+        # feed ranges, read as a change feed until not modified
+        # /dbs/{database}/colls/{table}/pkranges
+        elif len(parts) == 5 and parts[-1] == 'pkranges':
+            if headers.get('If-None-Match'):
+                return (304, {'etag': '"%s"' % PARTITION_KEY_RANGES}, '')
+            ranges = get_partition_key_ranges()
+            return _response(200, {
+                '_rid': table_name,
+                '_count': len(ranges),
+                'PartitionKeyRanges': ranges
+            }, {
+                'Content-Type': 'application/json',
+                'etag': '"%s"' % PARTITION_KEY_RANGES
+            })
 
         # upsert_item() reads the collection
         # /dbs/{database}/colls/{table}
         elif len(parts) == 4 and parts[-2] == 'colls':
             if request.method == 'GET':
-                return _response(200, {})
+                return _response(200, {
+                    'id': table_name,
+                    'partitionKey': {
+                        'paths': ['/' + key_attrs[0]],
+                        'kind': 'Hash'
+                    },
+                    'indexingPolicy': {
+                        'indexingMode': 'consistent',
+                        'includedPaths': [{'path': '/*'}],
+                        'excludedPaths': [{'path': '/"_etag"/?'}]
+                    }
+                })
 
         return _response(404)
 
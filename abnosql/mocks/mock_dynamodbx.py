@@ -32,8 +32,31 @@ def mock_dynamodbx(f):
             'Items': items
         }
 
+    def batch_execute_statement(kwargs):
+        # select statements return single item so must use full key
+        responses = []
+        for statement in kwargs['Statements']:
+            message = 'Select statements must specify the primary key'
+            try:
+                items = execute_statement(statement)['Items']
+            except Exception as e:
+                (items, message) = (None, str(e))
+            if items is None or len(items) > 1:
+                responses.append({'Error': {
+                    'Code': 'ValidationError', 'Message': message
+                }})
+                continue
+            response = {'TableName': get_table_name(statement['Statement'])}
+            if len(items):
+                response['Item'] = items[0]
+            responses.append(response)
+        return {
+            'Responses': responses
+        }
+
     FUNC_MAP = {
-        'ExecuteStatement': execute_statement
+        'ExecuteStatement': execute_statement,
+        'BatchExecuteStatement': batch_execute_statement
     }
 
     def _mock(self, operation_name, kwargs):
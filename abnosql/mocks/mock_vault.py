@@ -0,0 +1,74 @@
+from base64 import b64decode
+from base64 import b64encode
+import functools
+import hashlib
+import json
+import os
+import re
+from urllib import parse as urlparse
+
+import responses  # type: ignore
+
+# stand-in for HashiCorp Vault transit engine encrypt/decrypt endpoints
+# (including batch_input), keys are derived from this made up root key
+ROOT_KEY = b'mock-vault-transit-root-key'
+
+
+def mock_vault(f):
+
+    def _key(name, context=None):
+        return hashlib.sha256(
+            ROOT_KEY + name.encode() + b64decode(context or '')
+        ).digest()
+
+    def _callback(request):
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        path = urlparse.urlsplit(request.url).path
+        parts = [_ for _ in path.split('/') if _ != '']
+        (operation, name) = (parts[-2], parts[-1])
+        # print(f'REQ: {request.method} {request.url} B: {request.body}')
+
+        def _response(code, body):
+            return code, {}, json.dumps(body)
+
+        if request.headers.get('X-Vault-Token') is None:
+            return _response(403, {'errors': ['permission denied']})
+
+        body = json.loads(request.body)
+        batch_input = body.get('batch_input', [body])
+        results = []
+        for _input in batch_input:
+            aesgcm = AESGCM(_key(name, _input.get('context')))
+            if operation == 'encrypt':
+                nonce = os.urandom(12)
+                ct = aesgcm.encrypt(
+                    nonce, b64decode(_input['plaintext']), None
+                )
+                results.append({
+                    'ciphertext': 'vault:v1:' + b64encode(
+                        nonce + ct
+                    ).decode(),
+                    'key_version': 1
+                })
+            else:
+                try:
+                    raw = b64decode(_input['ciphertext'].split(':')[2])
+                    pt = aesgcm.decrypt(raw[:12], raw[12:], None)
+                    results.append({'plaintext': b64encode(pt).decode()})
+                except Exception:
+                    results.append({
+                        'error': 'cipher: message authentication failed'
+                    })
+        return _response(200, {'data': {'batch_results': results}})
+
+    @functools.wraps(f)
+    def decorated(*args, **kwargs):
+        responses.add_callback(
+            responses.POST,
+            re.compile(r'^https?://[^/]+/v1/.+/(encrypt|decrypt)/[^/]+$'),
+            _callback,
+            content_type='application/json'
+        )
+        return f(*args, **kwargs)
+    return decorated
@@ -5,6 +5,7 @@ import os
 import typing as t
 
 import abnosql.exceptions as ex
+from abnosql.kms import get_key_selector
 from abnosql.kms import get_keys
 from abnosql.kms import KmsBase
 from abnosql.plugin import PM
@@ -13,6 +14,10 @@ from abnosql.plugin import PM
 try:
     import aws_encryption_sdk  # type: ignore
     from aws_encryption_sdk import CommitmentPolicy  # type: ignore
+    from aws_encryption_sdk.exceptions import DecryptKeyError  # type: ignore
+    from aws_encryption_sdk.key_providers.kms import (  # type: ignore
+        MRKAwareStrictAwsKmsMasterKeyProvider
+    )
     from botocore.exceptions import ClientError  # type: ignore
     from botocore.exceptions import NoCredentialsError  # type: ignore
     from botocore.session import Session  # type: ignore
@@ -23,6 +28,13 @@ except ImportError:
 AWS_DEFAULT_REGION = os.environ.get('AWS_DEFAULT_REGION', 'us-east-1')
 
 
+def is_mrk_replicas(key_ids: t.List[str]) -> bool:
+    # True if key ids are all replicas of the same multi-region key (MRK),
+    # eg arn:aws:kms:us-east-1:111122223333:key/mrk-1234 in each region
+    ids = set(key_id.split(':key/')[-1] for key_id in key_ids)
+    return len(ids) == 1 and ids.pop().startswith('mrk-')
+
+
 def kms_ex_handler(raise_not_found: t.Optional[bool] = True):
     def decorator(func):
         @functools.wraps(func)
@@ -61,10 +73,31 @@ class Kms(KmsBase):
         self.client = aws_encryption_sdk.EncryptionSDKClient(
             commitment_policy=CommitmentPolicy.REQUIRE_ENCRYPT_REQUIRE_DECRYPT
         )
-        self.mkp = aws_encryption_sdk.StrictAwsKmsMasterKeyProvider(
-            key_ids=self.key_ids,
-            botocore_session=self.session
-        )
+        # replicas of one MRK can decrypt each others data keys, so encrypt
+        # uses the fastest healthy replica.  Otherwise encrypt under every
+        # key, so any key (eg in another region) can decrypt
+        self.mrk_replicas = is_mrk_replicas(self.key_ids)
+        self.mkps = {
+            key_id: aws_encryption_sdk.StrictAwsKmsMasterKeyProvider(
+                key_ids=[key_id],
+                botocore_session=self.session
+            )
+            for key_id in self.key_ids
+        } if self.mrk_replicas else {
+            None: aws_encryption_sdk.StrictAwsKmsMasterKeyProvider(
+                key_ids=self.key_ids,
+                botocore_session=self.session
+            )
+        }
+        # decrypt fails over to other keys/MRK replicas
+        self.decrypt_mkps = {
+            key_id: MRKAwareStrictAwsKmsMasterKeyProvider(
+                key_ids=[key_id],
+                botocore_session=self.session
+            )
+            for key_id in self.key_ids
+        }
+        self.key_selector = get_key_selector(self.key_ids, self.config)
 
     @kms_ex_handler()
     def encrypt(
@@ -72,18 +105,28 @@ class Kms(KmsBase):
     ) -> str:
         # not using aws dynamodb encryption sdk in case in future
         # we want to use another aws database (eg postgres)
-        ciphertext, _ = self.client.encrypt(
-            source=plaintext,
-            key_provider=self.mkp,
-            encryption_context=context
+        def _encrypt(key_id):
+            return self.client.encrypt(
+                source=plaintext,
+                key_provider=self.mkps[key_id],
+                encryption_context=context
+            )
+
+        ciphertext, _ = (
+            self.key_selector.call(_encrypt) if self.mrk_replicas
+            else _encrypt(None)
         )
         return b64encode(ciphertext).decode()
 
     @kms_ex_handler()
     def decrypt(self, serialized: str, context: t.Dict) -> str:
-        plaintext, header = self.client.decrypt(
-            source=b64decode(serialized),
-            key_provider=self.mkp
+        # key not able to decrypt the data doesn't count against its health
+        plaintext, header = self.key_selector.call(
+            lambda key_id: self.client.decrypt(
+                source=b64decode(serialized),
+                key_provider=self.decrypt_mkps[key_id]
+            ),
+            is_error=lambda e: not isinstance(e, DecryptKeyError)
         )
         for k, v in header.encryption_context.items():
             if k == 'aws-crypto-public-key':
@@ -2,27 +2,85 @@ from base64 import b64decode
 from base64 import b64encode
 import functools
 import json
+import logging
 import os
+import struct
+import threading
+import time
 import typing as t
 
 import abnosql.exceptions as ex
+from abnosql.kms import get_dek_cache
+from abnosql.kms import get_dek_mode
+from abnosql.kms import get_dek_reuse
+from abnosql.kms import get_key_replicas
+from abnosql.kms import get_key_selector
 from abnosql.kms import get_keys
+from abnosql.kms import get_max_workers
 from abnosql.kms import KmsBase
+from abnosql.kms import map_concurrent
 from abnosql.kms import pack_bytes
 from abnosql.kms import unpack_bytes
+from abnosql.kms import wrap_deks
 from abnosql.plugin import PM
 
 
 try:
     import azure.core.exceptions as azex  # type: ignore
     from azure.identity import DefaultAzureCredential  # type: ignore
+    from azure.keyvault.keys import KeyClient  # type: ignore
+    from azure.keyvault.keys import KeyVaultKeyIdentifier  # type: ignore
     from azure.keyvault.keys.crypto import CryptographyClient  # type: ignore
     from azure.keyvault.keys.crypto import KeyWrapAlgorithm  # type: ignore
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+    from cryptography.hazmat.primitives.asymmetric import rsa
     from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 except ImportError:
     MISSING_DEPS = True
 
 
+# compact envelope version byte.  Version 1 (pack_bytes) always starts
+# with 0x00 as it's the first byte of a 4 byte total length
+ENVELOPE_V2 = 2
+ENVELOPE_V2_KID = 0x01  # flag set if key version (kid) is present
+NONCE_LEN = 12
+
+
+def pack_envelope(
+    ct: bytes, nonce: bytes, enc_dek: bytes, kid: t.Optional[bytes] = None
+) -> bytes:
+    # version, flags, dek length + wrapped dek, [kid length + kid],
+    # 12 byte nonce and ciphertext (including GCM tag) as remainder
+    flags = ENVELOPE_V2_KID if kid else 0
+    packed = struct.pack('>BBH', ENVELOPE_V2, flags, len(enc_dek)) + enc_dek
+    if kid:
+        packed += struct.pack('>H', len(kid)) + kid
+    return packed + nonce + ct
+
+
+def unpack_envelope(
+    packed: bytes
+) -> t.Tuple[bytes, bytes, bytes, t.Optional[bytes]]:
+    (version, flags, length) = struct.unpack('>BBH', packed[:4])
+    if version != ENVELOPE_V2:
+        raise ValueError('invalid envelope version')
+    i = 4
+    enc_dek = packed[i:i + length]
+    i += length
+    kid = None
+    if flags & ENVELOPE_V2_KID:
+        length = struct.unpack('>H', packed[i:i + 2])[0]
+        i += 2
+        kid = packed[i:i + length]
+        i += length
+    nonce = packed[i:i + NONCE_LEN]
+    ct = packed[i + NONCE_LEN:]
+    if len(enc_dek) == 0 or len(nonce) != NONCE_LEN or len(ct) == 0:
+        raise ValueError('invalid serialization')
+    return (ct, nonce, enc_dek, kid)
+
+
 def kms_ex_handler(raise_not_found: t.Optional[bool] = True):
 
     def decorator(func):
@@ -51,15 +109,34 @@ class Kms(KmsBase):
         key_ids = self.config.get('key_ids', get_keys())
         if not isinstance(key_ids, list) or len(key_ids) == 0:
             raise ex.ConfigException('kms key_ids required')
+        # first key is the primary, other keys are used to decrypt.  If
+        # keys are replicas (eg restored into other regions' Key Vaults)
+        # they are also used for encrypt if faster and unwrap failover
+        self.key_ids = key_ids
         self.key_id = key_ids[0]
-        self.crypto_client = CryptographyClient(
-            self.key_id, self.config.get(
-                'credential', DefaultAzureCredential()
-            )
+        self.key_replicas = get_key_replicas(self.config)
+        self.key_selector = get_key_selector(self.key_ids, self.config)
+        self.credential = self.config.get(
+            'credential', DefaultAzureCredential()
         )
+        self.crypto_client = CryptographyClient(self.key_id, self.credential)
+        self.crypto_clients: t.Dict[str, CryptographyClient] = {}
         self.pack_bytes_maxlen = self.config.get(
             'pack_bytes_maxlen', 10000
         )
+        self.envelope_version = self.config.get('envelope_version', 1)
+        self.max_workers = get_max_workers(self.config)
+        self.dek_cache = get_dek_cache(self.config)
+        self.dek_mode = get_dek_mode(self.config)
+        self.dek_reuse = get_dek_reuse(self.config)
+
+        # wrap DEKs locally with the CMK public key, which is fetched from
+        # Key Vault and refreshed every public_key_max_age seconds so that
+        # a rotated (versionless) key_id picks up the latest key version
+        self.local_wrap = self.config.get('local_wrap', True) is not False
+        self.public_key_max_age = self.config.get('public_key_max_age', 3600)
+        self.public_keys: t.Dict[str, t.Tuple[str, t.Any, float]] = {}
+        self.public_key_lock = threading.Lock()
 
     @kms_ex_handler()
     def encrypt(
@@ -74,52 +151,223 @@ class Kms(KmsBase):
         # and the wrapped/encrypted AES key lives with the data
         # see https://developers.google.com/tink/client-side-encryption
         # https://docs.aws.amazon.com/encryption-sdk/latest/developer-guide/concepts.html  # noqa
-        context = dict(sorted(context.items()))
-        aad = json.dumps(context).encode()
 
         # 1) generate random Data Encryption Key (DEK)
-        # 256-bit AES-GCM key with 96-bit nonce
-        nonce = os.urandom(96)
-        dek = key or AESGCM.generate_key(bit_length=256)
-        dek_aesgcm = AESGCM(dek)
-
+        # 256-bit AES-GCM key (or reuse one if dek_mode is cached)
         # 2) The DEK is encrypted by a Key Encryption Key (KEK)
         # that is stored in a cloud KMS (Azure Key Vault CMK)
-        enc_dek = self.crypto_client.wrap_key(
-            KeyWrapAlgorithm.rsa_oaep_256, dek
-        ).encrypted_key
-        del dek  # delete unencrypted DEK from memory asap
+        ((dek, (enc_dek, kid)),) = self.wrap_deks([context], key)
 
-        # 3) Data is encrypted using the DEK by the client.
-        ct = dek_aesgcm.encrypt(nonce, plaintext.encode(), aad)
-        del dek_aesgcm
+        # 3) & 4) encrypt data locally using the DEK
+        return self.encrypt_local(plaintext, context, dek, enc_dek, kid)
 
-        # 4) Concatenates the KEK-encrypted encryption DEK with the encrypted
-        # data (byte packing is what aws-encryption-sdk and google tink do)
-        serialized = b64encode(
-            pack_bytes([ct, nonce, enc_dek], self.pack_bytes_maxlen)
-        ).decode()
-        return serialized
+    @kms_ex_handler()
+    def encrypt_many(
+        self,
+        plaintexts: t.List[str],
+        contexts: t.List[t.Dict],
+        key: t.Optional[bytes] = None
+    ) -> t.List[str]:
+        # wrap each distinct DEK with the CMK concurrently (remote if
+        # local_wrap disabled) then AES-GCM encrypt each plaintext locally
+        return [
+            self.encrypt_local(plaintext, context, dek, *wrapped)
+            for (plaintext, context, (dek, wrapped)) in zip(
+                plaintexts, contexts, self.wrap_deks(contexts, key)
+            )
+        ]
+
+    def wrap_deks(
+        self, contexts: t.List[t.Dict], key: t.Optional[bytes] = None
+    ) -> t.List[t.Tuple[bytes, t.Tuple[bytes, t.Optional[str]]]]:
+        # DEK and (wrapped DEK, kid) per value as per dek_mode
+        return wrap_deks(
+            contexts, key, self.dek_mode, self.dek_reuse,
+            lambda: AESGCM.generate_key(bit_length=256),
+            self.wrap_key, self.max_workers
+        )
 
     @kms_ex_handler()
     def decrypt(self, serialized: str, context: t.Dict) -> str:
-        context = dict(sorted(context.items()))
-        aad = json.dumps(context).encode()
-
         # 1) Extracts the KEK-encrypted DEK key.
-        unpacked = unpack_bytes(b64decode(serialized.encode()))
-        if len(unpacked) != 3:
-            raise ValueError('invalid serialization')
-        (ct, nonce, enc_dek) = unpacked
+        (ct, nonce, enc_dek, kid) = self.unpack(serialized)
 
         # 2) Makes a request to your KMS to decrypt the KEK-encrypted DEK.
-        # decrypt the key using Azure Key Vault CMK
-        dek = self.crypto_client.unwrap_key(
-            KeyWrapAlgorithm.rsa_oaep_256, enc_dek
-        ).key
+        dek = self.unwrap_key(enc_dek, kid)
 
         # 3) Decrypts the ciphertext locally using the DEK.
+        return self.decrypt_local(ct, nonce, dek, context)
+
+    @kms_ex_handler()
+    def decrypt_many(
+        self,
+        serialized: t.List[str],
+        contexts: t.List[t.Dict]
+    ) -> t.List[str]:
+        # unwrap each distinct DEK concurrently (remote)
+        # then AES-GCM decrypt each ciphertext locally
+        unpacked = [self.unpack(_) for _ in serialized]
+        unique = list(dict.fromkeys((_[2], _[3]) for _ in unpacked))
+        deks = dict(zip(unique, map_concurrent(
+            self.unwrap_key, unique, self.max_workers
+        )))
+        return [
+            self.decrypt_local(ct, nonce, deks[(enc_dek, kid)], context)
+            for ((ct, nonce, enc_dek, kid), context) in zip(unpacked, contexts)
+        ]
+
+    def get_public_key(
+        self, key_id: t.Optional[str] = None
+    ) -> t.Optional[t.Tuple[str, t.Any]]:
+        # get cached CMK public key and its versioned kid, fetching it
+        # from Key Vault if not cached or older than public_key_max_age
+        key_id = key_id or self.key_id
+        with self.public_key_lock:
+            now = time.monotonic()
+            cached = self.public_keys.get(key_id)
+            if (
+                cached is not None
+                and now - cached[2] < self.public_key_max_age
+            ):
+                return (cached[0], cached[1])
+            try:
+                kvid = KeyVaultKeyIdentifier(key_id)
+                key = KeyClient(kvid.vault_url, self.credential).get_key(
+                    kvid.name, kvid.version
+                )
+            except azex.HttpResponseError as e:
+                # fall back to remote wrap if no keys/get permission
+                if e.status_code == 403:
+                    logging.warning(
+                        'kms azure: no keys/get permission, using remote wrap'
+                    )
+                    self.local_wrap = False
+                    return None
+                # keep using previous key if refresh fails
+                if cached is not None:
+                    return (cached[0], cached[1])
+                raise
+            public_key = rsa.RSAPublicNumbers(
+                int.from_bytes(key.key.e, 'big'),  # type: ignore
+                int.from_bytes(key.key.n, 'big')  # type: ignore
+            ).public_key()
+            self.public_keys[key_id] = (key.id, public_key, now)
+            return (key.id, public_key)
+
+    def get_crypto_client(self, kid: t.Optional[str] = None):
+        # unwrap needs the key version that wrapped the DEK
+        if kid is None or kid == self.key_id:
+            return self.crypto_client
+        if kid not in self.crypto_clients:
+            self.crypto_clients[kid] = CryptographyClient(
+                kid, self.credential
+            )
+        return self.crypto_clients[kid]
+
+    def wrap_key(self, dek: bytes) -> t.Tuple[bytes, t.Optional[str]]:
+        # wrap with the primary key, or the fastest healthy replica
+        if not self.key_replicas:
+            return self._wrap_key(dek, self.key_id)
+        return self.key_selector.call(
+            lambda key_id: self._wrap_key(dek, key_id)
+        )
+
+    def _wrap_key(
+        self, dek: bytes, key_id: str
+    ) -> t.Tuple[bytes, t.Optional[str]]:
+        # wrap the key locally with the CMK RSA public key (RSA-OAEP-256)
+        public_key = self.get_public_key(key_id) if self.local_wrap else None
+        if public_key is not None:
+            (kid, key) = public_key
+            return (
+                key.encrypt(dek, padding.OAEP(
+                    mgf=padding.MGF1(algorithm=hashes.SHA256()),
+                    algorithm=hashes.SHA256(),
+                    label=None
+                )),
+                kid
+            )
+        resp = self.get_crypto_client(key_id).wrap_key(
+            KeyWrapAlgorithm.rsa_oaep_256, dek
+        )
+        return (resp.encrypted_key, resp.key_id)
+
+    def unwrap_key(self, enc_dek: bytes, kid: t.Optional[str] = None) -> bytes:
+        # decrypt the key using Azure Key Vault CMK
+        dek = self.dek_cache.get(enc_dek) if self.dek_cache else None
+        if dek is None:
+            # use the key version that wrapped the DEK, failing over to
+            # the other keys if replicas.  A key that didn't wrap the DEK
+            # (400) doesn't count against its health
+            def _unwrap(key_id):
+                return self.get_crypto_client(key_id).unwrap_key(
+                    KeyWrapAlgorithm.rsa_oaep_256, enc_dek
+                ).key
+
+            dek = self.key_selector.call(
+                _unwrap,
+                is_error=lambda e: not (
+                    isinstance(e, azex.HttpResponseError)
+                    and e.status_code == 400
+                ),
+                preferred=kid or self.key_id
+            ) if self.key_replicas else _unwrap(kid or self.key_id)
+            if self.dek_cache:
+                self.dek_cache.put(enc_dek, dek)
+        return dek
+
+    def encrypt_local(
+        self,
+        plaintext: str,
+        context: t.Dict,
+        dek: bytes,
+        enc_dek: bytes,
+        kid: t.Optional[str] = None
+    ) -> str:
+        context = dict(sorted(context.items()))
+        aad = json.dumps(context).encode()
+
+        # Data is encrypted using the DEK by the client.
+        # 256-bit AES-GCM key with 96-bit nonce (v2 envelope) or
+        # 96 byte nonce (v1 envelope)
+        v2 = self.envelope_version == ENVELOPE_V2
+        nonce = os.urandom(NONCE_LEN if v2 else 96)
+        dek_aesgcm = AESGCM(dek)
+        ct = dek_aesgcm.encrypt(nonce, plaintext.encode(), aad)
+        del dek_aesgcm
+
+        # Concatenates the KEK-encrypted encryption DEK with the encrypted
+        # data (byte packing is what aws-encryption-sdk and google tink do)
+        # and the key version used to wrap the DEK if it differs from key_id
+        # (eg key_id is versionless) so it can be unwrapped after rotation
+        _kid = kid.encode() if kid is not None and kid != self.key_id else None
+        if v2:
+            return b64encode(pack_envelope(ct, nonce, enc_dek, _kid)).decode()
+        packed = [ct, nonce, enc_dek]
+        if _kid is not None:
+            packed.append(_kid)
+        return b64encode(
+            pack_bytes(packed, self.pack_bytes_maxlen)
+        ).decode()
+
+    def unpack(
+        self, serialized: str
+    ) -> t.Tuple[bytes, bytes, bytes, t.Optional[str]]:
+        packed = b64decode(serialized.encode())
+        if packed[:1] == bytes([ENVELOPE_V2]):
+            (ct, nonce, enc_dek, kid) = unpack_envelope(packed)
+            return (ct, nonce, enc_dek, kid.decode() if kid else None)
+        unpacked = unpack_bytes(packed)
+        if len(unpacked) not in [3, 4]:
+            raise ValueError('invalid serialization')
+        _kid = unpacked[3].decode() if len(unpacked) == 4 else None
+        return (unpacked[0], unpacked[1], unpacked[2], _kid)
+
+    def decrypt_local(
+        self, ct: bytes, nonce: bytes, dek: bytes, context: t.Dict
+    ) -> str:
+        context = dict(sorted(context.items()))
+        aad = json.dumps(context).encode()
         dek_aesgcm = AESGCM(dek)
         del dek
-        plaintext = dek_aesgcm.decrypt(nonce, ct, aad).decode()
-        return plaintext
+        return dek_aesgcm.decrypt(nonce, ct, aad).decode()
@@ -6,11 +6,14 @@ import os
 import typing as t
 
 import abnosql.exceptions as ex
+from abnosql.kms import get_key_replicas
+from abnosql.kms import get_key_selector
 from abnosql.kms import get_keys
 from abnosql.kms import KmsBase
 from abnosql.plugin import PM
 
 try:
+    from google.api_core import exceptions as gexceptions  # type: ignore
     from tink import aead  # type: ignore
     from tink import core  # type: ignore
     from tink.integration import gcpkms  # type: ignore
@@ -33,6 +36,18 @@ def kms_ex_handler(raise_not_found: t.Optional[bool] = True):
     return decorator
 
 
+def is_key_error(e: Exception) -> bool:
+    # decrypt failed because the key didn't encrypt the data (Cloud KMS
+    # InvalidArgument or the envelope AEAD failing), rather than the key
+    # being unavailable, so it doesn't count against the key's health
+    if not isinstance(e, core.TinkError):
+        return False
+    cause = e.args[0] if len(e.args) else None
+    return not isinstance(cause, gexceptions.GoogleAPIError) or isinstance(
+        cause, gexceptions.InvalidArgument
+    )
+
+
 def mock_remote_aead(*args, **kwargs):
     # used for patching during tests
     # see https://github.com/tink-crypto/tink-py/blob/main/tink/aead/_kms_envelope_aead_test.py  # noqa
@@ -54,6 +69,8 @@ class Kms(KmsBase):
         if not isinstance(self.key_ids, list) or len(self.key_ids) == 0:
             raise ex.ConfigException('kms key_ids required')
         self.kek_uri = self.key_ids[0]
+        self.key_replicas = get_key_replicas(self.config)
+        self.key_selector = get_key_selector(self.key_ids, self.config)
         self.credentials = self.config.get(
             'credentials', os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
         )
@@ -63,23 +80,42 @@ class Kms(KmsBase):
             self.kek_uri,
             self.credentials
         )
-        remote_aead = self.client.get_aead(self.kek_uri)
-        self.env_aead = aead.KmsEnvelopeAead(
-            aead.aead_key_templates.AES256_GCM, remote_aead
-        )
+        # one envelope AEAD per key (eg per location).  Encrypt uses the
+        # first key, or the fastest healthy key if keys are replicas
+        self.env_aeads = {}
+        for key_id in self.key_ids:
+            client = self.client if key_id == self.kek_uri else (
+                gcpkms.GcpKmsClient(key_id, self.credentials)
+            )
+            self.env_aeads[key_id] = aead.KmsEnvelopeAead(
+                aead.aead_key_templates.AES256_GCM, client.get_aead(key_id)
+            )
+        self.env_aead = self.env_aeads[self.kek_uri]
 
     @kms_ex_handler()
     def encrypt(
         self, plaintext: str, context: t.Dict, key: t.Optional[bytes] = None
     ) -> str:
-        ciphertext = self.env_aead.encrypt(
-            plaintext.encode(), json.dumps(context).encode()
+        def _encrypt(key_id):
+            return self.env_aeads[key_id].encrypt(
+                plaintext.encode(), json.dumps(context).encode()
+            )
+
+        ciphertext = (
+            self.key_selector.call(_encrypt) if self.key_replicas
+            else _encrypt(self.kek_uri)
         )
         return b64encode(ciphertext).decode()
 
     @kms_ex_handler()
     def decrypt(self, serialized: str, context: t.Dict) -> str:
-        plaintext = self.env_aead.decrypt(
-            b64decode(serialized), json.dumps(context).encode()
+        # ciphertext doesn't identify the key, so try the first key (which
+        # encrypts unless keys are replicas) then the other keys
+        plaintext = self.key_selector.call(
+            lambda key_id: self.env_aeads[key_id].decrypt(
+                b64decode(serialized), json.dumps(context).encode()
+            ),
+            is_error=lambda e: not is_key_error(e),
+            preferred=None if self.key_replicas else self.kek_uri
         )
         return plaintext.decode()
@@ -0,0 +1,208 @@
+from base64 import b64decode
+from base64 import b64encode
+import functools
+import json
+import os
+import time
+import typing as t
+
+import abnosql.exceptions as ex
+from abnosql.kms import get_dek_cache
+from abnosql.kms import get_dek_mode
+from abnosql.kms import get_dek_reuse
+from abnosql.kms import get_keys
+from abnosql.kms import get_max_workers
+from abnosql.kms import KmsBase
+from abnosql.kms import map_concurrent
+from abnosql.kms import pack_bytes
+from abnosql.kms import unpack_bytes
+from abnosql.kms import wrap_deks
+from abnosql.plugin import PM
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:
+    MISSING_DEPS = True
+
+NONCE_LEN = 12
+
+
+def kms_ex_handler(raise_not_found: t.Optional[bool] = True):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            except FileNotFoundError as e:
+                raise ex.ConfigException(detail=str(e)) from None
+            except InvalidTag:
+                raise ex.PluginException(
+                    detail='decryption failed'
+                ) from None
+            except ex.NoSQLException:
+                raise
+            except Exception as e:
+                raise ex.PluginException(detail=e)
+        return wrapper
+    return decorator
+
+
+def key_path(key_id: str) -> str:
+    # key id is path to key file, optionally file:// URL
+    return key_id[7:] if key_id.startswith('file://') else key_id
+
+
+def create_key(key_id: str) -> bytes:
+    """Create local keyring key file containing base64 256-bit AES key
+
+    Args:
+
+        key_id: key file path or file:// URL
+
+    Returns:
+
+        key bytes
+
+    """
+    key = AESGCM.generate_key(bit_length=256)
+    fd = os.open(key_path(key_id), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(b64encode(key).decode())
+    return key
+
+
+def load_key(key_id: str) -> bytes:
+    with open(key_path(key_id), 'r') as f:
+        key = b64decode(f.read().strip())
+    if len(key) not in [16, 24, 32]:
+        raise ex.ConfigException(f'invalid AES key in {key_id}')
+    return key
+
+
+class Kms(KmsBase):
+    """Local keyring provider using AES keys held in files
+
+    For testing and benchmarking the encryption pipeline without a cloud
+    KMS.  Data keys (DEKs) are AES-GCM wrapped with the first key (the
+    KEK), other keys are tried on unwrap (eg after rotation).  Values use
+    the same pack_bytes envelope as the azure provider.  Optional `latency`
+    config (seconds) is added to each wrap/unwrap to model a remote KMS.
+    """
+
+    @kms_ex_handler()
+    def __init__(
+        self, pm: PM, config: t.Optional[dict] = None
+    ) -> None:
+        self.pm = pm
+        self.config = config or {}
+        self.provider = 'local'
+        key_ids = self.config.get('key_ids', get_keys())
+        if not isinstance(key_ids, list) or len(key_ids) == 0:
+            raise ex.ConfigException('kms key_ids required')
+        self.key_ids = key_ids
+        self.key_id = key_ids[0]
+        self.keys = {key_id: load_key(key_id) for key_id in key_ids}
+        self.latency = self.config.get('latency', 0)
+        self.pack_bytes_maxlen = self.config.get(
+            'pack_bytes_maxlen', 10000
+        )
+        self.max_workers = get_max_workers(self.config)
+        self.dek_cache = get_dek_cache(self.config)
+        self.dek_mode = get_dek_mode(self.config)
+        self.dek_reuse = get_dek_reuse(self.config)
+
+    @kms_ex_handler()
+    def encrypt(
+        self, plaintext: str, context: t.Dict, key: t.Optional[bytes] = None
+    ) -> str:
+        return self.encrypt_many([plaintext], [context], key)[0]
+
+    @kms_ex_handler()
+    def encrypt_many(
+        self,
+        plaintexts: t.List[str],
+        contexts: t.List[t.Dict],
+        key: t.Optional[bytes] = None
+    ) -> t.List[str]:
+        deks = wrap_deks(
+            contexts, key, self.dek_mode, self.dek_reuse,
+            lambda: AESGCM.generate_key(bit_length=256),
+            self.wrap_key, self.max_workers
+        )
+        return [
+            self.encrypt_local(plaintext, context, dek, enc_dek)
+            for (plaintext, context, (dek, enc_dek)) in zip(
+                plaintexts, contexts, deks
+            )
+        ]
+
+    @kms_ex_handler()
+    def decrypt(self, serialized: str, context: t.Dict) -> str:
+        return self.decrypt_many([serialized], [context])[0]
+
+    @kms_ex_handler()
+    def decrypt_many(
+        self,
+        serialized: t.List[str],
+        contexts: t.List[t.Dict]
+    ) -> t.List[str]:
+        # unwrap each distinct DEK then AES-GCM decrypt each ciphertext
+        unpacked = [self.unpack(_) for _ in serialized]
+        unique = list(dict.fromkeys(_[2] for _ in unpacked))
+        deks = dict(zip(unique, map_concurrent(
+            self.unwrap_key, [(_,) for _ in unique], self.max_workers
+        )))
+        return [
+            self.decrypt_local(ct, nonce, deks[enc_dek], context)
+            for ((ct, nonce, enc_dek), context) in zip(unpacked, contexts)
+        ]
+
+    def wrap_key(self, dek: bytes) -> bytes:
+        if self.latency:
+            time.sleep(self.latency)
+        nonce = os.urandom(NONCE_LEN)
+        return nonce + AESGCM(self.keys[self.key_id]).encrypt(nonce, dek, None)
+
+    def unwrap_key(self, enc_dek: bytes) -> bytes:
+        dek = self.dek_cache.get(enc_dek) if self.dek_cache else None
+        if dek is None:
+            if self.latency:
+                time.sleep(self.latency)
+            dek = self._unwrap_key(enc_dek)
+            if self.dek_cache:
+                self.dek_cache.put(enc_dek, dek)
+        return dek
+
+    def _unwrap_key(self, enc_dek: bytes) -> bytes:
+        # the GCM tag identifies the key, so try each key in turn
+        for key_id in self.key_ids:
+            try:
+                return AESGCM(self.keys[key_id]).decrypt(
+                    enc_dek[:NONCE_LEN], enc_dek[NONCE_LEN:], None
+                )
+            except InvalidTag:
+                continue
+        raise ex.PluginException(detail='no key in key_ids can unwrap DEK')
+
+    def encrypt_local(
+        self, plaintext: str, context: t.Dict, dek: bytes, enc_dek: bytes
+    ) -> str:
+        aad = json.dumps(dict(sorted(context.items()))).encode()
+        nonce = os.urandom(NONCE_LEN)
+        ct = AESGCM(dek).encrypt(nonce, plaintext.encode(), aad)
+        return b64encode(
+            pack_bytes([ct, nonce, enc_dek], self.pack_bytes_maxlen)
+        ).decode()
+
+    def unpack(self, serialized: str) -> t.Tuple[bytes, bytes, bytes]:
+        unpacked = unpack_bytes(b64decode(serialized.encode()))
+        if len(unpacked) != 3:
+            raise ValueError('invalid serialization')
+        return (unpacked[0], unpacked[1], unpacked[2])
+
+    def decrypt_local(
+        self, ct: bytes, nonce: bytes, dek: bytes, context: t.Dict
+    ) -> str:
+        aad = json.dumps(dict(sorted(context.items()))).encode()
+        return AESGCM(dek).decrypt(nonce, ct, aad).decode()
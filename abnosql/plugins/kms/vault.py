@@ -0,0 +1,231 @@
+from base64 import b64decode
+from base64 import b64encode
+import functools
+import json
+import os
+import struct
+import typing as t
+from urllib.parse import urlparse
+
+import abnosql.exceptions as ex
+from abnosql.kms import get_key_selector
+from abnosql.kms import get_keys
+from abnosql.kms import get_max_workers
+from abnosql.kms import KmsBase
+from abnosql.kms import map_concurrent
+from abnosql.plugin import PM
+
+try:
+    import requests  # type: ignore
+except ImportError:
+    MISSING_DEPS = True
+
+
+def kms_ex_handler(raise_not_found: t.Optional[bool] = True):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            except requests.HTTPError as e:
+                code = e.response.status_code
+                detail = e.response.text
+                if raise_not_found and code == 404:
+                    raise ex.NotFoundException(detail=detail) from None
+                elif code in [401, 403]:
+                    raise ex.ConfigException(detail=detail) from None
+                raise ex.PluginException(detail=detail) from None
+            except ex.NoSQLException:
+                raise
+            except Exception as e:
+                raise ex.PluginException(detail=e)
+        return wrapper
+    return decorator
+
+
+def parse_key_id(key_id: str) -> t.Tuple[t.Optional[str], str, str]:
+    # key id is either key name, eg 'mykey' or URL to transit key, eg
+    # https://vault.example.com:8200/v1/transit/keys/mykey
+    if not key_id.startswith('http'):
+        return (None, 'transit', key_id)
+    parsed = urlparse(key_id)
+    parts = [_ for _ in parsed.path.split('/') if _ != '']
+    if len(parts) < 4 or parts[0] != 'v1' or parts[-2] != 'keys':
+        raise ex.ConfigException(f'invalid vault key id: {key_id}')
+    return (
+        f'{parsed.scheme}://{parsed.netloc}',
+        '/'.join(parts[1:-2]),
+        parts[-1]
+    )
+
+
+def serialize(ciphertext: str) -> str:
+    # vault:v1:<base64> to base64 packed key version + raw ciphertext
+    # so serialized value is base64 like the other providers
+    parts = ciphertext.split(':')
+    if len(parts) != 3 or parts[0] != 'vault' or parts[1][:1] != 'v':
+        raise ValueError('invalid vault ciphertext')
+    return b64encode(
+        struct.pack('>I', int(parts[1][1:])) + b64decode(parts[2])
+    ).decode()
+
+
+def deserialize(serialized: str) -> str:
+    packed = b64decode(serialized.encode())
+    if len(packed) <= 4:
+        raise ValueError('invalid serialization')
+    version = struct.unpack('>I', packed[:4])[0]
+    return f'vault:v{version}:' + b64encode(packed[4:]).decode()
+
+
+class Kms(KmsBase):
+
+    @kms_ex_handler()
+    def __init__(
+        self, pm: PM, config: t.Optional[dict] = None
+    ) -> None:
+        self.pm = pm
+        self.config = config or {}
+        self.provider = 'vault'
+        key_ids = self.config.get('key_ids', get_keys())
+        if not isinstance(key_ids, list) or len(key_ids) == 0:
+            raise ex.ConfigException('kms key_ids required')
+        # key ids after the first are replicas of the key (eg performance
+        # replica clusters in other regions), the fastest healthy one is
+        # used with failover to the others
+        self.keys = {}
+        for key_id in key_ids:
+            (addr, mount, key_name) = parse_key_id(key_id)
+            self.keys[key_id] = (
+                (
+                    addr
+                    or self.config.get('addr')
+                    or os.environ.get('VAULT_ADDR', 'http://127.0.0.1:8200')
+                ).rstrip('/'),
+                self.config.get('mount', mount),
+                key_name
+            )
+        (self.addr, self.mount, self.key_name) = self.keys[key_ids[0]]
+        self.key_selector = get_key_selector(key_ids, self.config)
+        self.token = self.config.get('token', os.environ.get('VAULT_TOKEN'))
+        if not self.token:
+            raise ex.ConfigException('kms vault token required')
+        self.namespace = self.config.get(
+            'namespace', os.environ.get('VAULT_NAMESPACE')
+        )
+        # keys created with derived=true use context for key derivation,
+        # otherwise context is bound by prefixing it to the plaintext
+        self.derived = self.config.get('derived', False) is True
+        self.batch_size = self.config.get('batch_size', 250)
+        self.max_workers = get_max_workers(self.config)
+        self.session = self.config.get('vault_session', requests.Session())
+
+    def _post(
+        self, operation: str, batch_input: t.List[t.Dict], key_id: str
+    ) -> t.List:
+        (addr, mount, key_name) = self.keys[key_id]
+        headers = {'X-Vault-Token': self.token}
+        if self.namespace:
+            headers['X-Vault-Namespace'] = self.namespace
+        resp = self.session.post(
+            f'{addr}/v1/{mount}/{operation}/{key_name}',
+            json={'batch_input': batch_input},
+            headers=headers,
+            timeout=self.config.get('timeout', 30)
+        )
+        resp.raise_for_status()
+        results = resp.json()['data']['batch_results']
+        errors = [_['error'] for _ in results if _.get('error')]
+        if len(errors):
+            raise ex.PluginException(detail='; '.join(errors))
+        return results
+
+    def _batches(self, batch_input: t.List[t.Dict], operation: str) -> t.List:
+        # one request per batch_size items, batches run concurrently
+        batches = [
+            (operation, batch_input[i:i + self.batch_size])
+            for i in range(0, len(batch_input), self.batch_size)
+        ]
+        results = []
+        for result in map_concurrent(self._call, batches, self.max_workers):
+            results.extend(result)
+        return results
+
+    def _call(self, operation: str, batch_input: t.List[t.Dict]) -> t.List:
+        # only server and connection errors count against replica health
+        return self.key_selector.call(
+            lambda key_id: self._post(operation, batch_input, key_id),
+            is_error=lambda e: not isinstance(e, ex.NoSQLException) and not (
+                isinstance(e, requests.HTTPError)
+                and getattr(e.response, 'status_code', 500) < 500
+            )
+        )
+
+    def _context(self, context: t.Dict) -> str:
+        return json.dumps(dict(sorted(context.items())))
+
+    @kms_ex_handler()
+    def encrypt(
+        self, plaintext: str, context: t.Dict, key: t.Optional[bytes] = None
+    ) -> str:
+        return self.encrypt_many([plaintext], [context], key)[0]
+
+    @kms_ex_handler()
+    def encrypt_many(
+        self,
+        plaintexts: t.List[str],
+        contexts: t.List[t.Dict],
+        key: t.Optional[bytes] = None
+    ) -> t.List[str]:
+        # key (data key) is ignored as vault transit encrypts with the
+        # named key, so no envelope data key is generated client side
+        batch_input = []
+        for plaintext, context in zip(plaintexts, contexts):
+            _context = self._context(context)
+            _input = {}
+            if self.derived:
+                _input['context'] = b64encode(_context.encode()).decode()
+            else:
+                plaintext = json.dumps([_context, plaintext])
+            _input['plaintext'] = b64encode(plaintext.encode()).decode()
+            batch_input.append(_input)
+        if len(batch_input) == 0:
+            return []
+        return [
+            serialize(_['ciphertext'])
+            for _ in self._batches(batch_input, 'encrypt')
+        ]
+
+    @kms_ex_handler()
+    def decrypt(self, serialized: str, context: t.Dict) -> str:
+        return self.decrypt_many([serialized], [context])[0]
+
+    @kms_ex_handler()
+    def decrypt_many(
+        self,
+        serialized: t.List[str],
+        contexts: t.List[t.Dict]
+    ) -> t.List[str]:
+        batch_input = []
+        for _serialized, context in zip(serialized, contexts):
+            _input = {'ciphertext': deserialize(_serialized)}
+            if self.derived:
+                _input['context'] = b64encode(
+                    self._context(context).encode()
+                ).decode()
+            batch_input.append(_input)
+        if len(batch_input) == 0:
+            return []
+        plaintexts = []
+        for result, context in zip(
+            self._batches(batch_input, 'decrypt'), contexts
+        ):
+            plaintext = b64decode(result['plaintext']).decode()
+            if not self.derived:
+                (_context, plaintext) = json.loads(plaintext)
+                if _context != self._context(context):
+                    raise ex.PluginException(
+                        detail='encryption context mismatch'
+                    )
+            plaintexts.append(plaintext)
+        return plaintexts
@@ -1,6 +1,10 @@
+from base64 import b64decode
+from base64 import b64encode
 import functools
+import json
 import logging
 import os
+import re
 import time
 
 import typing as t
@@ -10,24 +14,48 @@ import pluggy  # type: ignore
 import abnosql.exceptions as ex
 from abnosql.plugin import PM
 from abnosql.table import add_change_meta
+from abnosql.table import apply_update
 from abnosql.table import check_exists_enabled
 from abnosql.table import delete_item_post
 from abnosql.table import delete_item_pre
+from abnosql.table import get_consistency
 from abnosql.table import get_item_post
 from abnosql.table import get_item_pre
-from abnosql.table import get_key_attrs
+from abnosql.table import get_items_post
+from abnosql.table import get_items_pre
+from abnosql.table import get_projection
+from abnosql.table import get_query_condition
+from abnosql.table import get_sql_condition
 from abnosql.table import get_sql_params
+from abnosql.table import get_sql_select
+from abnosql.table import get_table_key_attrs
+from abnosql.table import get_write_returns
+from abnosql.table import kms_blind_index_filters
+from abnosql.table import kms_blind_index_sql
 from abnosql.table import kms_process_query_items
+from abnosql.table import kms_query_projection
+from abnosql.table import match_condition
 from abnosql.table import parse_connstr
+from abnosql.table import project_item
 from abnosql.table import put_item_post
 from abnosql.table import put_item_pre
+from abnosql.table import put_items_post
+from abnosql.table import put_items_pre
+from abnosql.table import query_sql_concurrent
 from abnosql.table import TableBase
+from abnosql.table import transact_write_post
+from abnosql.table import transact_write_pre
+from abnosql.table import unflatten_sql_item
+from abnosql.table import update_item_post
+from abnosql.table import update_item_pre
 from abnosql.table import validate_query_attrs
 
 hookimpl = pluggy.HookimplMarker('abnosql.table')
 
 try:
+    from azure.core import MatchConditions  # type: ignore
     from azure.cosmos import CosmosClient  # type: ignore
+    from azure.cosmos.exceptions import CosmosBatchOperationError  # type: ignore # noqa
     from azure.cosmos.exceptions import CosmosHttpResponseError  # type: ignore
     from azure.cosmos.exceptions import CosmosResourceNotFoundError  # type: ignore # noqa
     from azure.identity import DefaultAzureCredential  # type: ignore
@@ -111,6 +139,127 @@ def get_key_kwargs(**kwargs):
     return kwargs
 
 
+def get_patch_operations(
+    operations: t.List[t.Tuple[str, str, t.Any]],
+    item: t.Optional[t.Dict] = None
+) -> t.List[t.Dict]:
+    """Get patch operations for update_item_pre() operations
+
+    Patch has no if not exists, so set_if_not_exists is only included
+    if the current item is given (and the attribute is missing from it),
+    likewise with item, missing lists are created before appending to
+    them and removing missing attributes is skipped (both of which are
+    otherwise bad requests)
+
+    Args:
+
+        operations: list of (attribute, operator, value)
+        item: optional current item
+
+    Returns:
+
+        list of patch operation dicts
+
+    """
+    patches = []
+    for (k, op, val) in operations:
+        if op == 'set' or (
+            op == 'set_if_not_exists' and item is not None and k not in item
+        ):
+            patches.append({'op': 'set', 'path': f'/{k}', 'value': val})
+        elif op == 'increment':
+            patches.append({'op': 'incr', 'path': f'/{k}', 'value': val})
+        elif op == 'append':
+            if item is not None and k not in item:
+                patches.append({'op': 'set', 'path': f'/{k}', 'value': []})
+            patches.extend([
+                {'op': 'add', 'path': f'/{k}/-', 'value': v}
+                for v in val
+            ])
+        elif op == 'remove' and (item is None or k in item):
+            patches.append({'op': 'remove', 'path': f'/{k}'})
+    return patches
+
+
+# cross partition queries that need results merged across partitions
+# (global order, groups, distinct values or aggregates) so can't be paged
+# one feed range at a time.  Keywords not part of paths or strings
+MERGED_QUERY_PAT = re.compile(
+    r'(?<![\w.\]"\'])(ORDER\s+BY|GROUP\s+BY|(COUNT|SUM|MIN|MAX|AVG)\s*\()'
+    r'|\bSELECT\s+(DISTINCT\b|(DISTINCT\s+)?TOP\s)',
+    re.I
+)
+PAGINATION_MODES = ['continuation', 'offset']
+
+
+def get_pagination(config: t.Dict) -> str:
+    # query pagination, from cosmos_pagination config or env var
+    pagination = config.get(
+        'cosmos_pagination',
+        os.environ.get('ABNOSQL_COSMOS_PAGINATION', 'continuation')
+    )
+    if pagination not in PAGINATION_MODES:
+        raise ex.ValidationException(
+            f'invalid cosmos_pagination: {pagination}, must be one of: '
+            + ', '.join(PAGINATION_MODES)
+        )
+    return pagination
+
+
+# cosmos consistency levels, weakest first, and their header values
+ACCOUNT_CONSISTENCY_LEVELS = {
+    'eventual': 'Eventual',
+    'consistent_prefix': 'ConsistentPrefix',
+    'session': 'Session',
+    'bounded_staleness': 'BoundedStaleness',
+    'strong': 'Strong'
+}
+
+
+def get_account_consistency(config: t.Dict) -> str:
+    # account default consistency, from cosmos_account_consistency config
+    # or env var, defaults to session (the cosmos account default)
+    consistency = config.get(
+        'cosmos_account_consistency',
+        os.environ.get('ABNOSQL_COSMOS_ACCOUNT_CONSISTENCY', 'session')
+    )
+    if consistency not in ACCOUNT_CONSISTENCY_LEVELS:
+        raise ex.ValidationException(
+            f'invalid cosmos_account_consistency: {consistency}, must be '
+            + 'one of: ' + ', '.join(ACCOUNT_CONSISTENCY_LEVELS)
+        )
+    return consistency
+
+
+def get_sql_partition_key(
+    attr: str, statement: str, parameters: t.Dict[str, t.Any]
+) -> t.Optional[t.Any]:
+    # partition key value if the statement has an equality condition on
+    # the partition key attribute of the FROM alias (or bare attribute)
+    # with a parameter, and no OR or NOT conditions
+    param = f'@{attr}'
+    if param not in parameters or re.search(
+        r'\b(OR|NOT)\b', statement, re.I
+    ):
+        return None
+    match = re.search(
+        r'\bFROM\s+(\w+)(?:\s+(?:AS\s+)?(?!(?:WHERE|JOIN|ORDER|GROUP|'
+        r'OFFSET)\b)(\w+))?',
+        statement,
+        re.I
+    )
+    if match is None:
+        return None
+    alias = match.group(2) or match.group(1)
+    if not re.search(
+        r'(?<![\w.\]])(?:' + re.escape(alias) + r'\.)?' + re.escape(attr)
+        + r'\s*=\s*' + re.escape(param) + r'(?!\w)',
+        statement
+    ):
+        return None
+    return parameters[param]
+
+
 def strip_cosmos_attrs(item):
     for attr in ['_rid', '_self', '_etag', '_attachments', '_ts']:
         item.pop(attr, None)
@@ -130,8 +279,13 @@ class Table(TableBase):
         self.database_client = DATABASE_CLIENT
         if os.environ.get('ABNOSQL_DISABLE_GLOBAL_CACHE', 'FALSE') == 'TRUE':
             self.database_client = None
-        self.key_attrs = get_key_attrs(self.config)
+        self.key_attrs = get_table_key_attrs(self)
         self.check_exists = check_exists_enabled(self.config)
+        # session token of the last write, for session consistency reads
+        self.session_token = None
+        # item ttl is seconds since last modified, if enabled on container
+        self.ttl_format = 'seconds'
+        self.ttl_attribute = 'ttl'
         # enabled by default
         self.change_meta = self.config.get(
             'cosmos_change_meta',
@@ -198,15 +352,48 @@ class Table(TableBase):
     def _container(self, name):
         return self._database_client().get_container_client(name)
 
+    def _read_kwargs(self, consistency: t.Optional[str]) -> t.Dict:
+        # per request consistency can only weaken the account default
+        # consistency (cosmos returns 400 otherwise), so only send the
+        # header for weaker levels.  Set via azure-core headers policy
+        # as query_items() doesn't accept consistency_level
+        if consistency is None:
+            return {}
+        kwargs: t.Dict[str, t.Any] = {}
+        levels = list(ACCOUNT_CONSISTENCY_LEVELS)
+        if levels.index(consistency) < levels.index(
+            get_account_consistency(self.config)
+        ):
+            kwargs['headers'] = {
+                'x-ms-consistency-level': ACCOUNT_CONSISTENCY_LEVELS[
+                    consistency
+                ]
+            }
+        if consistency == 'session' and self.session_token is not None:
+            kwargs['session_token'] = self.session_token
+        return kwargs
+
+    def _set_session_token(self, headers, *args):
+        # write response_hook, as the client's last response headers are
+        # shared with other containers and threads
+        if headers.get('x-ms-session-token'):
+            self.session_token = headers['x-ms-session-token']
+
     @cosmos_ex_handler()
     def get_item(self, **kwargs) -> t.Optional[t.Dict]:
+        attributes = kwargs.pop('attributes', None)
+        consistency = get_consistency(
+            self.config, kwargs.pop('consistency', None)
+        )
         audit_key, _check_exists = get_item_pre(self, dict(**kwargs))
+        get_projection(self, attributes)  # validate
 
         item = None
         try:
             item = strip_cosmos_attrs(
                 self._container(self.name).read_item(
-                    **get_key_kwargs(**kwargs)
+                    **get_key_kwargs(**kwargs),
+                    **self._read_kwargs(consistency)
                 )
             )
         except CosmosResourceNotFoundError:
@@ -215,19 +402,69 @@ class Table(TableBase):
             else:
                 raise ex.NotFoundException('item not found')
 
-        return get_item_post(self, dict(**kwargs), item, audit_key)
+        # point reads can't project so attributes are projected client side
+        return get_item_post(
+            self, dict(**kwargs), item, audit_key, attributes
+        )
+
+    @cosmos_ex_handler()
+    def get_items(
+        self,
+        keys: t.Iterable[t.Dict[str, t.Any]],
+        attributes: t.Optional[t.List[str]] = None,
+        consistency: t.Optional[str] = None
+    ) -> t.List[t.Optional[t.Dict]]:
+        keys = get_items_pre(self, keys)
+        get_projection(self, attributes)  # validate
+        read_kwargs = self._read_kwargs(
+            get_consistency(self.config, consistency)
+        )
+
+        container = self._container(self.name)
+        items = []
+        for key in keys:
+            try:
+                items.append(strip_cosmos_attrs(
+                    container.read_item(**get_key_kwargs(**key), **read_kwargs)
+                ))
+            except CosmosResourceNotFoundError:
+                items.append(None)
+
+        return get_items_post(self, keys, items, attributes)
 
     @cosmos_ex_handler()
     def put_item(
         self,
         item: t.Dict,
         update: t.Optional[bool] = False,
-        audit_user: t.Optional[str] = None
-    ) -> t.Dict:
+        audit_user: t.Optional[str] = None,
+        returns: t.Optional[str] = None
+    ) -> t.Optional[t.Dict]:
 
         # cosmos has to do create/update on delete but don't audit this
         abnosql_audit_callback = item.pop('abnosql_audit_callback', None)
-        item, key = put_item_pre(self, item, update, audit_user)
+        returns = get_write_returns(self.config, returns)
+        item, _ = put_item_pre(self, item, update, audit_user)
+        item = self._put_item(item, update, returns)
+        return put_item_post(
+            self, item, update, audit_user, abnosql_audit_callback, returns
+        )
+
+    def _put_item(
+        self,
+        item: t.Dict,
+        update: t.Optional[bool] = False,
+        returns: t.Optional[str] = None
+    ):
+        key = {k: item[k] for k in self.key_attrs}
+        container = self._container(self.name)
+        # minimal response (no document) unless the whole item is needed
+        written = None
+        kwargs: t.Dict[str, t.Any] = {
+            'response_hook': self._set_session_token
+        }
+        if returns in ['none', 'updated']:
+            (written, kwargs['no_response']) = (dict(item), True)
 
         # do update
         if update is True:
@@ -235,35 +472,109 @@ class Table(TableBase):
                 k: v for k, v in item.items()
                 if k not in self.key_attrs
             }
-            kwargs = {
+            kwargs.update({
                 'item': key[self.key_attrs[-1]],
                 'partition_key': key[self.key_attrs[0]],
                 'patch_operations': [
                     {'op': 'add', 'path': f'/{k}', 'value': v}
                     for k, v in update_item.items()
                 ]
-            }
-            item = self._container(self.name).patch_item(**kwargs)
+            })
+            item = container.patch_item(**kwargs)
         # do create/replace
         else:
-            item = self._container(self.name).upsert_item(item)
-        item = strip_cosmos_attrs(item)
-
-        return put_item_post(
-            self, item, update, audit_user, abnosql_audit_callback
-        )
+            item = container.upsert_item(item, **kwargs)
+        return strip_cosmos_attrs(written or item)
 
     @cosmos_ex_handler()
     def put_items(
         self,
         items: t.Iterable[t.Dict],
         update: t.Optional[bool] = False,
-        audit_user: t.Optional[str] = None
-    ):
+        audit_user: t.Optional[str] = None,
+        returns: t.Optional[str] = None
+    ) -> t.Optional[t.List[t.Dict]]:
         # TODO(batch)
-        for item in items:
-            self.put_item(item, update=update, audit_user=audit_user)
-        self.pm.hook.put_items_post(table=self.name, items=items)
+        returns = get_write_returns(self.config, returns)
+        items = list(items)
+        callbacks = [
+            item.pop('abnosql_audit_callback', None) for item in items
+        ]
+        _items = []
+        for item, abnosql_audit_callback in zip(
+            put_items_pre(self, items, update, audit_user), callbacks
+        ):
+            item = self._put_item(item, update, returns or 'none')
+            _items.append(put_item_post(
+                self, item, update, audit_user, abnosql_audit_callback
+            ))
+        return put_items_post(self, items, _items, returns)
+
+    @cosmos_ex_handler()
+    def update_item(
+        self,
+        key: t.Dict[str, t.Any],
+        updates: t.Dict[str, t.Any],
+        audit_user: t.Optional[str] = None
+    ) -> t.Dict:
+        key, operations = update_item_pre(self, key, updates, audit_user)
+        patches = get_patch_operations(operations)
+
+        # a single patch is atomic, but has max 10 operations, no if not
+        # exists and can't append to missing lists or remove missing
+        # attributes (bad requests), so those updates are instead a read
+        # and a single etag guarded replace
+        if len(patches) > 10 or any(
+            _[1] == 'set_if_not_exists' for _ in operations
+        ):
+            return update_item_post(
+                self, self._replace_item(key, operations), audit_user
+            )
+        try:
+            item = self._patch_item(key, patches)
+        except CosmosHttpResponseError as e:
+            # nothing was applied, so safe to replace instead
+            if e.status_code != 400:
+                raise
+            item = self._replace_item(key, operations)
+        return update_item_post(self, strip_cosmos_attrs(item), audit_user)
+
+    def _patch_item(
+        self, key: t.Dict[str, t.Any], patches: t.List[t.Dict]
+    ) -> t.Dict:
+        # single (max 10 operations) patch
+        container = self._container(self.name)
+        return container.patch_item(
+            **get_key_kwargs(**key), patch_operations=patches,
+            response_hook=self._set_session_token
+        )
+
+    def _replace_item(
+        self,
+        key: t.Dict[str, t.Any],
+        operations: t.List[t.Tuple[str, str, t.Any]],
+        retries: int = 3
+    ) -> t.Dict:
+        # read and replace if not modified since, retried if it was
+        container = self._container(self.name)
+        for _ in range(retries):
+            current = container.read_item(**get_key_kwargs(**key))
+            item = apply_update(strip_cosmos_attrs(dict(current)), operations)
+            try:
+                item = container.replace_item(
+                    key[self.key_attrs[-1]], item,
+                    etag=current['_etag'],
+                    match_condition=MatchConditions.IfNotModified,
+                    response_hook=self._set_session_token
+                )
+            except CosmosHttpResponseError as e:
+                if e.status_code != 412:
+                    raise
+                continue
+            return strip_cosmos_attrs(item)
+        raise ex.TransactionException(
+            detail='item changed during update, retries exhausted'
+        )
 
     @cosmos_ex_handler()
     def delete_item(self, **kwargs):
@@ -279,7 +590,7 @@ class Table(TableBase):
             # cosmos has to do create/update on delete but don't audit this
             item['abnosql_audit_callback'] = False
             # set update to False because would need key attrs defined if True
-            self.put_item(item, update=False)
+            self.put_item(item, update=False, returns='none')
             # sleep defined number of seconds to allow time between
             # update then delete events.  5 seconds seems to work, less
             # isnt enough time and cosmos doesnt send update event
@@ -291,11 +602,85 @@ class Table(TableBase):
                 time.sleep(sleep_secs)
 
         self._container(self.name).delete_item(
-            **get_key_kwargs(**kwargs)
+            **get_key_kwargs(**kwargs), response_hook=self._set_session_token
         )
 
         delete_item_post(self, key)
 
+    @cosmos_ex_handler()
+    def transact_write(
+        self,
+        operations: t.Iterable[t.Dict[str, t.Any]],
+        audit_user: t.Optional[str] = None
+    ) -> None:
+        _operations = transact_write_pre(self, operations, audit_user)
+        hk = self.key_attrs[0]
+        if len(set(
+            (op['table'].name, str(op['key'][hk])) for op in _operations
+        )) > 1:
+            raise ex.ValidationException(
+                'cosmos transactions must be within one table and '
+                'partition key'
+            )
+        container = self._container(self.name)
+        # conditions and updates that depend on the current item are
+        # evaluated against a read of it, with the etag failing the batch
+        # if it changed since.  Note deletes don't set change metadata
+        batch: t.List[t.Tuple] = []
+        indexes = []
+        for i, op in enumerate(_operations):
+            _id = op['key'][self.key_attrs[-1]]
+            current = None
+            if op['condition'] or op['action'] in ['update', 'check']:
+                try:
+                    current = container.read_item(
+                        **get_key_kwargs(**op['key'])
+                    )
+                except CosmosResourceNotFoundError:
+                    pass
+                if (
+                    current is None and op['action'] in ['update', 'check']
+                ) or not match_condition(current, op['condition']):
+                    raise ex.TransactionException(
+                        detail=f'condition check failed on operation {i}'
+                    )
+            kwargs = {'if_match_etag': current['_etag']} if current else {}
+            patches = get_patch_operations(
+                op['operations'], current
+            ) if op['action'] == 'update' else []
+            if op['action'] == 'put':
+                # create fails if item created since condition checked
+                batch.append((
+                    'create' if op['condition'] and not current else 'upsert',
+                    (op['item'],), kwargs
+                ))
+            elif op['action'] == 'delete':
+                batch.append(('delete', (_id,), kwargs))
+            elif len(patches):
+                # max 10 operations per patch
+                for j in range(0, len(patches), 10):
+                    batch.append((
+                        'patch', (_id, patches[j:j + 10]),
+                        kwargs if j == 0 else {}
+                    ))
+                    indexes.append(i)
+                continue
+            else:
+                # check reads the item, failing if changed since (no write)
+                batch.append(('read', (_id,), kwargs))
+            indexes.append(i)
+        try:
+            container.execute_item_batch(
+                batch, partition_key=_operations[0]['key'][hk],
+                response_hook=self._set_session_token
+            )
+        except CosmosBatchOperationError as e:
+            raise ex.TransactionException(detail=(
+                f'operation {indexes[e.error_index]} failed '
+                f'with status {e.status_code}'
+            )) from None
+        transact_write_post(_operations, audit_user)
+
     @cosmos_ex_handler()
     def query(
         self,
@@ -303,40 +688,126 @@ class Table(TableBase):
         filters: t.Optional[t.Dict[str, t.Any]] = None,
         limit: t.Optional[int] = None,
         next: t.Optional[str] = None,
-        index: t.Optional[str] = None
+        index: t.Optional[str] = None,
+        decrypt: t.Optional[bool] = False,
+        attributes: t.Optional[t.List[str]] = None,
+        fill: t.Optional[bool] = False,
+        consistency: t.Optional[str] = None
     ) -> t.Dict[str, t.Any]:
-        filters = filters or {}
-        key = key or {}
-        validate_query_attrs(key, filters)
-        parameters = {
-            f'@{k}': v for k, v in
-            (filters | key).items()
-        }
-        # cosmos doesnt like hyphens in table names
-        table_alias = 'c' if '-' in self.name else self.name
-        statement = f'SELECT * FROM {table_alias}'
-        op = 'WHERE'
-        for param in parameters.keys():
-            statement += f' {op} {table_alias}.{param[1:]} = {param}'
-            op = 'AND'
-
-        resp = self.query_sql(
+        (where, parameters) = self._where(key, filters)
+        projection = (
+            get_projection(self, attributes)
+            or kms_query_projection(self, decrypt)
+        )
+        select = get_sql_select(self._alias(), projection)
+        statement = f'SELECT {select} FROM {self._alias()}{where}'
+
+        resp = self._query_sql(
             statement,
             parameters,
             limit=limit,
-            next=next
+            next=next,
+            decrypt=decrypt,
+            consistency=consistency,
+            partition_key=self._partition_key(key)
         )
+        resp['items'] = [
+            project_item(self, unflatten_sql_item(_, projection), attributes)
+            for _ in resp['items']
+        ]
         return resp
 
+    def _partition_key(
+        self, key: t.Optional[t.Dict[str, t.Any]]
+    ) -> t.Optional[t.Any]:
+        # partition key value if in key, for single partition queries
+        hk = self.key_attrs[0]
+        if key and hk in key and get_query_condition(key[hk])[0] == '=':
+            return key[hk]
+        return None
+
+    def _query_kwargs(
+        self, kwargs: t.Dict[str, t.Any], partition_key: t.Optional[t.Any]
+    ) -> t.Dict[str, t.Any]:
+        # route to one partition if known, instead of fanning out
+        if partition_key is None:
+            return dict(kwargs, enable_cross_partition_query=True)
+        return dict(kwargs, partition_key=partition_key)
+
+    def _alias(self) -> str:
+        # cosmos doesnt like hyphens in table names
+        return 'c' if '-' in self.name else self.name
+
+    def _where(
+        self,
+        key: t.Optional[t.Dict[str, t.Any]] = None,
+        filters: t.Optional[t.Dict[str, t.Any]] = None
+    ) -> t.Tuple[str, t.Dict[str, t.Any]]:
+        filters = kms_blind_index_filters(self.config, filters) or {}
+        key = key or {}
+        validate_query_attrs(key, filters)
+        parameters: t.Dict[str, t.Any] = {}
+        conditions = [
+            get_sql_condition(f'{self._alias()}.{k}', f'@{k}', v, parameters)
+            for k, v in (filters | key).items()
+        ]
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        return (where, parameters)
+
+    @cosmos_ex_handler()
+    def count(
+        self,
+        key: t.Optional[t.Dict[str, t.Any]] = None,
+        filters: t.Optional[t.Dict[str, t.Any]] = None,
+        index: t.Optional[str] = None
+    ) -> int:
+        (where, parameters) = self._where(key, filters)
+        (statement, params) = get_sql_params(
+            f'SELECT VALUE COUNT(1) FROM {self._alias()}{where}',
+            parameters,
+            lambda var, val: {'name': var, 'value': val}
+        )
+        kwargs = self._query_kwargs(
+            {'query': statement}, self._partition_key(key)
+        )
+        if len(params):
+            kwargs['parameters'] = params
+        logging.debug(f'count() table: {self.name}, kwargs: {kwargs}')
+        # aggregated by the server, sum in case of per partition counts
+        return sum(self._container(self.name).query_items(**kwargs))
+
     @cosmos_ex_handler()
     def query_sql(
         self,
         statement: str,
         parameters: t.Optional[t.Dict[str, t.Any]] = None,
         limit: t.Optional[int] = None,
-        next: t.Optional[str] = None
+        next: t.Optional[str] = None,
+        decrypt: t.Optional[bool] = False,
+        consistency: t.Optional[str] = None
+    ) -> t.Dict[str, t.Any]:
+        return self._query_sql(
+            statement, parameters, limit, next, decrypt, consistency
+        )
+
+    def _query_sql(
+        self,
+        statement: str,
+        parameters: t.Optional[t.Dict[str, t.Any]] = None,
+        limit: t.Optional[int] = None,
+        next: t.Optional[str] = None,
+        decrypt: t.Optional[bool] = False,
+        consistency: t.Optional[str] = None,
+        partition_key: t.Optional[t.Any] = None
     ) -> t.Dict[str, t.Any]:
         parameters = parameters or {}
+        (statement, parameters) = kms_blind_index_sql(
+            self.config, statement, parameters
+        )
+        if partition_key is None:
+            partition_key = get_sql_partition_key(
+                self.key_attrs[0], statement, parameters
+            )
 
         def _get_param(var, val):
             return {'name': var, 'value': val}
@@ -345,27 +816,55 @@ class Table(TableBase):
             statement, parameters, _get_param
         )
 
-        kwargs: t.Dict[str, t.Any] = {
+        kwargs = self._query_kwargs({
             'query': statement,
-            'enable_cross_partition_query': True
-        }
+            **self._read_kwargs(get_consistency(self.config, consistency))
+        }, partition_key)
         if len(params):
             kwargs['parameters'] = params
-        # python cosmos SDK doesnt support
-        # kwargs['max_item_count'] = limit
         limit = limit or 100
-        next = next or '0'
-
-        # Python SDK does not support continuation
-        # for cross-partition queries - see limitations https://github.com/Azure/azure-sdk-for-python/tree/main/sdk/cosmos/azure-cosmos  # noqa
-        # so add OFFSET and LIMIT if not already present
-        if (
-            ' OFFSET ' not in statement.upper()
-            and ' LIMIT ' not in statement.upper()
+        container = self._container(self.name)
+
+        # page with continuation tokens, so documents before the page
+        # aren't read (and charged) again like with OFFSET.  Cross partition
+        # queries are paged one feed range (partition) at a time, unless
+        # the results are merged across partitions.  OFFSET next tokens
+        # are numeric, and tokens from the other mode are rejected
+        explicit = (
+            ' OFFSET ' in statement.upper() or ' LIMIT ' in statement.upper()
+        )
+        paged = not explicit and (
+            get_pagination(self.config) == 'continuation'
+        )
+        if paged and partition_key is None and MERGED_QUERY_PAT.search(
+            statement
         ):
-            kwargs['query'] += f' OFFSET {next} LIMIT {limit}'
+            # the SDK can't continue merged cross partition queries, and
+            # OFFSET re-reads every earlier page so is opt in
+            raise ex.ValidationException(
+                'cross partition query with ORDER BY, GROUP BY, DISTINCT, '
+                'TOP or aggregates can\'t be paged with continuation tokens, '
+                'use cosmos_pagination offset, OFFSET LIMIT or partition key'
+            )
+        if not explicit and next is not None and next.isdigit() == paged:
+            raise ex.ValidationException(
+                'invalid next, expected '
+                + ('continuation' if paged else 'offset') + ' token'
+            )
+        if paged:
+            (items, _next) = self._query_pages(
+                container, kwargs, limit, next, partition_key
+            )
+            items = kms_process_query_items(
+                self.config, [strip_cosmos_attrs(_) for _ in items], decrypt
+            )
+            return {'items': items, 'next': _next}
+
+        offset = next or '0'
+        # add OFFSET and LIMIT if not already present
+        if not explicit:
+            kwargs['query'] += f' OFFSET {offset} LIMIT {limit}'
         logging.debug(f'query_sql() table: {self.name}, kwargs: {kwargs}')
-        container = self._container(self.name)
         items = list(container.query_items(**kwargs))
         headers = container.client_connection.last_response_headers
         # continuation = headers.get('x-ms-continuation')
@@ -383,16 +882,95 @@ class Table(TableBase):
 
         for i in range(len(items)):
             items[i] = strip_cosmos_attrs(items[i])
-        items = kms_process_query_items(self.config, items)
-        _next = None
+        items = kms_process_query_items(self.config, items, decrypt)
+        next_offset = None
         try:
-            _next = limit + int(next)
+            next_offset = limit + int(offset)
         except Exception:
-            _next = None
-        if doc_count is not None and _next is not None and _next >= doc_count:
-            _next = None
+            next_offset = None
+        if doc_count is not None and next_offset is not None and (
+            next_offset >= doc_count
+        ):
+            next_offset = None
 
         return {
             'items': items,
-            'next': str(_next) if _next and len(items) else None
+            'next': str(next_offset) if next_offset and len(items) else None
+        }
+
+    def _query_pages(
+        self,
+        container,
+        kwargs: t.Dict[str, t.Any],
+        limit: int,
+        next: t.Optional[str],
+        partition_key: t.Optional[t.Any]
+    ) -> t.Tuple[t.List[t.Dict], t.Optional[str]]:
+        # next is the remaining feed ranges (None for the partition key)
+        # and SDK continuation token within the first, pages are read
+        # until limit items or there are no more
+        try:
+            token = json.loads(b64decode(next).decode()) if next else {}
+        except ValueError:
+            token = None
+        if not isinstance(token, dict):
+            raise ex.ValidationException(
+                'invalid next, expected continuation token'
+            )
+        if partition_key is not None:
+            ranges: t.List[t.Optional[t.Dict]] = [None]
+        elif 'ranges' in token:
+            ranges = token['ranges']
+        else:
+            ranges = list(container.read_feed_ranges())
+        continuation = token.get('continuation')
+
+        items: t.List[t.Dict] = []
+        while len(ranges) and len(items) < limit:
+            _kwargs = dict(kwargs, max_item_count=limit - len(items))
+            if ranges[0] is not None:
+                _kwargs['feed_range'] = ranges[0]
+            logging.debug(
+                f'query_sql() table: {self.name}, kwargs: {_kwargs}'
+            )
+            pages = container.query_items(**_kwargs).by_page(continuation)
+            for page in pages:
+                items.extend(page)
+                break
+            continuation = pages.continuation_token
+            if continuation is None:
+                ranges.pop(0)
+
+        _next = None
+        if len(ranges):
+            token = {'continuation': continuation}
+            if partition_key is None:
+                token['ranges'] = ranges
+            _next = b64encode(json.dumps(token).encode()).decode()
+        return (items, _next)
+
+    @cosmos_ex_handler()
+    def query_sql_many(
+        self,
+        statements: t.Iterable[t.Any],
+        decrypt: t.Optional[bool] = False
+    ) -> t.List[t.Dict[str, t.Any]]:
+        return query_sql_concurrent(self, statements, decrypt)
+
+    @cosmos_ex_handler()
+    def describe(self) -> t.Dict[str, t.Any]:
+        logging.debug(f'describe() table: {self.name}')
+        properties = self._container(self.name).read()
+        # document id is the range/sort key
+        key_attrs = [
+            _.lstrip('/').replace('/', '.')
+            for _ in properties.get('partitionKey', {}).get('paths', [])
+        ][:1]
+        if key_attrs != ['id']:
+            key_attrs.append('id')
+        # range, spatial and composite indexes are used automatically
+        return {
+            'key_attrs': key_attrs,
+            'indexes': [],
+            'indexing_policy': properties.get('indexingPolicy', {})
         }
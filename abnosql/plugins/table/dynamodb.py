@@ -4,24 +4,47 @@ from datetime import datetime
 import functools
 import json
 import logging
+import math
 import os
 import typing as t
 
 import pluggy  # type: ignore
 
 import abnosql.exceptions as ex
+from abnosql.kms import map_concurrent
 from abnosql.plugin import PM
 from abnosql.table import check_exists_enabled
 from abnosql.table import delete_item_post
 from abnosql.table import delete_item_pre
+from abnosql.table import get_consistency
 from abnosql.table import get_item_post
 from abnosql.table import get_item_pre
-from abnosql.table import get_key_attrs
+from abnosql.table import get_items_post
+from abnosql.table import get_items_pre
+from abnosql.table import get_projection
+from abnosql.table import get_query_condition
+from abnosql.table import get_query_fill_caps
+from abnosql.table import get_query_index
+from abnosql.table import get_query_max_workers
 from abnosql.table import get_sql_params
+from abnosql.table import get_sql_statements
+from abnosql.table import get_table_key_attrs
+from abnosql.table import get_table_metadata
+from abnosql.table import get_write_returns
+from abnosql.table import kms_blind_index_filters
+from abnosql.table import kms_blind_index_sql
 from abnosql.table import kms_process_query_items
+from abnosql.table import kms_query_projection
+from abnosql.table import project_item
 from abnosql.table import put_item_post
 from abnosql.table import put_item_pre
+from abnosql.table import put_items_post
+from abnosql.table import put_items_pre
 from abnosql.table import TableBase
+from abnosql.table import transact_write_post
+from abnosql.table import transact_write_pre
+from abnosql.table import update_item_post
+from abnosql.table import update_item_pre
 from abnosql.table import validate_query_attrs
 
 hookimpl = pluggy.HookimplMarker('abnosql.table')
@@ -34,7 +57,6 @@ try:
     from boto3.dynamodb.types import Decimal  # type: ignore
     from botocore.exceptions import ClientError  # type: ignore
     from botocore.exceptions import NoCredentialsError  # type: ignore
-    from dynamodb_json import json_util  # type: ignore
 except ImportError:
     MISSING_DEPS = True
 
@@ -46,16 +68,183 @@ def json_serial(obj):
         return obj.isoformat()
     if isinstance(obj, Decimal):
         return float(obj) if obj != obj.to_integral_value() else int(obj)
+    # binary is returned base64 encoded as it's not JSON serializable
     if isinstance(obj, Binary):
-        return obj.value
+        return b64encode(obj.value).decode()
+    if isinstance(obj, (bytes, bytearray)):
+        return b64encode(obj).decode()
     if isinstance(obj, set):
         return list(obj)
     raise TypeError('type not serializable')
 
 
+# values that need no conversion either way, checked with type(v) in
+# PLAIN_TYPES which is faster than isinstance() for flat items
+PLAIN_TYPES = frozenset([str, int, bool, type(None)])
+
+
+def to_number(val):
+    # Decimal to int if integral else float (same as json_serial)
+    return float(val) if val != val.to_integral_value() else int(val)
+
+
+def from_dynamodb(obj):
+    """Convert boto3 resource values to JSON compatible python values
+
+    Single pass replacement for json.loads(json.dumps(obj,
+    default=json_serial)), returning new dicts and lists
+
+    Args:
+
+        obj: value with Decimal, Binary, set etc from boto3 resource
+
+    Returns:
+
+        value with int/float, base64 string, list etc
+
+    """
+    if isinstance(obj, dict):
+        # fast path for flat items where most values need no conversion
+        return {
+            k: v if type(v) in PLAIN_TYPES else from_dynamodb(v)
+            for k, v in obj.items()
+        }
+    if isinstance(obj, (list, tuple, set)):
+        return [
+            v if type(v) in PLAIN_TYPES else from_dynamodb(v)
+            for v in obj
+        ]
+    if type(obj) in PLAIN_TYPES or isinstance(obj, float):
+        return obj
+    if isinstance(obj, Decimal):
+        return to_number(obj)
+    return json_serial(obj)
+
+
+def to_dynamodb(obj):
+    """Convert python values to values accepted by the boto3 resource
+
+    Single pass replacement for json.loads(json.dumps(obj),
+    parse_float=Decimal), leaving bytes (eg encrypted values) and sets
+    as they are
+
+    Args:
+
+        obj: python value
+
+    Returns:
+
+        value with floats converted to Decimal
+
+    """
+    if isinstance(obj, dict):
+        return {
+            str(k): v if type(v) in PLAIN_TYPES else to_dynamodb(v)
+            for k, v in obj.items()
+        }
+    if isinstance(obj, (list, tuple)):
+        return [
+            v if type(v) in PLAIN_TYPES else to_dynamodb(v)
+            for v in obj
+        ]
+    if isinstance(obj, (set, frozenset)):
+        return set(to_dynamodb(list(obj)))
+    if isinstance(obj, float):
+        return Decimal(repr(obj))
+    return obj
+
+
+def from_attribute_value(av: t.Dict[str, t.Any]) -> t.Any:
+    """Convert a low level client AttributeValue to a python value
+
+    Single pass replacement for json_util.loads(json.dumps(item,
+    default=json_serial)), eg {'N': '1.5'} to 1.5
+
+    Args:
+
+        av: AttributeValue dictionary
+
+    Returns:
+
+        python value, binary values are base64 encoded strings
+
+    """
+    ((_type, val),) = av.items()
+    if _type == 'S' or _type == 'BOOL':
+        return val
+    if _type == 'N':
+        return to_number(Decimal(val))
+    if _type == 'M':
+        return {k: from_attribute_value(v) for k, v in val.items()}
+    if _type == 'L':
+        return [from_attribute_value(v) for v in val]
+    if _type == 'NULL':
+        return None
+    if _type == 'B':
+        return json_serial(val)
+    if _type == 'SS':
+        return list(val)
+    if _type == 'NS':
+        return [to_number(Decimal(v)) for v in val]
+    if _type == 'BS':
+        return [json_serial(v) for v in val]
+    raise ValueError(f'unknown attribute value type: {_type}')
+
+
+def to_attribute_value(val: t.Any) -> t.Dict[str, t.Any]:
+    """Convert a python value to a low level client AttributeValue
+
+    Inverse of from_attribute_value(), floats are sent as their repr()
+    so no Decimal conversion is needed
+
+    Args:
+
+        val: python value
+
+    Returns:
+
+        AttributeValue dictionary, eg {'N': '1.5'}
+
+    """
+    _type = type(val)
+    if _type is str:
+        return {'S': val}
+    if _type is bool:
+        return {'BOOL': val}
+    if val is None:
+        return {'NULL': True}
+    if _type is int or isinstance(val, (int, Decimal)):
+        return {'N': str(val)}
+    if _type is float:
+        return {'N': repr(val)}
+    if isinstance(val, dict):
+        return {'M': {str(k): to_attribute_value(v) for k, v in val.items()}}
+    if isinstance(val, (list, tuple)):
+        return {'L': [to_attribute_value(v) for v in val]}
+    if isinstance(val, (bytes, bytearray)):
+        return {'B': bytes(val)}
+    if isinstance(val, Binary):
+        return {'B': val.value}
+    if isinstance(val, (set, frozenset)) and len(val):
+        values = [to_attribute_value(v) for v in val]
+        _types = set(list(v.keys())[0] for v in values)
+        if len(_types) == 1 and list(_types)[0] in ['S', 'N', 'B']:
+            _set_type = list(_types)[0]
+            return {f'{_set_type}S': [v[_set_type] for v in values]}
+    raise TypeError(f'type {_type.__name__} not serializable')
+
+
+def to_item(item: t.Dict[str, t.Any]) -> t.Dict[str, t.Dict[str, t.Any]]:
+    return {k: to_attribute_value(v) for k, v in item.items()}
+
+
+def from_item(item: t.Dict[str, t.Dict[str, t.Any]]) -> t.Dict[str, t.Any]:
+    return {k: from_attribute_value(v) for k, v in item.items()}
+
+
 def deserialize(obj, deserializer=None):
     if deserializer is None:
-        deserializer = json_serial
+        return from_dynamodb(obj)
     elif callable(deserializer):
         return deserializer(obj)
     return json.loads(json.dumps(obj, default=deserializer))
@@ -105,11 +294,191 @@ def serialize_dynamodb_type(var, val):
     return {_type: str(val)}
 
 
+def get_dynamodb_condition(
+    name: str, k: str, val: t.Any, values: t.Dict[str, t.Any]
+) -> str:
+    """Get KeyConditionExpression or FilterExpression condition
+
+    Args:
+
+        name: attribute name or #name placeholder
+        k: attribute, used for :value placeholders
+        val: key or filter value, see get_query_condition()
+        values: ExpressionAttributeValues that values are added to
+
+    Returns:
+
+        condition expression
+
+    """
+    (op, val) = get_query_condition(val)
+    if op == 'exists':
+        return f'attribute_{"" if val else "not_"}exists({name})'
+    if op in ['between', 'in']:
+        params = [f':{k}_{i}' for i in range(len(val))]
+        values.update(zip(params, val))
+        if op == 'between':
+            return f'{name} BETWEEN {params[0]} AND {params[1]}'
+        return f'{name} IN ({", ".join(params)})'
+    values[f':{k}'] = val
+    if op in ['begins_with', 'contains']:
+        return f'{op}({name}, :{k})'
+    return f'{name} {"<>" if op == "!=" else op} :{k}'
+
+
+def get_consistent_read_kwargs(
+    consistency: t.Optional[str]
+) -> t.Dict[str, t.Any]:
+    # no session consistency so read your writes needs strongly consistent
+    if consistency is None:
+        return {}
+    return {'ConsistentRead': consistency != 'eventual'}
+
+
+def get_projection_kwargs(
+    projection: t.List[str], names: t.Optional[t.Dict[str, str]] = None
+) -> t.Dict[str, t.Any]:
+    """Get ProjectionExpression and ExpressionAttributeNames kwargs
+
+    Args:
+
+        projection: list of attribute paths, eg ['hk', 'obj.foo']
+        names: optional ExpressionAttributeNames to add names to
+
+    Returns:
+
+        kwargs dict
+
+    """
+    names = {} if names is None else names
+    for k in projection:
+        names.update({f'#{part}': part for part in k.split('.')})
+    return {
+        'ProjectionExpression': ', '.join([
+            '.'.join([f'#{part}' for part in k.split('.')])
+            for k in projection
+        ]),
+        'ExpressionAttributeNames': names
+    }
+
+
+def get_update_kwargs(
+    operations: t.List[t.Tuple[str, str, t.Any]],
+    low_level: t.Optional[bool] = False
+) -> t.Dict[str, t.Any]:
+    """Get UpdateExpression kwargs for update_item() operations
+
+    Args:
+
+        operations: list of (attribute, operator, value), see
+            update_item_pre()
+        low_level: values are for the low level client, otherwise
+            converted for the table resource (eg float to Decimal)
+
+    Returns:
+
+        kwargs dict
+
+    """
+    clauses: t.Dict[str, t.List[str]] = {'SET': [], 'ADD': [], 'REMOVE': []}
+    names = {}
+    values: t.Dict[str, t.Any] = {}
+    for i, (k, op, val) in enumerate(operations):
+        names[f'#u{i}'] = k
+        (name, value) = (f'#u{i}', f':u{i}')
+        if op == 'remove':
+            clauses['REMOVE'].append(name)
+            continue
+        values[value] = val
+        if op == 'set':
+            clauses['SET'].append(f'{name} = {value}')
+        elif op == 'set_if_not_exists':
+            clauses['SET'].append(
+                f'{name} = if_not_exists({name}, {value})'
+            )
+        elif op == 'increment':
+            clauses['ADD'].append(f'{name} {value}')
+        elif op == 'append':
+            values[f'{value}_0'] = []
+            clauses['SET'].append(
+                f'{name} = list_append('
+                f'if_not_exists({name}, {value}_0), {value})'
+            )
+    kwargs: t.Dict[str, t.Any] = {
+        'UpdateExpression': ' '.join([
+            f'{clause} {", ".join(exps)}'
+            for clause, exps in clauses.items()
+            if len(exps)
+        ]),
+        'ExpressionAttributeNames': names
+    }
+    if len(values):
+        kwargs['ExpressionAttributeValues'] = (
+            values if low_level else to_dynamodb(values)
+        )
+    return kwargs
+
+
+# transact_write() actions to TransactWriteItems item types
+TRANSACT_ITEM_TYPES = {
+    'put': 'Put',
+    'update': 'Update',
+    'delete': 'Delete',
+    'check': 'ConditionCheck'
+}
+
+
+def get_transact_item(operation: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
+    """Get TransactWriteItems item for transact_write_pre() operation
+
+    Args:
+
+        operation: dict containing table, action, key, condition and
+            item or operations
+
+    Returns:
+
+        transact item dict for the low level client
+
+    """
+    tb = operation['table']
+    action = operation['action']
+    kwargs: t.Dict[str, t.Any] = {'TableName': tb.name}
+    if action == 'put':
+        kwargs['Item'] = to_item(operation['item'])
+    else:
+        kwargs['Key'] = to_item(operation['key'])
+    names: t.Dict[str, str] = {}
+    values: t.Dict[str, t.Any] = {}
+    if action == 'update':
+        kwargs.update(get_update_kwargs(operation['operations'], True))
+        names = kwargs.pop('ExpressionAttributeNames')
+        values = kwargs.pop('ExpressionAttributeValues', {})
+    conditions = []
+    # update and check require item to already exist
+    if action in ['update', 'check']:
+        names['#_k'] = tb.key_attrs[0]
+        conditions.append('attribute_exists(#_k)')
+    for k, v in operation['condition'].items():
+        names[f'#c_{k}'] = k
+        conditions.append(
+            get_dynamodb_condition(f'#c_{k}', f'c_{k}', v, values)
+        )
+    if len(conditions):
+        kwargs['ConditionExpression'] = ' AND '.join(conditions)
+    if len(names):
+        kwargs['ExpressionAttributeNames'] = names
+    if len(values):
+        kwargs['ExpressionAttributeValues'] = to_item(values)
+    return {TRANSACT_ITEM_TYPES[action]: kwargs}
+
+
 def get_dynamodb_kwargs(
     name: str,
     key: t.Optional[t.Dict[str, t.Any]] = None,
     filters: t.Optional[t.Dict[str, t.Any]] = None,
-    index: t.Optional[str] = None
+    index: t.Optional[str] = None,
+    projection: t.Optional[t.List[str]] = None
 ) -> t.Dict:
     key = key or {}
     if len(key) > 2:
@@ -117,16 +486,18 @@ def get_dynamodb_kwargs(
     filters = filters or {}
     validate_query_attrs(key, filters)
 
-    _values = {}
-    if len(key):
-        _values = {
-            f':{k}': v
-            for k, v in key.items()
-        }
+    _values: t.Dict[str, t.Any] = {}
+    key_conditions = [
+        get_dynamodb_condition(k, k, v, _values)
+        for k, v in key.items()
+    ]
     _names = {}
+    filter_conditions = []
     for k, v in filters.items():
         _names[f'#{k}'] = k
-        _values[f':{k}'] = v
+        filter_conditions.append(
+            get_dynamodb_condition(f'#{k}', k, v, _values)
+        )
 
     kwargs: t.Dict[str, t.Any] = {
         'TableName': name,
@@ -135,17 +506,16 @@ def get_dynamodb_kwargs(
     if index is not None:
         kwargs['IndexName'] = index
     if len(key):
-        kwargs['KeyConditionExpression'] = ' AND '.join([
-            f'{k} = :{k}' for k in key.keys()
-        ])
+        kwargs['KeyConditionExpression'] = ' AND '.join(key_conditions)
     if len(_values):
         kwargs['ExpressionAttributeValues'] = _values
+    if projection:
+        kwargs.pop('Select')
+        kwargs.update(get_projection_kwargs(projection, _names))
     if len(_names):
         kwargs['ExpressionAttributeNames'] = _names
     if len(filters):
-        kwargs['FilterExpression'] = ' AND '.join([
-            f'#{k} = :{k}' for k in filters.keys()
-        ])
+        kwargs['FilterExpression'] = ' AND '.join(filter_conditions)
     return kwargs
 
 
@@ -164,9 +534,43 @@ class Table(TableBase):
                 region_name=AWS_DEFAULT_REGION
             )
         )
-        self.key_attrs = get_key_attrs(self.config)
         self.check_exists = check_exists_enabled(self.config)
-        self.table = self.session.resource('dynamodb').Table(name)
+        self.binary = True
+        self.ttl_format = 'epoch'
+        self.resource = self.session.resource('dynamodb')
+        self.table = self.resource.Table(name)
+        self.client = self.session.client('dynamodb')
+        self.key_attrs = get_table_key_attrs(self)
+        # low level client mode skips the resource layer (and its Decimal
+        # and Binary types) by encoding/decoding AttributeValues directly
+        self.low_level = self.config.get('low_level') is True
+
+    def _request(self, method: str, **kwargs) -> t.Dict:
+        # call table resource method or the low level client equivalent,
+        # encoding keys/values and decoding items in the response
+        if not self.low_level:
+            return getattr(self.table, method)(**kwargs)
+        for k in ['Key', 'Item', 'ExclusiveStartKey']:
+            if k in kwargs:
+                kwargs[k] = to_item(kwargs[k])
+        if 'ExpressionAttributeValues' in kwargs:
+            kwargs['ExpressionAttributeValues'] = to_item(
+                kwargs['ExpressionAttributeValues']
+            )
+        kwargs['TableName'] = self.name
+        response = getattr(self.client, method)(**kwargs)
+        for k in ['Item', 'Attributes', 'LastEvaluatedKey']:
+            if k in response:
+                response[k] = from_item(response[k])
+        if 'Items' in response:
+            response['Items'] = [from_item(_) for _ in response['Items']]
+        return response
+
+    def _deserialize(self, obj):
+        # low level client responses are already decoded
+        if self.low_level:
+            return obj
+        return deserialize(obj, self.config.get('deserializer'))
 
     @dynamodb_ex_handler()
     def set_config(self, config: t.Optional[dict]):
@@ -179,31 +583,97 @@ class Table(TableBase):
 
     @dynamodb_ex_handler()
     def get_item(self, **kwargs) -> t.Optional[t.Dict]:
+        attributes = kwargs.pop('attributes', None)
+        consistency = get_consistency(
+            self.config, kwargs.pop('consistency', None)
+        )
         audit_key, _ = get_item_pre(self, dict(**kwargs))
 
-        response = deserialize(self.table.get_item(
+        projection = get_projection(self, attributes)
+        response = self._deserialize(self._request(
+            'get_item',
             TableName=self.name,
-            Key=get_key(**kwargs)
-        ), self.config.get('deserializer'))
+            Key=get_key(**kwargs),
+            **get_consistent_read_kwargs(consistency),
+            **(get_projection_kwargs(projection) if projection else {})
+        ))
         item = response.get('Item')
 
-        return get_item_post(self, dict(**kwargs), item, audit_key)
+        return get_item_post(
+            self, dict(**kwargs), item, audit_key, attributes
+        )
+
+    @dynamodb_ex_handler()
+    def get_items(
+        self,
+        keys: t.Iterable[t.Dict[str, t.Any]],
+        attributes: t.Optional[t.List[str]] = None,
+        consistency: t.Optional[str] = None
+    ) -> t.List[t.Optional[t.Dict]]:
+        keys = get_items_pre(self, keys)
+        projection = get_projection(self, attributes)
+        consistency = get_consistency(self.config, consistency)
+
+        def _key_id(obj):
+            return tuple(obj.get(k) for k in self.key_attrs)
+
+        # BatchGetItem rejects duplicate keys and allows max 100 keys
+        unique = list({_key_id(key): key for key in keys}.values())
+        found = {}
+        for i in range(0, len(unique), 100):
+            _keys = unique[i:i + 100]
+            if self.low_level:
+                _keys = [to_item(_) for _ in _keys]
+            request = {self.name: {
+                'Keys': _keys, **get_consistent_read_kwargs(consistency)
+            }}
+            if projection:
+                request[self.name].update(get_projection_kwargs(projection))
+            while request:
+                response = (
+                    self.client if self.low_level else self.resource
+                ).batch_get_item(RequestItems=request)
+                for item in response.get('Responses', {}).get(self.name, []):
+                    if self.low_level:
+                        item = from_item(item)
+                    found[_key_id(item)] = item
+                request = response.get('UnprocessedKeys')
+        items = [found.get(_key_id(key)) for key in keys]
+        items = self._deserialize(items)
+
+        return get_items_post(self, keys, items, attributes)
 
     @dynamodb_ex_handler()
     def put_item(
         self, item:
         t.Dict,
         update: t.Optional[bool] = False,
-        audit_user: t.Optional[str] = None
-    ) -> t.Dict:
+        audit_user: t.Optional[str] = None,
+        returns: t.Optional[str] = None
+    ) -> t.Optional[t.Dict]:
+        returns = get_write_returns(self.config, returns)
         item, _ = put_item_pre(self, item, update, audit_user)
-        item = json.loads(json.dumps(item), parse_float=Decimal)
+        item = self._put_item(item, update, returns)
+        return put_item_post(
+            self, item, update, audit_user, returns=returns
+        )
+
+    def _put_item(
+        self,
+        item: t.Dict,
+        update: t.Optional[bool] = False,
+        returns: t.Optional[str] = None
+    ):
+        item = dict(item) if self.low_level else to_dynamodb(item)
 
-        # do update
+        # do update, only returning the whole item if needed
         if update is True:
+            key = {k: item.pop(k) for k in self.key_attrs}
             kwargs = {
-                'Key': {k: item.pop(k) for k in self.key_attrs},
-                'ReturnValues': 'ALL_NEW'
+                'Key': key,
+                'ReturnValues': (
+                    'NONE' if returns in ['none', 'updated'] else 'ALL_NEW'
+                )
             }
             exp = []
             vals = {}
@@ -217,35 +687,90 @@ class Table(TableBase):
             kwargs['UpdateExpression'] = 'set %s' % ', '.join(exp)
             kwargs['ExpressionAttributeNames'] = aliases
             kwargs['ExpressionAttributeValues'] = vals
-            response = self.table.update_item(**kwargs)
-            item.update(response.get('Attributes'))
+            response = self._request('update_item', **kwargs)
+            item.update(key)
+            item.update(response.get('Attributes', {}))
 
         # do create/replace
         else:
-            self.table.put_item(Item=item)
+            self._request('put_item', Item=item)
 
-        return put_item_post(self, item, update, audit_user)
+        return item
 
     @dynamodb_ex_handler()
     def put_items(
         self,
         items: t.Iterable[t.Dict],
         update: t.Optional[bool] = False,
-        audit_user: t.Optional[str] = None
-    ):
+        audit_user: t.Optional[str] = None,
+        returns: t.Optional[str] = None
+    ) -> t.Optional[t.List[t.Dict]]:
         # TODO(batch)
-        for item in items:
-            self.put_item(item, update=update, audit_user=audit_user)
-        self.pm.hook.put_items_post(table=self.name, items=items)
+        returns = get_write_returns(self.config, returns)
+        items = list(items)
+        _items = []
+        for item in put_items_pre(self, items, update, audit_user):
+            # items aren't returned by default, so don't ask for ALL_NEW
+            item = self._put_item(item, update, returns or 'none')
+            _items.append(put_item_post(self, item, update, audit_user))
+        return put_items_post(self, items, _items, returns)
+
+    @dynamodb_ex_handler()
+    def update_item(
+        self,
+        key: t.Dict[str, t.Any],
+        updates: t.Dict[str, t.Any],
+        audit_user: t.Optional[str] = None
+    ) -> t.Dict:
+        key, operations = update_item_pre(self, key, updates, audit_user)
+        kwargs = get_update_kwargs(operations, self.low_level)
+        # key attribute condition so item must already exist
+        kwargs['ExpressionAttributeNames']['#_k'] = self.key_attrs[0]
+        kwargs.update({
+            'Key': key,
+            'ConditionExpression': 'attribute_exists(#_k)',
+            'ReturnValues': 'ALL_NEW'
+        })
+        try:
+            response = self._request('update_item', **kwargs)
+        except ClientError as e:
+            code = e.response['Error']['Code']
+            if code == 'ConditionalCheckFailedException':
+                raise ex.NotFoundException('item not found') from None
+            raise
+        item = self._deserialize(response.get('Attributes', {}))
+        return update_item_post(self, item, audit_user)
 
     @dynamodb_ex_handler()
     def delete_item(self, **kwargs):
         key = delete_item_pre(self, dict(kwargs))
 
-        self.table.delete_item(Key=get_key(**kwargs))
+        self._request('delete_item', Key=get_key(**kwargs))
 
         delete_item_post(self, key)
 
+    @dynamodb_ex_handler()
+    def transact_write(
+        self,
+        operations: t.Iterable[t.Dict[str, t.Any]],
+        audit_user: t.Optional[str] = None
+    ) -> None:
+        _operations = transact_write_pre(self, operations, audit_user)
+        # table resource has no transactions so always use the client
+        try:
+            self.client.transact_write_items(TransactItems=[
+                get_transact_item(_) for _ in _operations
+            ])
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'TransactionCanceledException':
+                raise ex.TransactionException(detail=[
+                    _.get('Code') for _ in e.response.get(
+                        'CancellationReasons', []
+                    )
+                ]) from None
+            raise
+        transact_write_post(_operations, audit_user)
+
     @dynamodb_ex_handler()
     def query(
         self,
@@ -253,47 +778,150 @@ class Table(TableBase):
         filters: t.Optional[t.Dict[str, t.Any]] = None,
         limit: t.Optional[int] = None,
         next: t.Optional[str] = None,
-        index: t.Optional[str] = None
+        index: t.Optional[str] = None,
+        decrypt: t.Optional[bool] = False,
+        attributes: t.Optional[t.List[str]] = None,
+        fill: t.Optional[bool] = False,
+        consistency: t.Optional[str] = None
     ) -> t.Dict[str, t.Any]:
+        filters = kms_blind_index_filters(self.config, filters)
+        read_kwargs = get_consistent_read_kwargs(
+            get_consistency(self.config, consistency)
+        )
+        (key, filters, index) = get_query_index(
+            self, key, filters, index,
+            read_kwargs.get('ConsistentRead') is True
+        )
+        projection = (
+            get_projection(self, attributes)
+            or kms_query_projection(self, decrypt)
+        )
+        # fill can stop part way through a page, so next is built from the
+        # last returned item's table and index key attributes
+        last_attrs = list(self.key_attrs)
+        if fill and index is not None:
+            last_attrs += [
+                attr for _ in get_table_metadata(self)['indexes']
+                if _['name'] == index for attr in _['key_attrs']
+            ]
+        extra_attrs = [
+            _ for _ in dict.fromkeys(last_attrs)
+            if projection is not None and _ not in projection
+        ]
         kwargs = get_dynamodb_kwargs(
-            self.name, key, filters=filters, index=index
+            self.name, key, filters=filters, index=index,
+            projection=(
+                projection + extra_attrs if projection is not None else None
+            )
         )
+        kwargs.update(read_kwargs)
         if next is not None:
             kwargs['ExclusiveStartKey'] = json.loads(b64decode(next).decode())
-        if limit is not None:
-            kwargs['Limit'] = limit
-        response = None
-        if key is not None:
-            logging.debug(f'query() table: {self.name}, query kwargs: {kwargs}')
-            response = self.table.query(**kwargs)
-        else:
-            logging.debug(f'query() table: {self.name}, scan kwargs: {kwargs}')
-            response = self.table.scan(**kwargs)
-        items = response.get('Items', [])
-        items = kms_process_query_items(self.config, items)
-        last = response.get('LastEvaluatedKey')
+        method = 'query' if key is not None else 'scan'
+        logging.debug(f'query() table: {self.name}, {method} kwargs: {kwargs}')
+        # Limit is applied before FilterExpression, so fill keeps paging,
+        # sizing each page from the filter selectivity so far (capped by
+        # fill_max_scanned) and trimming the items to limit
+        (max_pages, max_scanned) = (
+            get_query_fill_caps(self.config) if fill else (1, None)
+        )
+        _items: t.List[t.Dict] = []
+        (pages, scanned) = (0, 0)
+        while True:
+            page_limit = None
+            if limit is not None:
+                page_limit = limit - len(_items)
+                if scanned > 0:
+                    page_limit = math.ceil(
+                        page_limit * scanned / max(len(_items), 1)
+                    )
+            if max_scanned is not None:
+                page_limit = min(
+                    max_scanned - scanned, page_limit or max_scanned
+                )
+            if page_limit is not None:
+                kwargs['Limit'] = page_limit
+            response = self._request(method, **kwargs)
+            _items.extend(response.get('Items', []))
+            pages += 1
+            scanned += response.get('ScannedCount', 0)
+            last = response.get('LastEvaluatedKey')
+            if (
+                last is None
+                or (limit is not None and len(_items) >= limit)
+                or (max_pages is not None and pages >= max_pages)
+                or (max_scanned is not None and scanned >= max_scanned)
+            ):
+                break
+            kwargs['ExclusiveStartKey'] = last
+        if limit is not None and len(_items) > limit:
+            _items = _items[:limit]
+            last = {k: _items[-1][k] for k in dict.fromkeys(last_attrs)}
+        if len(extra_attrs):
+            _items = [
+                {k: v for k, v in _.items() if k not in extra_attrs}
+                for _ in _items
+            ]
+        items = [
+            project_item(self, _, attributes)
+            for _ in kms_process_query_items(
+                self.config, self._deserialize(_items), decrypt
+            )
+        ]
         if last is not None:
             last = b64encode(json.dumps(last).encode()).decode()
         return {
-            'items': deserialize(items, self.config.get('deserializer')),
+            'items': items,
             'next': last
         }
 
+    @dynamodb_ex_handler()
+    def count(
+        self,
+        key: t.Optional[t.Dict[str, t.Any]] = None,
+        filters: t.Optional[t.Dict[str, t.Any]] = None,
+        index: t.Optional[str] = None
+    ) -> int:
+        filters = kms_blind_index_filters(self.config, filters)
+        (key, filters, index) = get_query_index(self, key, filters, index)
+        kwargs = get_dynamodb_kwargs(
+            self.name, key, filters=filters, index=index
+        )
+        kwargs['Select'] = 'COUNT'
+        method = 'query' if key is not None else 'scan'
+        logging.debug(f'count() table: {self.name}, {method} kwargs: {kwargs}')
+        # each page (max 1MB read) returns a count, so sum them
+        count = 0
+        while True:
+            response = self._request(method, **kwargs)
+            count += response.get('Count', 0)
+            last = response.get('LastEvaluatedKey')
+            if last is None:
+                return count
+            kwargs['ExclusiveStartKey'] = last
+
     @dynamodb_ex_handler()
     def query_sql(
         self,
         statement: str,
         parameters: t.Optional[t.Dict[str, t.Any]] = None,
         limit: t.Optional[int] = None,
-        next: t.Optional[str] = None
+        next: t.Optional[str] = None,
+        decrypt: t.Optional[bool] = False,
+        consistency: t.Optional[str] = None
     ) -> t.Dict[str, t.Any]:
         parameters = parameters or {}
+        (statement, parameters) = kms_blind_index_sql(
+            self.config, statement, parameters
+        )
         (statement, params) = get_sql_params(
             statement, parameters, serialize_dynamodb_type, '?'
         )
-        client = self.session.client('dynamodb')
         kwargs: t.Dict[str, t.Any] = {
-            'Statement': statement
+            'Statement': statement,
+            **get_consistent_read_kwargs(
+                get_consistency(self.config, consistency)
+            )
         }
         if next is not None:
             kwargs['NextToken'] = next
@@ -303,14 +931,114 @@ class Table(TableBase):
             kwargs['Parameters'] = params
 
         logging.debug(f'query_sql() table: {self.name}, kwargs: {kwargs}')
-        response = client.execute_statement(**kwargs)
-        items = []
-        _items = response.get('Items', [])
-        _items = kms_process_query_items(self.config, _items)
-        for item in _items:
-            items.append(json_util.loads(json.dumps(item)))
+        response = self.client.execute_statement(**kwargs)
+        items = [from_item(item) for item in response.get('Items', [])]
+        items = kms_process_query_items(self.config, items, decrypt)
 
         return {
             'items': items,
             'next': response.get('NextToken')
         }
+
+    @dynamodb_ex_handler()
+    def query_sql_many(
+        self,
+        statements: t.Iterable[t.Any],
+        decrypt: t.Optional[bool] = False
+    ) -> t.List[t.Dict[str, t.Any]]:
+        results: t.List[t.Dict[str, t.Any]] = []
+        requests = []
+        read_kwargs = get_consistent_read_kwargs(get_consistency(self.config))
+        for (statement, parameters) in get_sql_statements(statements):
+            results.append({'items': [], 'next': None, 'error': None})
+            try:
+                (statement, parameters) = kms_blind_index_sql(
+                    self.config, statement, parameters
+                )
+                (statement, params) = get_sql_params(
+                    statement, parameters, serialize_dynamodb_type, '?'
+                )
+            except ex.NoSQLException as e:
+                results[-1]['error'] = e
+                continue
+            request: t.Dict[str, t.Any] = {
+                'Statement': statement, **read_kwargs
+            }
+            if len(params):
+                request['Parameters'] = params
+            requests.append((len(results) - 1, request))
+
+        # max 25 statements per BatchExecuteStatement, batches concurrent
+        @dynamodb_ex_handler()
+        def _execute(batch):
+            logging.debug(f'query_sql_many() table: {self.name}, {batch}')
+            return self.client.batch_execute_statement(
+                Statements=[request for (_, request) in batch]
+            ).get('Responses', [])
+
+        def _batch(batch):
+            # failed (eg throttled) batch is an error for its statements
+            try:
+                return _execute(batch)
+            except ex.NoSQLException as e:
+                return e
+
+        batches = [
+            (requests[i:i + 25],) for i in range(0, len(requests), 25)
+        ]
+        found = []
+        for (batch,), responses in zip(batches, map_concurrent(
+            _batch, batches, get_query_max_workers(self.config)
+        )):
+            if isinstance(responses, ex.NoSQLException):
+                for (i, _) in batch:
+                    results[i]['error'] = responses
+                continue
+            for (i, _), response in zip(batch, responses):
+                error = response.get('Error')
+                if error is not None:
+                    results[i]['error'] = (
+                        ex.NotFoundException
+                        if error.get('Code') == 'ResourceNotFound'
+                        else ex.ValidationException
+                    )(detail=error.get('Message', error.get('Code')))
+                elif 'Item' in response:
+                    found.append((i, from_item(response['Item'])))
+
+        # decrypt items of all statements together, one decrypt_many()
+        items = kms_process_query_items(
+            self.config, [item for (_, item) in found], decrypt
+        )
+        for (i, _), item in zip(found, items):
+            results[i]['items'] = [item]
+        return results
+
+    @dynamodb_ex_handler()
+    def describe(self) -> t.Dict[str, t.Any]:
+        logging.debug(f'describe() table: {self.name}')
+        response = self.client.describe_table(TableName=self.name)['Table']
+
+        def _key_attrs(key_schema):
+            # HASH before RANGE
+            return [
+                _['AttributeName'] for _ in sorted(
+                    key_schema, key=lambda _: _['KeyType'] != 'HASH'
+                )
+            ]
+
+        indexes = []
+        for _type in ['global', 'local']:
+            attr = _type.capitalize() + 'SecondaryIndexes'
+            for index in response.get(attr, []):
+                indexes.append({
+                    'name': index['IndexName'],
+                    'type': _type,
+                    'key_attrs': _key_attrs(index['KeySchema']),
+                    'projection': index.get('Projection', {}).get(
+                        'ProjectionType', 'ALL'
+                    )
+                })
+        return {
+            'key_attrs': _key_attrs(response['KeySchema']),
+            'indexes': indexes
+        }
@@ -1,5 +1,8 @@
 from base64 import b64decode
 from base64 import b64encode
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
 import functools
 import json
 import logging
@@ -16,14 +19,31 @@ from abnosql.plugin import PM
 from abnosql.table import check_exists_enabled
 from abnosql.table import delete_item_post
 from abnosql.table import delete_item_pre
+from abnosql.table import get_consistency
 from abnosql.table import get_item_post
 from abnosql.table import get_item_pre
+from abnosql.table import get_items_post
+from abnosql.table import get_items_pre
 from abnosql.table import get_key_attrs
+from abnosql.table import get_projection
+from abnosql.table import get_query_condition
+from abnosql.table import get_write_returns
+from abnosql.table import kms_blind_index_filters
+from abnosql.table import kms_blind_index_sql
 from abnosql.table import kms_process_query_items
+from abnosql.table import kms_query_projection
+from abnosql.table import match_condition
 from abnosql.table import parse_connstr
+from abnosql.table import project_item
 from abnosql.table import put_item_post
 from abnosql.table import put_item_pre
+from abnosql.table import put_items_pre
+from abnosql.table import query_sql_concurrent
 from abnosql.table import TableBase
+from abnosql.table import transact_write_post
+from abnosql.table import transact_write_pre
+from abnosql.table import update_item_post
+from abnosql.table import update_item_pre
 from abnosql.table import validate_query_attrs
 
 import sqlglot
@@ -48,6 +68,77 @@ OPERATORS = {
 }
 
 
+def get_firestore_filters(
+    k: str, val: t.Any
+) -> t.List[t.Tuple[str, str, t.Any]]:
+    """Get where() filters for query() key or filter value
+
+    Args:
+
+        k: attribute name
+        val: key or filter value, see get_query_condition()
+
+    Returns:
+
+        list of (field, operator, value) filters
+
+    """
+    (op, val) = get_query_condition(val)
+    if op == 'begins_with':
+        # prefix range, \uf8ff is a high code point sorting after others
+        return [(k, '>=', val), (k, '<', val + '\uf8ff')]
+    if op == 'between':
+        return [(k, '>=', val[0]), (k, '<=', val[1])]
+    if op == 'exists':
+        if val is not True:
+            raise ex.ValidationException(
+                'firestore cannot query for missing attributes'
+            )
+        return [(k, '!=', None)]
+    if op == 'contains':
+        return [(k, 'array_contains', val)]
+    if op == 'in':
+        return [(k, 'in', list(val))]
+    return [(k, '==' if op == '=' else op, val)]
+
+
+def get_update_data(
+    operations: t.List[t.Tuple[str, str, t.Any]],
+    item: t.Optional[t.Dict] = None
+) -> t.Dict[str, t.Any]:
+    """Get update() data for update_item_pre() operations
+
+    There is no conditional field transform, so set_if_not_exists is
+    only included if the current item is given (and the attribute is
+    missing from it)
+
+    Args:
+
+        operations: list of (attribute, operator, value)
+        item: optional current item
+
+    Returns:
+
+        dict of field to value or transform
+
+    """
+    data = {}
+    for (k, op, val) in operations:
+        if op == 'set':
+            data[k] = val
+        elif op == 'set_if_not_exists':
+            if item is not None and k not in item:
+                data[k] = val
+        elif op == 'increment':
+            data[k] = firestore.Increment(val)
+        elif op == 'append':
+            # note ArrayUnion only adds elements not already present
+            data[k] = firestore.ArrayUnion(val)
+        elif op == 'remove':
+            data[k] = firestore.DELETE_FIELD
+    return data
+
+
 def firestore_ex_handler(raise_not_found: t.Optional[bool] = True):
     def decorator(func):
         @functools.wraps(func)
@@ -81,6 +172,8 @@ class Table(TableBase):
         self.client = self.config.get('client', self.get_client())
         self.key_attrs = get_key_attrs(self.config)
         self.check_exists = check_exists_enabled(self.config)
+        self.binary = True
+        self.ttl_format = 'datetime'
         self.table = self.client.collection(name)
         self.docid_delim = self.config.get('docid_delim', ':')
         self.batch = None
@@ -127,6 +220,21 @@ class Table(TableBase):
             raise ValueError('key length must be 1 or 2')
         return self.docid_delim.join(key)
 
+    def _read_kwargs(self, consistency: t.Optional[str]) -> t.Dict:
+        # reads are strongly consistent, eventual uses stale reads (at a
+        # read_time in the past) which can be served with lower latency
+        if consistency != 'eventual':
+            return {}
+        stale_secs = float(self.config.get(
+            'firestore_stale_secs',
+            os.environ.get('ABNOSQL_FIRESTORE_STALE_SECS', '15')
+        ))
+        return {
+            'read_time': datetime.now(timezone.utc) - timedelta(
+                seconds=stale_secs
+            )
+        }
+
     @firestore_ex_handler()
     def set_config(self, config: t.Optional[dict]):
         if config is None:
@@ -138,22 +246,73 @@ class Table(TableBase):
 
     @firestore_ex_handler()
     def get_item(self, **kwargs) -> t.Optional[t.Dict]:
+        attributes = kwargs.pop('attributes', None)
+        consistency = get_consistency(
+            self.config, kwargs.pop('consistency', None)
+        )
         audit_key, _ = get_item_pre(self, dict(**kwargs))
 
-        doc = self.table.document(self._docid(**kwargs)).get()
+        projection = get_projection(self, attributes)
+        ref = self.table.document(self._docid(**kwargs))
+        read_kwargs = self._read_kwargs(consistency)
+        if projection:
+            read_kwargs['field_paths'] = projection
+        doc = ref.get(**read_kwargs)
         item = doc.to_dict() if doc.exists else None
 
-        return get_item_post(self, dict(**kwargs), item, audit_key)
+        return get_item_post(
+            self, dict(**kwargs), item, audit_key, attributes
+        )
+
+    @firestore_ex_handler()
+    def get_items(
+        self,
+        keys: t.Iterable[t.Dict[str, t.Any]],
+        attributes: t.Optional[t.List[str]] = None,
+        consistency: t.Optional[str] = None
+    ) -> t.List[t.Optional[t.Dict]]:
+        keys = get_items_pre(self, keys)
+        projection = get_projection(self, attributes)
+        read_kwargs = self._read_kwargs(
+            get_consistency(self.config, consistency)
+        )
+        if projection:
+            read_kwargs['field_paths'] = projection
+
+        # get_all() doesnt return documents in order so map by doc id
+        docids = [self._docid(**key) for key in keys]
+        found = {}
+        refs = [
+            self.table.document(docid) for docid in dict.fromkeys(docids)
+        ]
+        for doc in self.client.get_all(refs, **read_kwargs):
+            if doc.exists:
+                found[doc.id] = doc.to_dict()
+        items = [found.get(docid) for docid in docids]
+
+        return get_items_post(self, keys, items, attributes)
 
     @firestore_ex_handler()
     def put_item(
         self,
         item: t.Dict,
         update: t.Optional[bool] = False,
-        audit_user: t.Optional[str] = None
-    ) -> t.Dict:
+        audit_user: t.Optional[str] = None,
+        returns: t.Optional[str] = None
+    ) -> t.Optional[t.Dict]:
+        returns = get_write_returns(self.config, returns)
         item, _ = put_item_pre(self, item, update, audit_user)
+        item = self._put_item(item, update, returns)
+        return put_item_post(
+            self, item, update, audit_user, returns=returns
+        )
 
+    def _put_item(
+        self,
+        item: t.Dict,
+        update: t.Optional[bool] = False,
+        returns: t.Optional[str] = None
+    ):
         # do update
         docid = self._docid(**item)
         ref = self.table.document(docid)
@@ -170,29 +329,84 @@ class Table(TableBase):
             else:
                 ref.set(item)
 
-        # firestore doesnt return updated item, so make this optional if needed
+        # firestore doesnt return updated item, so read it if returns all
+        # (only needed for updates, put_get config always reads it)
         # note encrypted attrs won't be decrypted
-        if self.config.get('put_get') is True:
+        if (returns == 'all' and update is True) or (
+            returns is None and self.config.get('put_get') is True
+        ):
             item = self.table.document(docid).get().to_dict()
 
-        return put_item_post(self, item, update, audit_user)
+        return item
 
     @firestore_ex_handler()
     def put_items(
         self,
         items: t.Iterable[t.Dict],
         update: t.Optional[bool] = False,
-        audit_user: t.Optional[str] = None
-    ):
+        audit_user: t.Optional[str] = None,
+        returns: t.Optional[str] = None
+    ) -> t.Optional[t.List[t.Dict]]:
+        returns = get_write_returns(self.config, returns)
         if self.config.get('batchmode') is not False:
             self.batch = self.client.batch()
-        for item in items:
-            self.put_item(item, update=update, audit_user=audit_user)
+        items = list(items)
+        _items = []
+        for item in put_items_pre(self, items, update, audit_user):
+            # batched writes aren't committed yet, so read after commit
+            item = self._put_item(
+                item, update, 'updated' if self.batch else returns or 'none'
+            )
+            _items.append(put_item_post(self, item, update, audit_user))
         self.pm.hook.put_items_post(table=self.name, items=items)
         if self.config.get('batchmode') is not False:
             if self.batch is not None:
                 self.batch.commit()
+                if returns == 'all' and update is True:
+                    _items = self._get_docs(_items)
             self.batch = None
+        return None if returns in [None, 'none'] else _items
+
+    def _get_docs(self, items: t.List[t.Dict]) -> t.List[t.Dict]:
+        # get_all() doesnt return documents in order so map by doc id
+        docids = [self._docid(**item) for item in items]
+        found = {
+            doc.id: doc.to_dict() for doc in self.client.get_all([
+                self.table.document(docid)
+                for docid in dict.fromkeys(docids)
+            ])
+            if doc.exists
+        }
+        return [found[docid] for docid in docids]
+
+    @firestore_ex_handler()
+    def update_item(
+        self,
+        key: t.Dict[str, t.Any],
+        updates: t.Dict[str, t.Any],
+        audit_user: t.Optional[str] = None
+    ) -> t.Dict:
+        key, operations = update_item_pre(self, key, updates, audit_user)
+        ref = self.table.document(self._docid(**key))
+
+        # no conditional field transform, so read in transaction for
+        # set_if_not_exists, otherwise update() fails if item not found
+        if any(op == 'set_if_not_exists' for (_, op, _) in operations):
+            @firestore.transactional
+            def _update(transaction):
+                doc = next(iter(transaction.get(ref)), None)
+                if doc is None or not doc.exists:
+                    raise ex.NotFoundException('item not found')
+                data = get_update_data(operations, doc.to_dict())
+                if len(data):
+                    transaction.update(ref, data)
+            _update(self.client.transaction())
+        else:
+            ref.update(get_update_data(operations))
+
+        # firestore doesnt return updated item
+        item = ref.get().to_dict()
+        return update_item_post(self, item, audit_user)
 
     @firestore_ex_handler()
     def delete_item(self, **kwargs):
@@ -202,6 +416,48 @@ class Table(TableBase):
         self.table.document(docid).delete()
         delete_item_post(self, key)
 
+    @firestore_ex_handler()
+    def transact_write(
+        self,
+        operations: t.Iterable[t.Dict[str, t.Any]],
+        audit_user: t.Optional[str] = None
+    ) -> None:
+        _operations = transact_write_pre(self, operations, audit_user)
+        refs = [
+            op['table'].table.document(op['table']._docid(**op['key']))
+            for op in _operations
+        ]
+
+        # reads must be before writes, the transaction is retried if
+        # documents read (for conditions and updates) change before commit
+        @firestore.transactional
+        def _write(transaction):
+            items = []
+            for i, (op, ref) in enumerate(zip(_operations, refs)):
+                item = None
+                if op['condition'] or op['action'] in ['update', 'check']:
+                    doc = next(iter(transaction.get(ref)), None)
+                    if doc is not None and doc.exists:
+                        item = doc.to_dict()
+                    if (
+                        item is None and op['action'] in ['update', 'check']
+                    ) or not match_condition(item, op['condition']):
+                        raise ex.TransactionException(
+                            detail=f'condition check failed on operation {i}'
+                        )
+                items.append(item)
+            for op, ref, item in zip(_operations, refs, items):
+                if op['action'] == 'put':
+                    transaction.set(ref, op['item'])
+                elif op['action'] == 'delete':
+                    transaction.delete(ref)
+                elif op['action'] == 'update':
+                    data = get_update_data(op['operations'], item)
+                    if len(data):
+                        transaction.update(ref, data)
+        _write(self.client.transaction())
+        transact_write_post(_operations, audit_user)
+
     @firestore_ex_handler()
     def query(
         self,
@@ -209,26 +465,54 @@ class Table(TableBase):
         filters: t.Optional[t.Dict[str, t.Any]] = None,
         limit: t.Optional[int] = None,
         next: t.Optional[str] = None,
-        index: t.Optional[str] = None
+        index: t.Optional[str] = None,
+        decrypt: t.Optional[bool] = False,
+        attributes: t.Optional[t.List[str]] = None,
+        fill: t.Optional[bool] = False,
+        consistency: t.Optional[str] = None
     ) -> t.Dict[str, t.Any]:
-        filters = filters or {}
+        filters = kms_blind_index_filters(self.config, filters) or {}
         key = key or {}
         validate_query_attrs(key, filters)
-        parameters = {
-            f'@{k}': v for k, v in
-            (filters | key).items()
-        }
-        statement = 'SELECT * FROM table'
-        op = 'WHERE'
-        for param in parameters.keys():
-            statement += f' {op} {param} = @{param}'
-            op = 'AND'
-        return self.query_sql(
-            statement,
-            parameters,
+        # build where filters directly as SQL can't express all operators
+        where = []
+        for k, v in (filters | key).items():
+            where.extend(get_firestore_filters(k, v))
+        resp = self._query(
+            where,
+            (
+                get_projection(self, attributes)
+                or kms_query_projection(self, decrypt)
+                or []
+            ),
             limit=limit,
-            next=next
+            next=next,
+            decrypt=decrypt,
+            consistency=consistency
         )
+        resp['items'] = [
+            project_item(self, _, attributes) for _ in resp['items']
+        ]
+        return resp
+
+    @firestore_ex_handler()
+    def count(
+        self,
+        key: t.Optional[t.Dict[str, t.Any]] = None,
+        filters: t.Optional[t.Dict[str, t.Any]] = None,
+        index: t.Optional[str] = None
+    ) -> int:
+        filters = kms_blind_index_filters(self.config, filters) or {}
+        key = key or {}
+        validate_query_attrs(key, filters)
+        query = self.table
+        for k, v in (filters | key).items():
+            for (col, op, val) in get_firestore_filters(k, v):
+                query = query.where(col, op, val)
+        logging.debug(f'count() table: {self.name}')
+        # aggregation query, documents aren't returned
+        results = query.count().get()
+        return int(results[0][0].value) if len(results) else 0
 
     @firestore_ex_handler()
     def query_sql(
@@ -236,10 +520,14 @@ class Table(TableBase):
         statement: str,
         parameters: t.Optional[t.Dict[str, t.Any]] = None,
         limit: t.Optional[int] = None,
-        next: t.Optional[str] = None
+        next: t.Optional[str] = None,
+        decrypt: t.Optional[bool] = False,
+        consistency: t.Optional[str] = None
     ) -> t.Dict[str, t.Any]:
-        limit = limit or 100
         parameters = parameters or {}
+        (statement, parameters) = kms_blind_index_sql(
+            self.config, statement, parameters
+        )
         select = None
         try:
             select = sqlglot.parse_one(statement)
@@ -249,8 +537,7 @@ class Table(TableBase):
             raise ex.ValidationException(detail='only SELECT is supported')
 
         # parse the sql using sqlglot (there must be a better way to do below)
-        filters = []
-        query = self.table
+        filters: t.List[t.Tuple[str, str, t.Any]] = []
         where = select.find(exp.Where)
         if where:
             for cond in where.find_all(exp.Condition):
@@ -258,20 +545,59 @@ class Table(TableBase):
                     continue
                 column = cond.this.name
                 expr = cond.expression
-                operator = OPERATORS.get(type(cond))  # type: ignore
+                operator = OPERATORS[type(cond)]  # type: ignore
                 val = expr.this.name
                 pval = parameters.get(f'@{val}')
                 if isinstance(expr, exp.Column):
-                    filters.append([column, operator, val])
+                    filters.append((column, operator, val))
                 elif isinstance(expr, exp.Parameter) and pval is not None:
-                    filters.append([column, operator, pval])
+                    filters.append((column, operator, pval))
+
+        # project selected columns (if not SELECT *)
+        columns = [
+            col.name for col in select.expressions
+            if isinstance(col, exp.Column)
+        ]
+        return self._query(
+            filters, columns, limit, next, decrypt, consistency
+        )
+
+    @firestore_ex_handler()
+    def query_sql_many(
+        self,
+        statements: t.Iterable[t.Any],
+        decrypt: t.Optional[bool] = False
+    ) -> t.List[t.Dict[str, t.Any]]:
+        return query_sql_concurrent(self, statements, decrypt)
+
+    @firestore_ex_handler()
+    def describe(self) -> t.Dict[str, t.Any]:
+        # composite indexes are only available via the admin API and
+        # are used automatically by queries
+        return {
+            'key_attrs': list(self.key_attrs),
+            'indexes': []
+        }
 
-        logging.debug(f'query_sql() table: {self.name}, filters: {filters}')
+    def _query(
+        self,
+        filters: t.List[t.Tuple[str, str, t.Any]],
+        columns: t.List[str],
+        limit: t.Optional[int] = None,
+        next: t.Optional[str] = None,
+        decrypt: t.Optional[bool] = False,
+        consistency: t.Optional[str] = None
+    ) -> t.Dict[str, t.Any]:
+        limit = limit or 100
+        logging.debug(f'query() table: {self.name}, filters: {filters}')
         query = self.table
 
         for (col, op, val) in filters:
             query = query.where(col, op, val)
 
+        if len(columns):
+            query = query.select(columns)
+
         # don't order as it messes up pagination
         if next is not None:
             query = query.start_at(
@@ -287,7 +613,10 @@ class Table(TableBase):
         c = 0
         items = []
         last = None
-        for doc in query.stream():
+        read_kwargs = self._read_kwargs(
+            get_consistency(self.config, consistency)
+        )
+        for doc in query.stream(**read_kwargs):
             c += 1
             item = doc.to_dict()
             if c < limit + 1:
@@ -299,7 +628,7 @@ class Table(TableBase):
 
         if c < limit + 1:
             last = None
-        items = kms_process_query_items(self.config, items)
+        items = kms_process_query_items(self.config, items, decrypt)
         return {
             'items': items,
             'next': last
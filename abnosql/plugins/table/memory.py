@@ -1,33 +1,115 @@
 import functools
 import json
+import re
+import threading
+import time
 import typing as t
 
 import pluggy  # type: ignore
 import sqlglot  # type: ignore
 from sqlglot.executor import execute  # type: ignore
-from sqlglot import exp  # type: ignore
+from sqlglot.executor.env import ENV  # type: ignore
 from sqlglot import parse_one  # type: ignore
 
 import abnosql.exceptions as ex
 from abnosql.plugin import PM
+from abnosql.table import apply_update
 from abnosql.table import check_exists_enabled
 from abnosql.table import delete_item_post
 from abnosql.table import delete_item_pre
+from abnosql.table import get_consistency
 from abnosql.table import get_item_post
 from abnosql.table import get_item_pre
+from abnosql.table import get_items_post
+from abnosql.table import get_items_pre
 from abnosql.table import get_key_attrs
+from abnosql.table import get_projection
+from abnosql.table import get_sql_condition
 from abnosql.table import get_sql_params
+from abnosql.table import get_sql_select
+from abnosql.table import get_ttl_config
+from abnosql.table import get_write_returns
+from abnosql.table import kms_blind_index_filters
+from abnosql.table import kms_blind_index_sql
 from abnosql.table import kms_process_query_items
+from abnosql.table import kms_query_projection
+from abnosql.table import match_condition
+from abnosql.table import project_item
 from abnosql.table import put_item_post
 from abnosql.table import put_item_pre
+from abnosql.table import put_items_post
+from abnosql.table import put_items_pre
+from abnosql.table import query_sql_concurrent
 from abnosql.table import quote_str
 from abnosql.table import TableBase
+from abnosql.table import transact_write_post
+from abnosql.table import transact_write_pre
+from abnosql.table import unflatten_sql_item
+from abnosql.table import update_item_post
+from abnosql.table import update_item_pre
 from abnosql.table import validate_query_attrs
 
 
 hookimpl = pluggy.HookimplMarker('abnosql.table')
 
 TABLES: t.Dict = {}
+# serializes update_item() and transact_write() read-modify-writes
+LOCK = threading.RLock()
+
+
+def _json_list(val: t.Any) -> t.Any:
+    # list/dict attributes are stored as JSON strings for sqlglot
+    if isinstance(val, str) and val[:1] == '[':
+        try:
+            return json.loads(val)
+        except ValueError:
+            pass
+    return val
+
+
+def _contains(val: t.Any, sub: t.Any) -> bool:
+    # substring only, lists are handled by _array_contains
+    return (
+        isinstance(val, str)
+        and isinstance(_json_list(val), str)
+        and isinstance(sub, str)
+        and sub in val
+    )
+
+
+def _array_contains(val: t.Any, elem: t.Any) -> bool:
+    val = _json_list(val)
+    return isinstance(val, list) and elem in val
+
+
+# emulate cosmos SQL system functions used by query()
+ENV.update({
+    'STARTSWITH': lambda val, prefix: (
+        isinstance(val, str) and val.startswith(prefix)
+    ),
+    'CONTAINS': _contains,
+    'ARRAY_CONTAINS': _array_contains,
+    'ARRAYCONTAINS': _array_contains,
+    'IS_DEFINED': lambda val: val is not None
+})
+
+
+def _get_path(item: t.Dict, path: str) -> t.Any:
+    val: t.Any = item
+    for part in path.split('.'):
+        if not isinstance(val, dict):
+            return None
+        val = val.get(part)
+    return val
+
+
+def _expired(
+    item: t.Optional[t.Dict], attr: t.Optional[str], now: float
+) -> bool:
+    return (
+        attr is not None and item is not None
+        and isinstance(item.get(attr), (int, float)) and item[attr] <= now
+    )
 
 
 def clear_tables():
@@ -76,23 +158,67 @@ def query_items(
     # cosmos style placeholders
     elif '@' in statement:
         _nparams = {pd['name']: pd['value'] for pd in parameters}
-        for _param, _val in _nparams.items():
+        # longest first so @k doesn't replace the start of @k_0
+        for _param in sorted(_nparams, key=len, reverse=True):
+            _val = _nparams[_param]
             if isinstance(_val, str):
                 _val = quote_str(_val)
             statement = statement.replace(_param, str(_val))
 
+    # cosmos SELECT VALUE returns values instead of objects, eg
+    # SELECT VALUE COUNT(1), so alias the expression and unwrap it
+    value = re.match(r'^\s*SELECT\s+VALUE\s+(.+?)\s+FROM\s', statement, re.I)
+    if value:
+        statement = (
+            f'SELECT {value.group(1)} AS value FROM '
+            + statement[value.end():]
+        )
+
     # azure cosmos can often have alias table names eg SELECT * FROM c
     # so get table name from statement.  Don't query if no items
     table_name = get_table_name(statement)
     if len(items) == 0:
         return []
 
+    # sqlglot can't select nested paths eg c.obj.foo so add them to the
+    # items as flattened attributes eg obj__foo
+    paths = list(dict.fromkeys(re.findall(
+        rf'\b{table_name}\.([a-zA-Z0-9_]+(?:\.[a-zA-Z0-9_]+)+)', statement
+    )))
+    if len(paths):
+        for path in paths:
+            statement = re.sub(
+                rf'\b{table_name}\.{re.escape(path)}\b',
+                f'{table_name}.{path.replace(".", "__")}',
+                statement
+            )
+        _items = []
+        for item in items:
+            item = dict(item)
+            for path in paths:
+                val = _get_path(item, path)
+                if val is not None:
+                    item[path.replace('.', '__')] = val
+            _items.append(item)
+        items = _items
+
     # sqlglot execute can't handle dict or list keys...
     # also doesnt like camelCase attribute names because expects them to be
     # lower case, so detect and convert to lower
+    # sqlglot takes columns from first item, so add missing (including
+    # referenced) attributes as None and remove them from the results
+    _columns = list(dict.fromkeys(
+        [k.lower() for item in items for k in item]
+        + [
+            k.lower() for k in re.findall(
+                rf'\b{table_name}\.([a-zA-Z0-9_]+)', statement
+            )
+        ]
+    ))
     _items = []
     _unpack = {}
     _lower = {}
+    _missing = set()
     for item in items:
         new_item = {}
         for camel in item.keys():
@@ -105,27 +231,37 @@ def query_items(
                 _unpack[camel] = True
                 v = json.dumps(v)
             new_item[attr] = v
+        for attr in _columns:
+            if attr not in new_item:
+                _missing.add(attr)
+                new_item[attr] = None
         _items.append(new_item)
 
-    # get any offset supplied
-    offset = None
-    for _offset in parse_one(statement).find_all(exp.Offset):  # type: ignore
-        offset = _offset
-        break
-    if offset:
+    # sqlglot executor ignores OFFSET, so remove OFFSET and LIMIT and
+    # slice the filtered rows instead
+    query = parse_one(statement)
+    slices = {}
+    for arg in ['offset', 'limit']:
+        node = query.args.get(arg)
+        if node is None:
+            continue
+        query.set(arg, None)
         try:
-            offset = int(str(offset).split(' ')[-1])  # type: ignore
+            slices[arg] = max(int(str(node.expression)), 0)
         except Exception:
-            offset = None
-
-    # slice the data via offset
-    if isinstance(offset, int) and offset > 0 and offset < len(_items):
-        _items = _items[offset:]
+            pass
 
     # query the data
-    resp = execute(statement, tables={table_name: _items})
+    resp = execute(query, tables={table_name: _items})
+    if len(slices):
+        start = slices.get('offset', 0)
+        end = start + slices['limit'] if 'limit' in slices else None
+        resp.rows = resp.rows[start:end]
     rows = [
-        dict(zip(resp.columns, row))
+        {
+            k: v for k, v in zip(resp.columns, row)
+            if not (v is None and k in _missing)
+        }
         for row in resp.rows
     ]
 
@@ -133,13 +269,17 @@ def query_items(
     if len(_lower):
         for i in range(len(rows)):
             for attr, camel in _lower.items():
-                rows[i][camel] = rows[i].pop(attr, None)
+                if attr in rows[i]:
+                    rows[i][camel] = rows[i].pop(attr)
 
     # unpack
     if len(_unpack):
         for i in range(len(rows)):
             for k in _unpack.keys():
-                rows[i][k] = json.loads(rows[i][k])
+                if k in rows[i]:
+                    rows[i][k] = json.loads(rows[i][k])
+    if value:
+        return [row['value'] for row in rows]
     return rows
 
 
@@ -173,6 +313,8 @@ class Table(TableBase):
         self.set_config(config)
         self.key_attrs = get_key_attrs(self.config)
         self.check_exists = check_exists_enabled(self.config)
+        self.binary = True
+        self.ttl_format = 'epoch'
         self.items = self.config.get('items', {})
 
     @memory_ex_handler()
@@ -186,27 +328,70 @@ class Table(TableBase):
 
     @memory_ex_handler()
     def get_item(self, **kwargs) -> t.Dict:
+        attributes = kwargs.pop('attributes', None)
+        get_consistency(self.config, kwargs.pop('consistency', None))
         audit_key, _ = get_item_pre(self, dict(**kwargs))
+        get_projection(self, attributes)  # validate
 
         key = get_key(**kwargs)
         item = None
+        self._evict([key])
         if self.items:
             item = self.items.get(key)
         else:
             global TABLES
             item = TABLES.get(self.name, {}).get(key)
+        # copy so decryption doesn't modify stored item
+        item = item.copy() if item is not None else None
 
-        return get_item_post(self, dict(**kwargs), item, audit_key)
+        return get_item_post(
+            self, dict(**kwargs), item, audit_key, attributes
+        )
+
+    @memory_ex_handler()
+    def get_items(
+        self,
+        keys: t.Iterable[t.Dict[str, t.Any]],
+        attributes: t.Optional[t.List[str]] = None,
+        consistency: t.Optional[str] = None
+    ) -> t.List[t.Optional[t.Dict]]:
+        keys = get_items_pre(self, keys)
+        get_projection(self, attributes)  # validate
+        get_consistency(self.config, consistency)
+
+        global TABLES
+        _keys = [get_key(**key) for key in keys]
+        self._evict(_keys)
+        items = [
+            (self.items or TABLES.get(self.name, {})).get(_key)
+            for _key in _keys
+        ]
+        # copy so decryption doesn't modify stored items
+        items = [_.copy() if _ is not None else None for _ in items]
+
+        return get_items_post(self, keys, items, attributes)
 
     @memory_ex_handler()
     def put_item(
         self,
         item: t.Dict,
         update: t.Optional[bool] = False,
-        audit_user: t.Optional[str] = None
-    ) -> t.Dict:
+        audit_user: t.Optional[str] = None,
+        returns: t.Optional[str] = None
+    ) -> t.Optional[t.Dict]:
+        returns = get_write_returns(self.config, returns)
         item, _ = put_item_pre(self, item, update, audit_user)
+        item = self._put_item(item, update, returns)
+        return put_item_post(
+            self, item, update, audit_user, returns=returns
+        )
 
+    def _put_item(
+        self,
+        item: t.Dict,
+        update: t.Optional[bool] = False,
+        returns: t.Optional[str] = None
+    ):
         _key = ':'.join([item[_] for _ in self.key_attrs])
         if self.items:
             if update is True:
@@ -221,20 +406,61 @@ class Table(TableBase):
                 TABLES[self.name][_key].update(item)
             else:
                 TABLES[self.name][_key] = item
+        if returns in ['none', 'updated']:
+            return dict(item)
         item = TABLES[self.name][_key].copy()
-
-        return put_item_post(self, item, update, audit_user)
+        return item
 
     @memory_ex_handler()
     def put_items(
         self,
         items: t.Iterable[t.Dict],
         update: t.Optional[bool] = False,
+        audit_user: t.Optional[str] = None,
+        returns: t.Optional[str] = None
+    ) -> t.Optional[t.List[t.Dict]]:
+        returns = get_write_returns(self.config, returns)
+        items = list(items)
+        _items = []
+        for item in put_items_pre(self, items, update, audit_user):
+            item = self._put_item(item, update, returns or 'none')
+            _items.append(put_item_post(self, item, update, audit_user))
+        return put_items_post(self, items, _items, returns)
+
+    @memory_ex_handler()
+    def update_item(
+        self,
+        key: t.Dict[str, t.Any],
+        updates: t.Dict[str, t.Any],
         audit_user: t.Optional[str] = None
-    ):
-        for item in items:
-            self.put_item(item, update=update, audit_user=audit_user)
-        self.pm.hook.put_items_post(table=self.name, items=items)
+    ) -> t.Dict:
+        key, operations = update_item_pre(self, key, updates, audit_user)
+        _key = get_key(**key)
+        items = self._table_items(_key)
+        with LOCK:
+            if _key not in items:
+                raise ex.NotFoundException('item not found')
+            item = apply_update(items[_key], operations)
+            items[_key] = item
+        return update_item_post(self, item.copy(), audit_user)
+
+    def _table_items(self, *keys: str) -> t.Dict:
+        global TABLES
+        self._evict(keys)
+        return self.items or TABLES.setdefault(self.name, {})
+
+    def _evict(self, keys: t.Iterable[str]):
+        # expired items are removed lazily when read by key, see add_ttl(),
+        # queries skip them instead so reads never scan the whole table
+        (attr, _) = get_ttl_config(self)
+        if attr is None:
+            return
+        now = time.time()
+        items = self.items or TABLES.get(self.name, {})
+        with LOCK:
+            for _key in keys:
+                if _expired(items.get(_key), attr, now):
+                    items.pop(_key, None)
 
     @memory_ex_handler()
     def delete_item(self, **kwargs):
@@ -249,46 +475,128 @@ class Table(TableBase):
 
         delete_item_post(self, key)
 
+    @memory_ex_handler()
+    def transact_write(
+        self,
+        operations: t.Iterable[t.Dict[str, t.Any]],
+        audit_user: t.Optional[str] = None
+    ) -> None:
+        _operations = transact_write_pre(self, operations, audit_user)
+        with LOCK:
+            # validate all operations then write, so none or all applied
+            writes: t.List[t.Tuple[t.Dict, str, t.Optional[t.Dict]]] = []
+            for i, op in enumerate(_operations):
+                _key = get_key(**op['key'])
+                items = op['table']._table_items(_key)
+                current = items.get(_key)
+                if (
+                    current is None and op['action'] in ['update', 'check']
+                ) or not match_condition(current, op['condition']):
+                    raise ex.TransactionException(
+                        detail=f'condition check failed on operation {i}'
+                    )
+                if op['action'] == 'put':
+                    writes.append((items, _key, dict(op['item'])))
+                elif op['action'] == 'update':
+                    writes.append((
+                        items, _key, apply_update(current, op['operations'])
+                    ))
+                elif op['action'] == 'delete':
+                    writes.append((items, _key, None))
+            for (items, _key, item) in writes:
+                if item is None:
+                    items.pop(_key, None)
+                else:
+                    items[_key] = item
+        transact_write_post(_operations, audit_user)
+
     @memory_ex_handler()
     def query(
         self,
-        key: t.Dict[str, t.Any],
+        key: t.Optional[t.Dict[str, t.Any]] = None,
         filters: t.Optional[t.Dict[str, t.Any]] = None,
         limit: t.Optional[int] = None,
         next: t.Optional[str] = None,
-        index: t.Optional[str] = None
+        index: t.Optional[str] = None,
+        decrypt: t.Optional[bool] = False,
+        attributes: t.Optional[t.List[str]] = None,
+        fill: t.Optional[bool] = False,
+        consistency: t.Optional[str] = None
     ) -> t.Dict[str, t.Any]:
-        filters = filters or {}
-        validate_query_attrs(key, filters)
-        parameters = {
-            f'@{k}': v
-            for k, v in filters.items()
-        }
-        parameters.update({
-            f'@{k}': v
-            for k, v in key.items()
-        })
-        statement = f'SELECT * FROM {self.name}'
-        op = 'WHERE'
-        for param in parameters.keys():
-            statement += f' {op} {self.name}.{param[1:]} = {param}'
-            op = 'AND'
-        items = self.query_sql(statement)
-        items = kms_process_query_items(self.config, items)
+        (where, parameters) = self._where(key, filters)
+        projection = (
+            get_projection(self, attributes)
+            or kms_query_projection(self, decrypt)
+        )
+        select = get_sql_select(self.name, projection)
+        statement = f'SELECT {select} FROM {self.name}{where}'
+        items = [
+            project_item(self, unflatten_sql_item(_, projection), attributes)
+            for _ in self.query_sql(
+                statement, parameters, decrypt=decrypt,
+                consistency=consistency
+            )
+        ]
         return {
             'items': items,
             'next': None
         }
 
+    def _where(
+        self,
+        key: t.Optional[t.Dict[str, t.Any]] = None,
+        filters: t.Optional[t.Dict[str, t.Any]] = None
+    ) -> t.Tuple[str, t.Dict[str, t.Any]]:
+        filters = kms_blind_index_filters(self.config, filters) or {}
+        key = key or {}
+        validate_query_attrs(key, filters)
+        parameters: t.Dict[str, t.Any] = {}
+        conditions = [
+            get_sql_condition(f'{self.name}.{k}', f'@{k}', v, parameters)
+            for k, v in dict(filters, **key).items()
+        ]
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        return (where, parameters)
+
+    def _items(self) -> t.List[t.Dict]:
+        (attr, _) = get_ttl_config(self)
+        now = time.time()
+        return [
+            _ for _ in (self.items or TABLES.get(self.name, {})).values()
+            if not _expired(_, attr, now)
+        ]
+
+    @memory_ex_handler()
+    def count(
+        self,
+        key: t.Optional[t.Dict[str, t.Any]] = None,
+        filters: t.Optional[t.Dict[str, t.Any]] = None,
+        index: t.Optional[str] = None
+    ) -> int:
+        (where, parameters) = self._where(key, filters)
+        (statement, params) = get_sql_params(
+            f'SELECT VALUE COUNT(1) FROM {self.name}{where}',
+            parameters,
+            lambda var, val: {'name': var, 'value': val}
+        )
+        counts: t.List[t.Any] = query_items(statement, self._items(), params)
+        return sum(counts)
+
     @memory_ex_handler()
     def query_sql(
         self,
         statement: str,
         parameters: t.Optional[t.Dict[str, t.Any]] = None,
         limit: t.Optional[int] = None,
-        next: t.Optional[str] = None
+        next: t.Optional[str] = None,
+        decrypt: t.Optional[bool] = False,
+        consistency: t.Optional[str] = None
     ) -> t.List[t.Dict]:
+        get_consistency(self.config, consistency)
         parameters = parameters or {}
+        (statement, parameters) = kms_blind_index_sql(
+            self.config, statement, parameters
+        )
 
         def _get_param(var, val):
             return {'name': var, 'value': val}
@@ -296,12 +604,22 @@ class Table(TableBase):
         (statement, params) = get_sql_params(
             statement, parameters, _get_param
         )
-        items = []
-        if self.items:
-            items = list(self.items.values())
-        else:
-            global TABLES
-            items = list(TABLES.get(self.name, {}).values())
-        items = query_items(statement, items, params, self.name)
-        items = kms_process_query_items(self.config, items)
+        items = query_items(statement, self._items(), params, self.name)
+        items = kms_process_query_items(self.config, items, decrypt)
         return items
+
+    @memory_ex_handler()
+    def query_sql_many(
+        self,
+        statements: t.Iterable[t.Any],
+        decrypt: t.Optional[bool] = False
+    ) -> t.List[t.Dict[str, t.Any]]:
+        return query_sql_concurrent(self, statements, decrypt)
+
+    @memory_ex_handler()
+    def describe(self) -> t.Dict[str, t.Any]:
+        # no secondary indexes
+        return {
+            'key_attrs': list(self.key_attrs),
+            'indexes': []
+        }
@@ -1,11 +1,20 @@
 from abc import ABCMeta  # type: ignore
 from abc import abstractmethod
+from base64 import b64decode
+from base64 import b64encode
 from datetime import datetime
+from datetime import timedelta
 from datetime import timezone
+import copy
+import hashlib
+import hmac
 import json
 import jsonschema  # type: ignore
+import operator
 import os
 import re
+import threading
+import time
 import typing as t
 from urllib.parse import urlparse
 from yaml import safe_load  # type: ignore
@@ -14,6 +23,7 @@ import pluggy  # type: ignore
 
 import abnosql.exceptions as ex
 from abnosql.kms import kms
+from abnosql.kms import map_concurrent
 from abnosql import plugin
 
 hookimpl = pluggy.HookimplMarker('abnosql.table')
@@ -137,6 +147,11 @@ class TableBase(metaclass=ABCMeta):
         Args:
 
             partition key and range/sort key (if used)
+            attributes: optional list of attributes to return (projection),
+                may be nested paths eg ['name', 'obj.foo'], key attributes
+                are always returned
+            consistency: optional read consistency, eventual, session or
+                strong, see get_consistency()
 
         Returns:
 
@@ -145,12 +160,38 @@ class TableBase(metaclass=ABCMeta):
         """
         pass
 
+    @abstractmethod
+    def get_items(
+        self,
+        keys: t.Iterable[t.Dict[str, t.Any]],
+        attributes: t.Optional[t.List[str]] = None,
+        consistency: t.Optional[str] = None
+    ) -> t.List[t.Optional[t.Dict]]:
+        """Get multiple table/collection items
+
+        Args:
+
+            keys: list of key dictionaries containing partition key and
+                range/sort key (if used)
+            attributes: optional list of attributes to return, see get_item()
+            consistency: optional read consistency, see get_consistency()
+
+        Returns:
+
+            list of item dictionaries in same order as keys, with None
+            where item not found (even if check_exists is enabled)
+
+        """
+        pass
+
     @abstractmethod
     def put_item(
         self,
         item: t.Dict,
-        update: t.Optional[bool] = False
-    ) -> t.Dict:
+        update: t.Optional[bool] = False,
+        audit_user: t.Optional[str] = None,
+        returns: t.Optional[str] = None
+    ) -> t.Optional[t.Dict]:
         """Puts table/collection item
 
         Args:
@@ -158,10 +199,11 @@ class TableBase(metaclass=ABCMeta):
             item: dictionary
             update: perform update/patch - item must already exist
             audit_user: optional user / system ID string to add audit attrs
+            returns: optional none, updated or all, see get_write_returns()
 
         Returns:
 
-            item: dictionary of created/updated item
+            item: dictionary of created/updated item, None if returns none
 
         """
         pass
@@ -171,8 +213,9 @@ class TableBase(metaclass=ABCMeta):
         self,
         items: t.Iterable[t.Dict],
         update: t.Optional[bool] = False,
-        audit_user: t.Optional[str] = None
-    ):
+        audit_user: t.Optional[str] = None,
+        returns: t.Optional[str] = None
+    ) -> t.Optional[t.List[t.Dict]]:
         """Puts multiple table/collection items
 
         Args:
@@ -180,6 +223,45 @@ class TableBase(metaclass=ABCMeta):
             items: list of item dictionaries
             update: perform update/patch - items must already exist
             audit_user: user / system ID string to add audit attrs
+            returns: optional none, updated or all, see get_write_returns()
+
+        Returns:
+
+            list of created/updated items if returns updated or all,
+            otherwise None
+
+        """
+        pass
+
+    @abstractmethod
+    def update_item(
+        self,
+        key: t.Dict[str, t.Any],
+        updates: t.Dict[str, t.Any],
+        audit_user: t.Optional[str] = None
+    ) -> t.Dict:
+        """Atomically update attributes of existing table/collection item
+
+        Update values are set, or a dictionary with a single operator and
+        value, see get_update_operation(), eg:
+
+            tb.update_item({'hk': '1'}, {
+                'views': {'increment': 1},
+                'tags': {'append': ['new']},
+                'draft': {'remove': True},
+                'created': {'set_if_not_exists': '2024-01-01'},
+                'title': 'foo'
+            })
+
+        Args:
+
+            key: dictionary containing partition key and range/sort key
+            updates: dictionary of attribute to value or {operator: value}
+            audit_user: optional user / system ID string to add audit attrs
+
+        Returns:
+
+            item: dictionary of updated item
 
         """
         pass
@@ -194,6 +276,38 @@ class TableBase(metaclass=ABCMeta):
         """
         pass
 
+    @abstractmethod
+    def transact_write(
+        self,
+        operations: t.Iterable[t.Dict[str, t.Any]],
+        audit_user: t.Optional[str] = None
+    ) -> None:
+        """Atomically put, update, delete and condition check items, either
+        all operations succeed or none are applied
+
+        Each operation is a dictionary with one of put (item), update
+        (key, with updates, see update_item()), delete (key) or check
+        (key) and an optional condition, see transact_write_pre(), eg:
+
+            tb.transact_write([
+                {'put': {'hk': '1', 'rk': 'b', 'status': 'new'}},
+                {'update': {'hk': '1', 'rk': 'a'}, 'updates': {
+                    'count': {'increment': 1}
+                }},
+                {'delete': {'hk': '1', 'rk': 'c'}},
+                {'check': {'hk': '1', 'rk': 'd'}, 'condition': {
+                    'status': {'in': ['new', 'open']}
+                }}
+            ])
+
+        Args:
+
+            operations: list of operation dictionaries
+            audit_user: optional user / system ID string to add audit attrs
+
+        """
+        pass
+
     @abstractmethod
     def query(
         self,
@@ -201,9 +315,23 @@ class TableBase(metaclass=ABCMeta):
         filters: t.Optional[t.Dict[str, t.Any]] = None,
         limit: t.Optional[int] = None,
         next: t.Optional[str] = None,
-        index: t.Optional[str] = None
+        index: t.Optional[str] = None,
+        decrypt: t.Optional[bool] = False,
+        attributes: t.Optional[t.List[str]] = None,
+        fill: t.Optional[bool] = False,
+        consistency: t.Optional[str] = None
     ) -> t.Dict[str, t.Any]:
-        """Perform key based query with optional exact match filters
+        """Perform key based query with optional filters
+
+        Key and filter values are an exact match, or a dictionary with
+        a single operator and value, see get_query_condition().  The
+        range/sort key can use =, <, <=, >, >=, begins_with or between,
+        filters can also use !=, in, contains or exists, eg:
+
+            tb.query(
+                {'hk': '1', 'rk': {'begins_with': '2024-'}},
+                {'status': {'in': ['new', 'open']}}
+            )
 
         Args:
 
@@ -212,6 +340,13 @@ class TableBase(metaclass=ABCMeta):
             limit: query limit
             next: pagination token
             index: name of index to use (dynamodb only)
+            decrypt: decrypt encrypted attributes instead of removing them
+            attributes: optional list of attributes to return, see get_item()
+            fill: keep fetching pages until limit items match the filters
+                or results run out (dynamodb only, which applies limit
+                before filters), capped by fill_max_pages/fill_max_scanned
+                config, see get_query_fill_caps()
+            consistency: optional read consistency, see get_consistency()
 
         Returns:
             dictionary containing 'items' and 'next' pagination token
@@ -219,13 +354,38 @@ class TableBase(metaclass=ABCMeta):
         """
         pass
 
+    @abstractmethod
+    def count(
+        self,
+        key: t.Optional[t.Dict[str, t.Any]] = None,
+        filters: t.Optional[t.Dict[str, t.Any]] = None,
+        index: t.Optional[str] = None
+    ) -> int:
+        """Count items matching key and filters on the server (or all items
+        if no key), without returning the items
+
+        Args:
+
+            key: dictionary containing partition key and range/sort key,
+                see query()
+            filters: optional dictionary of key=value to filter on
+            index: name of index to use (dynamodb only)
+
+        Returns:
+            number of items
+
+        """
+        pass
+
     @abstractmethod
     def query_sql(
         self,
         statement: str,
         parameters: t.Optional[t.Dict[str, t.Any]] = None,
         limit: t.Optional[int] = None,
-        next: t.Optional[str] = None
+        next: t.Optional[str] = None,
+        decrypt: t.Optional[bool] = False,
+        consistency: t.Optional[str] = None
     ) -> t.Dict[str, t.Any]:
         """Perform key based query with optional exact match filters
 
@@ -235,6 +395,8 @@ class TableBase(metaclass=ABCMeta):
             parameters: optional dictionary containing @key = value placeholders
             limit: query limit
             next: pagination token
+            decrypt: decrypt encrypted attributes instead of removing them
+            consistency: optional read consistency, see get_consistency()
 
         Returns:
             dictionary containing 'items' and 'next' pagination token
@@ -242,6 +404,187 @@ class TableBase(metaclass=ABCMeta):
         """
         pass
 
+    @abstractmethod
+    def query_sql_many(
+        self,
+        statements: t.Iterable[t.Any],
+        decrypt: t.Optional[bool] = False
+    ) -> t.List[t.Dict[str, t.Any]]:
+        """Perform multiple SQL queries, batched (dynamodb) or concurrently
+
+        DynamoDB uses BatchExecuteStatement, so statements must be single
+        item reads (partition key and range/sort key equality)
+
+        Args:
+
+            statements: list of statement strings or (statement,
+                parameters) tuples, see query_sql()
+            decrypt: decrypt encrypted attributes instead of removing them
+
+        Returns:
+            list of dictionaries in same order as statements containing
+            'items', 'next' pagination token (first page only) and 'error'
+            (NoSQLException or None)
+
+        """
+        pass
+
+    @abstractmethod
+    def describe(self) -> t.Dict[str, t.Any]:
+        """Describe table metadata from the database (uncached), use
+        get_table_metadata() for the cached version
+
+        Returns:
+            dictionary containing 'key_attrs' list, 'indexes' list of
+            dictionaries containing 'name', 'type' (global or local),
+            'key_attrs' and 'projection' (ALL, KEYS_ONLY or INCLUDE) plus
+            any database specific metadata eg cosmos 'indexing_policy'
+
+        """
+        pass
+
+
+def get_projection(
+    tb, attributes: t.Optional[t.Iterable[str]] = None
+) -> t.Optional[t.List[str]]:
+    """Get attribute paths to project for attributes kwarg
+
+    Key attributes are always projected.  Nested paths within encrypted
+    attributes are projected as the whole attribute so it can be decrypted
+    (see project_item()).
+
+    Args:
+
+        tb: table instance
+        attributes: optional list of attribute names or dot separated
+            nested paths, eg ['name', 'obj.foo']
+
+    Returns:
+
+        list of attribute paths or None for all attributes
+
+    """
+    if attributes is None:
+        return None
+    if isinstance(attributes, str):
+        raise ex.ValidationException('attributes must be a list')
+    attributes = list(attributes)
+    _name_pat = re.compile(r'^[a-zA-Z0-9_-]+$')
+    invalid = [
+        str(_) for _ in attributes
+        if not isinstance(_, str)
+        or not all(_name_pat.match(part) for part in _.split('.'))
+    ]
+    if len(invalid) or len(attributes) == 0:
+        raise ex.ValidationException(
+            'invalid attributes: ' + ', '.join(invalid)
+        )
+    kcfg = tb.config.get('kms') or {}
+    enc_attrs = kcfg.get('attrs', [])
+    paths = tb.key_attrs + kcfg.get('key_attrs', []) + [
+        _.split('.')[0] if _.split('.')[0] in enc_attrs else _
+        for _ in attributes
+    ]
+    # overlapping paths are invalid in dynamodb, so keep the parent
+    return [
+        path for path in dict.fromkeys(paths)
+        if not any(path.startswith(_ + '.') for _ in paths)
+    ]
+
+
+def project_item(
+    tb, item: t.Optional[t.Dict], attributes: t.Optional[t.Iterable[str]]
+) -> t.Optional[t.Dict]:
+    """Project item to key attributes and attributes kwarg paths
+
+    Providers project on the server, this handles those that can't (eg
+    Cosmos point reads and nested paths within encrypted attributes).
+
+    Args:
+
+        tb: table instance
+        item: item dict or None
+        attributes: optional list of attribute names or nested paths
+
+    Returns:
+
+        projected item
+
+    """
+    if item is None or attributes is None:
+        return item
+    paths = [_.split('.') for _ in tb.key_attrs + list(attributes)]
+    if all(len(_) == 1 for _ in paths) and set(item.keys()) <= set(
+        _[0] for _ in paths
+    ):
+        return item
+    projected: t.Dict = {}
+    for path in paths:
+        val: t.Any = item
+        for part in path:
+            if not isinstance(val, dict) or part not in val:
+                break
+            val = val[part]
+        else:
+            obj = projected
+            for part in path[:-1]:
+                obj = obj.setdefault(part, {})
+            obj[path[-1]] = val
+    return projected
+
+
+def get_sql_select(alias: str, projection: t.Optional[t.List[str]]) -> str:
+    """Get SELECT list for projection, nested paths are aliased
+
+    Cosmos returns nested paths by leaf name, so eg c.obj.foo is selected
+    as obj__foo, see unflatten_sql_item()
+
+    Args:
+
+        alias: table alias
+        projection: list of attribute paths or None for all
+
+    Returns:
+
+        SELECT expressions
+
+    """
+    if not projection:
+        return '*'
+    return ', '.join([
+        f'{alias}.{k} AS {k.replace(".", "__")}' if '.' in k
+        else f'{alias}.{k}'
+        for k in projection
+    ])
+
+
+def unflatten_sql_item(
+    item: t.Dict, projection: t.Optional[t.List[str]]
+) -> t.Dict:
+    """Nest aliased paths selected via get_sql_select()
+
+    Args:
+
+        item: item dict
+        projection: list of attribute paths or None for all
+
+    Returns:
+
+        item
+
+    """
+    for path in [_ for _ in projection or [] if '.' in _]:
+        flat = path.replace('.', '__')
+        if flat not in item:
+            continue
+        val = item.pop(flat)
+        obj = item
+        parts = path.split('.')
+        for part in parts[:-1]:
+            obj = obj.setdefault(part, {})
+        obj[parts[-1]] = val
+    return item
+
 
 def get_sql_params(
     statement: str,
@@ -287,6 +630,170 @@ def get_sql_params(
     return (statement, params)
 
 
+def get_sql_statements(
+    statements: t.Iterable[t.Any]
+) -> t.List[t.Tuple[str, t.Dict[str, t.Any]]]:
+    """Get query_sql_many() statements as (statement, parameters) tuples
+
+    Args:
+
+        statements: list of statement strings or (statement, parameters)
+
+    Returns:
+        list of (statement, parameters) tuples
+
+    """
+    _statements = []
+    for statement in statements:
+        parameters = None
+        if isinstance(statement, (list, tuple)) and len(statement) == 2:
+            (statement, parameters) = statement
+        if not isinstance(statement, str) or not isinstance(
+            parameters or {}, dict
+        ):
+            raise ex.ValidationException(
+                'statements must be strings or (statement, parameters)'
+            )
+        _statements.append((statement, parameters or {}))
+    return _statements
+
+
+CONSISTENCY_LEVELS = ['eventual', 'session', 'strong']
+
+
+def get_consistency(
+    config: t.Dict, consistency: t.Optional[str] = None
+) -> t.Optional[str]:
+    """Get read consistency, from consistency argument, config or the
+    ABNOSQL_CONSISTENCY env var, None for the database default
+
+    - eventual: may return stale data, DynamoDB eventually consistent
+      reads, Cosmos eventual consistency and Firestore stale reads
+      (firestore_stale_secs config, default 15)
+    - session: read your writes (made via the same table object), Cosmos
+      session consistency using the session token of the last write,
+      DynamoDB strongly consistent reads
+    - strong: DynamoDB strongly consistent reads (not global secondary
+      indexes and twice the read capacity), Cosmos account default
+      consistency (strong if the account default, as requests can only
+      weaken consistency)
+
+    Firestore reads are strongly consistent unless eventual
+
+    Args:
+
+        config: table config
+        consistency: optional consistency argument
+
+    Returns:
+
+        consistency level or None
+
+    """
+    if consistency is None:
+        consistency = config.get(
+            'consistency', os.environ.get('ABNOSQL_CONSISTENCY')
+        )
+    if consistency is not None and consistency not in CONSISTENCY_LEVELS:
+        raise ex.ValidationException(
+            f'invalid consistency: {consistency}, must be one of: '
+            + ', '.join(CONSISTENCY_LEVELS)
+        )
+    return consistency
+
+
+WRITE_RETURNS = ['none', 'updated', 'all']
+
+
+def get_write_returns(
+    config: t.Dict, returns: t.Optional[str] = None
+) -> t.Optional[str]:
+    """Get what put_item() / put_items() return, from returns argument,
+    config or the ABNOSQL_RETURNS env var, None for the database default
+
+    - none: nothing, DynamoDB ReturnValues NONE and Cosmos minimal
+      response (no document in the response)
+    - updated: the item as written (attributes in the put or update),
+      without the database returning or re-reading it
+    - all: the whole item after the write, DynamoDB ReturnValues ALL_NEW
+      on updates and a Firestore read after updates (put_get config)
+
+    The default is the whole item for DynamoDB, Cosmos and memory, and
+    the item as written for Firestore (unless put_get config is True).
+    put_items() returns nothing unless returns is updated or all
+
+    Args:
+
+        config: table config
+        returns: optional returns argument
+
+    Returns:
+
+        returns or None
+
+    """
+    if returns is None:
+        returns = config.get('returns', os.environ.get('ABNOSQL_RETURNS'))
+    if returns is not None and returns not in WRITE_RETURNS:
+        raise ex.ValidationException(
+            f'invalid returns: {returns}, must be one of: '
+            + ', '.join(WRITE_RETURNS)
+        )
+    return returns
+
+
+def get_query_max_workers(config: t.Dict) -> int:
+    # max concurrent requests, from max_workers config or env var
+    return max(int(config.get(
+        'max_workers', os.environ.get('ABNOSQL_MAX_WORKERS', '10')
+    )), 1)
+
+
+def get_query_fill_caps(
+    config: t.Dict
+) -> t.Tuple[t.Optional[int], t.Optional[int]]:
+    # max pages and items scanned by query(fill=True), from fill_max_pages
+    # and fill_max_scanned config or env vars, default unlimited
+    caps = []
+    for name in ['max_pages', 'max_scanned']:
+        val = config.get(
+            f'fill_{name}', os.environ.get(f'ABNOSQL_FILL_{name.upper()}')
+        )
+        caps.append(max(int(val), 1) if val is not None else None)
+    return (caps[0], caps[1])
+
+
+def query_sql_concurrent(
+    tb, statements: t.Iterable[t.Any], decrypt: t.Optional[bool] = False
+) -> t.List[t.Dict[str, t.Any]]:
+    """Run query_sql() concurrently for each query_sql_many() statement
+
+    Args:
+
+        tb: table instance
+        statements: list of statement strings or (statement, parameters)
+        decrypt: decrypt encrypted attributes instead of removing them
+
+    Returns:
+        list of dictionaries containing 'items', 'next' and 'error'
+
+    """
+    def _query_sql(statement, parameters):
+        try:
+            response = tb.query_sql(statement, parameters, decrypt=decrypt)
+        except ex.NoSQLException as e:
+            return {'items': [], 'next': None, 'error': e}
+        # memory query_sql() returns list of items
+        if isinstance(response, list):
+            response = {'items': response, 'next': None}
+        return dict(response, error=None)
+
+    return map_concurrent(
+        _query_sql, get_sql_statements(statements),
+        get_query_max_workers(tb.config)
+    )
+
+
 def quote_str(string):
     # Quotes string
     return "'" + string.translate(
@@ -303,12 +810,12 @@ def get_item_pre(tb, kwargs):
     return key, _check_exists
 
 
-def get_item_post(tb, kwargs, item, audit_key):
+def get_item_post(tb, kwargs, item, audit_key, attributes=None):
     _check_exists = kwargs.pop('abnosql_check_exists', None)
     _item = tb.pm.hook.get_item_post(table=tb.name, item=item)
     if _item:
         item = _item
-    item = kms_decrypt_item(tb.config, item)
+    item = project_item(tb, kms_decrypt_item(tb.config, item), attributes)
     if _check_exists is not False:
         check_exists(tb, 'get', item)
     if item is not None:
@@ -316,7 +823,32 @@ def get_item_post(tb, kwargs, item, audit_key):
     return item
 
 
-def put_item_pre(tb, item, update, audit_user):
+def get_items_pre(tb, keys):
+    _keys = []
+    for key in keys:
+        key = validate_key_attrs(tb.key_attrs, dict(key), False)
+        tb.pm.hook.get_item_pre(table=tb.name, key=key)
+        _keys.append(key)
+    return _keys
+
+
+def get_items_post(tb, keys, items, attributes=None):
+    _items = []
+    for item in items:
+        _item = tb.pm.hook.get_item_post(table=tb.name, item=item)
+        _items.append(_item if _item else item)
+    _items = [
+        project_item(tb, _, attributes)
+        for _ in kms_decrypt_items(tb.config, _items)
+    ]
+    # missing items are None rather than check_exists NotFoundException
+    for key, item in zip(keys, _items):
+        if item is not None:
+            audit_callback(tb, 'get', key)
+    return _items
+
+
+def put_item_pre(tb, item, update, audit_user, encrypt=True):
     operation = 'update' if update else 'create'
     key = validate_key_attrs(tb.key_attrs, item)
     validate_item(tb.config, operation, item)
@@ -332,32 +864,403 @@ def put_item_pre(tb, item, update, audit_user):
             item, tb.name, 'MODIFY' if update is True else 'INSERT'
         )
 
+    item = add_ttl(tb, item)
+
     _item = tb.pm.hook.put_item_pre(table=tb.name, item=item)
     if _item:
         item = _item[0]
-    item = kms_encrypt_item(tb.config, item)
+    if encrypt is True:
+        item = kms_encrypt_items(tb.config, [item], kms_binary(tb))[0]
     return item, key
 
 
-def put_item_post(tb, item, update, audit_user, abnosql_audit_callback=True):
+def put_items_pre(tb, items, update, audit_user):
+    # encrypt all items together so remote KMS operations run concurrently
+    _items = [
+        put_item_pre(tb, item, update, audit_user, encrypt=False)[0]
+        for item in items
+    ]
+    return kms_encrypt_items(tb.config, _items, kms_binary(tb))
+
+
+def put_item_post(
+    tb, item, update, audit_user, abnosql_audit_callback=True, returns=None
+):
     key = validate_key_attrs(tb.key_attrs, item)
     tb.pm.hook.put_item_post(table=tb.name, item=item)
     if abnosql_audit_callback is not False:
         audit_callback(
             tb, 'update' if update else 'create', key, audit_user
         )
+    return None if returns == 'none' else item
+
+
+def put_items_post(tb, items, _items, returns):
+    # items are passed to hooks, _items (from _put_item()) are returned
+    tb.pm.hook.put_items_post(table=tb.name, items=items)
+    return None if returns is None or returns == 'none' else _items
+
+
+# update_item() operations, values can be {operator: value}
+UPDATE_OPERATORS = [
+    'set', 'set_if_not_exists', 'increment', 'append', 'remove'
+]
+
+
+def get_update_operation(val: t.Any) -> t.Tuple[str, t.Any]:
+    """Get operator and value from update_item() updates value
+
+    Values are set unless a single item dictionary with an operator key,
+    eg {'increment': 1}, {'append': ['a']}, {'remove': True} or
+    {'set_if_not_exists': 'foo'}
+
+    Args:
+
+        val: updates value
+
+    Returns:
+
+        tuple of operator and value
+
+    """
+    if not (
+        isinstance(val, dict)
+        and len(val) == 1
+        and list(val.keys())[0] in UPDATE_OPERATORS
+    ):
+        return ('set', val)
+    (op, val) = list(val.items())[0]
+    if op == 'increment' and (
+        isinstance(val, bool) or not isinstance(val, (int, float))
+    ):
+        raise ex.ValidationException('increment requires number value')
+    if op == 'append' and not isinstance(val, (list, tuple)):
+        raise ex.ValidationException('append requires list value')
+    if op == 'remove' and val is not True:
+        raise ex.ValidationException('remove requires True value')
+    return (op, list(val) if op == 'append' else val)
+
+
+def apply_update(
+    item: t.Dict, operations: t.List[t.Tuple[str, str, t.Any]]
+) -> t.Dict:
+    """Apply update_item_pre() operations to a copy of item
+
+    Args:
+
+        item: current item
+        operations: list of (attribute, operator, value)
+
+    Returns:
+
+        updated copy of item
+
+    """
+    item = copy.deepcopy(item)
+    for (k, op, val) in operations:
+        if op == 'set':
+            item[k] = val
+        elif op == 'set_if_not_exists':
+            item.setdefault(k, val)
+        elif op == 'increment':
+            current = item.get(k, 0)
+            if isinstance(current, bool) or not isinstance(
+                current, (int, float)
+            ):
+                raise ex.ValidationException(
+                    f'increment requires number attribute: {k}'
+                )
+            item[k] = current + val
+        elif op == 'append':
+            current = item.get(k, [])
+            if not isinstance(current, list):
+                raise ex.ValidationException(
+                    f'append requires list attribute: {k}'
+                )
+            item[k] = current + val
+        elif op == 'remove':
+            item.pop(k, None)
     return item
 
 
-def delete_item_pre(tb, kwargs):
-    key = validate_key_attrs(tb.key_attrs, dict(**kwargs), False)
-    check_exists(tb, 'delete', dict(kwargs))
-    return key
+def update_item_pre(
+    tb, key: t.Dict, updates: t.Dict, audit_user: t.Optional[str]
+) -> t.Tuple[t.Dict, t.List[t.Tuple[str, str, t.Any]]]:
+    """Validate update_item() updates and get operations
+
+    Audit attributes and change metadata (if enabled) are set and
+    encrypted attributes encrypted (only set and remove are supported
+    on these).
+
+    Args:
+
+        tb: table instance
+        key: key dict
+        updates: dict of attribute to value or {operator: value}
+        audit_user: optional user / system ID string
+
+    Returns:
+
+        key and list of (attribute, operator, value) operations
+
+    """
+    key = validate_key_attrs(tb.key_attrs, key, False)
+    if not isinstance(updates, dict) or len(updates) == 0:
+        raise ex.ValidationException('updates required')
+    _name_pat = re.compile(r'^[a-zA-Z0-9_-]+$')
+    invalid = sorted([
+        k for k in updates.keys()
+        if k in tb.key_attrs or not _name_pat.match(k)
+    ])
+    if len(invalid):
+        raise ex.ValidationException(
+            'invalid update attributes: ' + ', '.join(invalid)
+        )
+    ops = {k: get_update_operation(v) for k, v in updates.items()}
+
+    audit_user = audit_user or tb.config.get('audit_user')
+    extra = add_audit({}, True, audit_user) if audit_user else {}
+    if hasattr(tb, 'change_meta') and tb.change_meta is True:
+        extra = add_change_meta(extra, tb.name, 'MODIFY')
+    ops.update({k: ('set', v) for k, v in extra.items()})
+
+    kcfg = tb.config.get('kms')
+    if isinstance(kcfg, dict):
+        bidx_attrs = kms_blind_index_attrs(kcfg)
+        invalid = sorted([
+            k for k, (op, _) in ops.items()
+            if k in kcfg['attrs'] and op not in ['set', 'remove']
+        ])
+        if len(invalid):
+            raise ex.ValidationException(
+                'only set and remove supported on encrypted attributes: '
+                + ', '.join(invalid)
+            )
+        sets = {
+            k: v for k, (op, v) in ops.items()
+            if k in kcfg['attrs'] and op == 'set'
+        }
+        if len(sets):
+            encrypted = kms_encrypt_items(
+                tb.config, [dict(key, **sets)], kms_binary(tb)
+            )[0]
+            ops.update({
+                k: ('set', v) for k, v in encrypted.items()
+                if k not in key
+            })
+        ops.update({
+            bidx_attrs[k]: ('remove', True) for k, (op, _) in list(ops.items())
+            if k in bidx_attrs and op == 'remove'
+        })
+    return key, [(k, op, v) for k, (op, v) in ops.items()]
+
+
+def update_item_post(tb, item, audit_user):
+    item = put_item_post(tb, item, True, audit_user)
+    return kms_decrypt_item(tb.config, item)
+
+
+def delete_item_pre(tb, kwargs):
+    key = validate_key_attrs(tb.key_attrs, dict(**kwargs), False)
+    check_exists(tb, 'delete', dict(kwargs))
+    return key
+
+
+def delete_item_post(tb, key):
+    tb.pm.hook.delete_item_post(table=tb.name, key=key)
+    audit_callback(tb, 'delete', key)
+
+
+# transact_write() operation actions, each operation contains one of these
+TRANSACT_ACTIONS = ['put', 'update', 'delete', 'check']
+TRANSACT_MAX_OPERATIONS = 100
+
+
+def transact_write_pre(
+    tb, operations: t.Iterable[t.Dict], audit_user: t.Optional[str]
+) -> t.List[t.Dict[str, t.Any]]:
+    """Validate transact_write() operations and run the put_item(),
+    update_item() and delete_item() pre processing for each item
+
+    Operations contain one action:
+
+        put: item to create/replace
+        update: key, with updates dict, see update_item_pre()
+        delete: key
+        check: key, item must exist
+
+    and optionally `condition`, a dict of attribute to value or
+    {operator: value} (see get_query_condition()) the item must match,
+    and `table`, another table instance of the same database to write
+    to (default is tb).  Each item can only be in one operation
+
+    Args:
+
+        tb: table instance
+        operations: list of operation dicts
+        audit_user: optional user / system ID string
+
+    Returns:
+
+        list of dicts containing table, action, key, condition (blind
+        indexed if encrypted) and item (put) or operations (update)
+
+    """
+    operations = list(operations)
+    if not 0 < len(operations) <= TRANSACT_MAX_OPERATIONS:
+        raise ex.ValidationException(
+            f'transactions require 1 to {TRANSACT_MAX_OPERATIONS} operations'
+        )
+    _operations = []
+    item_ids = set()
+    for operation in operations:
+        if not isinstance(operation, dict):
+            raise ex.ValidationException('operation must be a dictionary')
+        actions = [_ for _ in TRANSACT_ACTIONS if _ in operation]
+        action = actions[0] if len(actions) == 1 else None
+        invalid = sorted(
+            set(operation.keys()) - set(TRANSACT_ACTIONS)
+            - set(['condition', 'table'])
+            - set(['updates'] if action == 'update' else [])
+        )
+        if action is None or len(invalid):
+            raise ex.ValidationException(
+                'operation requires one of ' + ', '.join(TRANSACT_ACTIONS)
+                + (' invalid: ' + ', '.join(invalid) if invalid else '')
+            )
+        _tb: t.Any = operation.get('table', tb)
+        if (
+            not issubclass(type(_tb), TableBase)
+            or getattr(_tb, 'database', None) != getattr(tb, 'database', None)
+        ):
+            raise ex.ValidationException(
+                'transaction tables must use the same database'
+            )
+        condition = operation.get('condition') or {}
+        if not isinstance(condition, dict):
+            raise ex.ValidationException('condition must be a dictionary')
+        validate_query_attrs({}, condition)
+        val = operation[action]
+        if not isinstance(val, dict):
+            raise ex.ValidationException(f'{action} requires dictionary')
+        _op: t.Dict[str, t.Any] = {
+            'table': _tb,
+            'action': action,
+            'condition': kms_blind_index_filters(_tb.config, condition)
+        }
+        if action == 'put':
+            (_op['item'], _op['key']) = put_item_pre(
+                _tb, dict(val), False, audit_user
+            )
+        elif action == 'update':
+            (_op['key'], _op['operations']) = update_item_pre(
+                _tb, val, operation.get('updates') or {}, audit_user
+            )
+        elif action == 'delete':
+            _op['key'] = delete_item_pre(_tb, val)
+        else:
+            _op['key'] = validate_key_attrs(_tb.key_attrs, val, False)
+        item_id = (_tb.name, json.dumps(_op['key'], sort_keys=True))
+        if item_id in item_ids:
+            raise ex.ValidationException(
+                'transaction operations must be on different items'
+            )
+        item_ids.add(item_id)
+        _operations.append(_op)
+    return _operations
+
+
+def transact_write_post(
+    operations: t.List[t.Dict[str, t.Any]], audit_user: t.Optional[str]
+):
+    # updated items aren't read, so put_item_post hook receives the key
+    # and set attributes
+    for op in operations:
+        tb = op['table']
+        if op['action'] == 'put':
+            put_item_post(tb, op['item'], False, audit_user)
+        elif op['action'] == 'update':
+            tb.pm.hook.put_item_post(table=tb.name, item=dict(op['key'], **{
+                k: v for (k, _op, v) in op['operations'] if _op == 'set'
+            }))
+            audit_callback(tb, 'update', op['key'], audit_user)
+        elif op['action'] == 'delete':
+            delete_item_post(op['table'], op['key'])
+
+
+def match_condition(item: t.Optional[t.Dict], condition: t.Dict) -> bool:
+    """Evaluate transact_write() condition against item client side
+
+    Missing attributes only match {'exists': False}
+
+    Args:
+
+        item: item dictionary or None if not found
+        condition: dict of attribute to value or {operator: value}
 
+    Returns:
 
-def delete_item_post(tb, key):
-    tb.pm.hook.delete_item_post(table=tb.name, key=key)
-    audit_callback(tb, 'delete', key)
+        True if item matches all conditions
+
+    """
+    item = item or {}
+    for k, v in condition.items():
+        (op, val) = get_query_condition(v)
+        if op == 'exists':
+            if (k in item) is not val:
+                return False
+            continue
+        if k not in item:
+            return False
+        attr = item[k]
+        try:
+            if op == 'begins_with':
+                matched = isinstance(attr, str) and attr.startswith(val)
+            elif op == 'between':
+                matched = val[0] <= attr <= val[1]
+            elif op == 'in':
+                matched = attr in val
+            elif op == 'contains':
+                matched = isinstance(attr, (str, list)) and val in attr
+            else:
+                matched = COMPARISONS[op](attr, val)
+        except TypeError:
+            matched = False
+        if not matched:
+            return False
+    return True
+
+
+COMPARISONS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge
+}
+
+
+def transact_write(
+    operations: t.Iterable[t.Dict[str, t.Any]],
+    audit_user: t.Optional[str] = None
+) -> None:
+    """Atomically write items in multiple tables of the same database
+
+    Args:
+
+        operations: list of operation dictionaries each containing
+            `table` (table instance), see TableBase.transact_write()
+        audit_user: optional user / system ID string to add audit attrs
+
+    """
+    operations = list(operations)
+    tables = [
+        _.get('table') if isinstance(_, dict) else None for _ in operations
+    ]
+    if len(tables) == 0 or not all(isinstance(_, TableBase) for _ in tables):
+        raise ex.ValidationException('table required in each operation')
+    t.cast(TableBase, tables[0]).transact_write(operations, audit_user)
 
 
 def validate_query_attrs(key: t.Dict, filters: t.Dict):
@@ -369,8 +1272,7 @@ def validate_query_attrs(key: t.Dict, filters: t.Dict):
         filters: filter dictionary
 
     """
-    # convert @variable to dynamodb ? placeholders
-    _name_pat = re.compile(r'^[a-zA-Z09_-]+$')
+    _name_pat = re.compile(r'^[a-zA-Z0-9_-]+$')
 
     def _validate_key_names(obj):
         return [_ for _ in obj.keys() if not _name_pat.match(_)]
@@ -383,6 +1285,99 @@ def validate_query_attrs(key: t.Dict, filters: t.Dict):
             'invalid key or filter keys: ' + ', '.join(invalid)
         )
 
+    # validate operators, only the range/sort key can use non equality
+    key_ops = [get_query_condition(v)[0] for v in key.values()]
+    for k, v in filters.items():
+        get_query_condition(v)
+    invalid = [op for op in key_ops if op not in KEY_OPERATORS]
+    if len(invalid):
+        raise ex.ValidationException(
+            'invalid key operators: ' + ', '.join(invalid)
+        )
+    if len([op for op in key_ops if op != '=']) > 1:
+        raise ex.ValidationException(
+            'only range/sort key condition can use key operators'
+        )
+
+
+# query() key and filter operators, values can be {operator: value}
+QUERY_OPERATORS = [
+    '=', '!=', '<', '<=', '>', '>=',
+    'begins_with', 'between', 'in', 'contains', 'exists'
+]
+KEY_OPERATORS = ['=', '<', '<=', '>', '>=', 'begins_with', 'between']
+
+
+def get_query_condition(val: t.Any) -> t.Tuple[str, t.Any]:
+    """Get operator and value from query() key or filter value
+
+    Values are an exact match unless a single item dictionary with an
+    operator key, eg {'begins_with': 'foo'}, {'between': [1, 5]},
+    {'in': ['a', 'b']} or {'exists': False}
+
+    Args:
+
+        val: key or filter value
+
+    Returns:
+
+        tuple of operator and value
+
+    """
+    if not (
+        isinstance(val, dict)
+        and len(val) == 1
+        and list(val.keys())[0] in QUERY_OPERATORS
+    ):
+        return ('=', val)
+    (op, val) = list(val.items())[0]
+    if op == 'between' and not (
+        isinstance(val, (list, tuple)) and len(val) == 2
+    ):
+        raise ex.ValidationException('between requires [low, high] value')
+    if op == 'in' and not (isinstance(val, (list, tuple)) and len(val)):
+        raise ex.ValidationException('in requires non empty list value')
+    if op == 'exists' and not isinstance(val, bool):
+        raise ex.ValidationException('exists requires boolean value')
+    return (op, val)
+
+
+def get_sql_condition(
+    column: str, param: str, val: t.Any, parameters: t.Dict[str, t.Any]
+) -> str:
+    """Get Cosmos style SQL condition for query() key or filter value
+
+    Args:
+
+        column: column name, eg c.foo
+        param: parameter name, eg @foo
+        val: key or filter value, see get_query_condition()
+        parameters: parameters dictionary that values are added to
+
+    Returns:
+
+        SQL condition
+
+    """
+    (op, val) = get_query_condition(val)
+    if op == 'exists':
+        return f'{"" if val else "NOT "}IS_DEFINED({column})'
+    if op in ['between', 'in']:
+        params = [f'{param}_{i}' for i in range(len(val))]
+        parameters.update(zip(params, val))
+        if op == 'between':
+            return f'({column} BETWEEN {params[0]} AND {params[1]})'
+        return f'{column} IN ({", ".join(params)})'
+    parameters[param] = val
+    if op == 'begins_with':
+        return f'STARTSWITH({column}, {param})'
+    if op == 'contains':
+        return (
+            f'(CONTAINS({column}, {param})'
+            f' OR ARRAY_CONTAINS({column}, {param}))'
+        )
+    return f'{column} {op} {param}'
+
 
 def validate_statement(statement: str):
     """Validate statement
@@ -398,6 +1393,158 @@ def validate_statement(statement: str):
         raise ex.ValidationException('statement must start with SELECT')
 
 
+TABLE_METADATA: t.Dict[t.Tuple[str, str], t.Tuple[float, t.Dict]] = {}
+TABLE_METADATA_LOCK = threading.Lock()
+
+
+def get_metadata_ttl(config: t.Dict) -> float:
+    # seconds to cache describe(), from metadata_ttl config or env var
+    return float(config.get(
+        'metadata_ttl', os.environ.get('ABNOSQL_METADATA_TTL', '300')
+    ))
+
+
+def get_table_metadata(tb, refresh: t.Optional[bool] = False) -> t.Dict:
+    """Get table metadata via describe(), cached per database and table
+    name for metadata_ttl config or ABNOSQL_METADATA_TTL seconds (default
+    300, 0 disables caching)
+
+    Args:
+
+        tb: table instance
+        refresh: ignore any cached metadata
+
+    Returns:
+
+        metadata dictionary, see TableBase.describe()
+
+    """
+    cache_key = (tb.database, tb.name)
+    with TABLE_METADATA_LOCK:
+        entry = TABLE_METADATA.get(cache_key)
+    if not refresh and entry is not None and entry[0] > time.monotonic():
+        return entry[1]
+    metadata = tb.describe()
+    ttl = get_metadata_ttl(tb.config)
+    with TABLE_METADATA_LOCK:
+        if ttl > 0:
+            TABLE_METADATA[cache_key] = (time.monotonic() + ttl, metadata)
+        else:
+            TABLE_METADATA.pop(cache_key, None)
+    return metadata
+
+
+def clear_table_metadata():
+    with TABLE_METADATA_LOCK:
+        TABLE_METADATA.clear()
+
+
+def get_table_key_attrs(tb) -> list:
+    """Get key attributes from config or env var, see get_key_attrs(),
+    otherwise from the table metadata, see get_table_metadata()
+
+    Args:
+
+        tb: table instance
+
+    Returns:
+
+        key_attrs: list of key attribute names
+
+    """
+    try:
+        return get_key_attrs(tb.config)
+    except ValueError:
+        key_attrs = get_table_metadata(tb).get('key_attrs') or []
+        if len(key_attrs) == 0:
+            raise
+        return key_attrs
+
+
+def index_routing_enabled(config: t.Dict) -> bool:
+    return config.get(
+        'index_routing',
+        os.environ.get('ABNOSQL_INDEX_ROUTING', 'TRUE') == 'TRUE'
+    ) is True
+
+
+def get_query_index(
+    tb,
+    key: t.Optional[t.Dict[str, t.Any]] = None,
+    filters: t.Optional[t.Dict[str, t.Any]] = None,
+    index: t.Optional[str] = None,
+    consistent: t.Optional[bool] = False
+) -> t.Tuple[
+    t.Optional[t.Dict[str, t.Any]], t.Optional[t.Dict[str, t.Any]],
+    t.Optional[str]
+]:
+    """Route a query() or count() without the table partition key to the
+    table or an index whose keys match the key and filter attributes,
+    instead of a filtered scan
+
+    The partition key must be an exact match and the range/sort key (if
+    any) can use a key operator, see KEY_OPERATORS.  Indexes that don't
+    project all attributes (or global indexes if consistent reads) are
+    ignored and the table key is preferred over an index.  Disabled via
+    index_routing config or ABNOSQL_INDEX_ROUTING
+
+    Args:
+
+        tb: table instance
+        key: key dictionary
+        filters: filter dictionary
+        index: index name, if supplied no routing is done
+        consistent: strongly consistent reads
+
+    Returns:
+
+        tuple of key, filters and index name to query
+
+    """
+    _key = key or {}
+    _filters = filters or {}
+    if (
+        index is not None
+        or (len(_key) == 0 and len(_filters) == 0)
+        or tb.key_attrs[0] in _key
+        or not index_routing_enabled(tb.config)
+    ):
+        return (key, filters, index)
+    conditions = dict(_filters, **_key)
+    metadata = get_table_metadata(tb)
+    candidates = [{
+        'name': None,
+        'key_attrs': metadata.get('key_attrs') or tb.key_attrs,
+        'projection': 'ALL'
+    }] + metadata.get('indexes', [])
+    best: t.Optional[t.Dict] = None
+    best_attrs: t.List[str] = []
+    for candidate in candidates:
+        if candidate.get('projection') != 'ALL' or (
+            consistent and candidate.get('type') == 'global'
+        ):
+            continue
+        (hk, rk) = (candidate['key_attrs'] + [None])[:2]
+        if hk not in conditions or get_query_condition(
+            conditions[hk]
+        )[0] != '=':
+            continue
+        attrs = [hk]
+        if rk in conditions and get_query_condition(
+            conditions[rk]
+        )[0] in KEY_OPERATORS:
+            attrs.append(rk)
+        if len(attrs) > len(best_attrs):
+            (best, best_attrs) = (candidate, attrs)
+    if best is None:
+        return (key, filters, index)
+    return (
+        {k: conditions[k] for k in best_attrs},
+        {k: v for k, v in conditions.items() if k not in best_attrs} or None,
+        best['name']
+    )
+
+
 def get_key_attrs(config: t.Optional[t.Dict] = None) -> list:
     """Get key attributes from ABNOSQL_KEY_ATTRS env var or config
 
@@ -515,21 +1662,82 @@ def kms_encrypt_item(config: t.Dict, item: t.Dict) -> t.Dict:
         item
 
     """  # noqa: E501
+    return kms_encrypt_items(config, [item])[0]
+
+
+def kms_binary(tb) -> bool:
+    """Check if encrypted values should be stored as binary
+
+    Enabled with kms `binary` config for databases that have a native
+    binary type (eg DynamoDB B or Firestore bytes), saving the base64
+    overhead
+
+    Args:
+
+        tb: table instance
+
+    Returns:
+        True if encrypted values should be stored as bytes
+
+    """
+    kcfg = tb.config.get('kms')
+    return (
+        isinstance(kcfg, dict)
+        and kcfg.get('binary') is True
+        and getattr(tb, 'binary', False) is True
+    )
+
+
+def kms_encrypt_items(
+    config: t.Dict,
+    items: t.List[t.Dict],
+    binary: t.Optional[bool] = False
+) -> t.List[t.Dict]:
+    """Encrypt multiple items as defined in config
+
+    All attribute values across the items are passed to the provider
+    encrypt_many() so that remote KMS operations run concurrently.
+
+    See kms_encrypt_item() for example config
+
+    Args:
+
+        config: config dictionary
+        items: list of item dicts
+        binary: store encrypted values as bytes instead of base64 strings
+
+    Returns:
+        items
+
+    """
     kcfg = config.get('kms', {})
-    if item is None or not kcfg:
-        return item
-    context = {k: item.get(k) for k in kcfg['key_attrs']}
-    # encrypt defined attrs
-    for attr in kcfg['attrs']:
-        val = item.get(attr)
-        if val is None:
+    if not kcfg:
+        return items
+    bidx_attrs = kms_blind_index_attrs(kcfg)
+    refs, plaintexts, contexts = [], [], []
+    for i, item in enumerate(items):
+        if item is None:
             continue
-        if not isinstance(val, str):
-            val = json.dumps(val)
-        item[attr] = kcfg['pm'].encrypt(
-            val, context, key=kcfg.get('key_bytes')
+        context = {k: item.get(k) for k in kcfg['key_attrs']}
+        # encrypt defined attrs
+        for attr in kcfg['attrs']:
+            val = item.get(attr)
+            if val is None:
+                continue
+            if not isinstance(val, str):
+                val = json.dumps(val)
+            refs.append((i, attr))
+            plaintexts.append(val)
+            contexts.append(context)
+            if attr in bidx_attrs:
+                item[bidx_attrs[attr]] = kms_blind_index(kcfg, attr, val)
+    if len(plaintexts):
+        serialized = kcfg['pm'].encrypt_many(
+            plaintexts, contexts, key=kcfg.get('key_bytes')
         )
-    return item
+        for (i, attr), val in zip(refs, serialized):
+            items[i][attr] = b64decode(val) if binary is True else val
+    return items
 
 
 def kms_decrypt_item(config: t.Dict, item: t.Dict) -> t.Dict:
@@ -545,34 +1753,191 @@ def kms_decrypt_item(config: t.Dict, item: t.Dict) -> t.Dict:
     Returns:
         item
     """
+    return kms_decrypt_items(config, [item])[0]
+
+
+def kms_decrypt_items(
+    config: t.Dict,
+    items: t.List[t.Dict]
+) -> t.List[t.Dict]:
+    """Decrypt multiple items as defined in config
+
+    All attribute values across the items are passed to the provider
+    decrypt_many() so that remote KMS operations run concurrently.
+
+    See kms_encrypt_item() for example config
+
+    Args:
+
+        config: config dictionary
+        items: list of item dicts
+
+    Returns:
+        items
+    """
     kcfg = config.get('kms', {})
-    if item is None or not kcfg:
-        return item
-    context = {k: item.get(k) for k in kcfg['key_attrs']}
-    # decrypt defined attrs
-    for attr in kcfg['attrs']:
-        val = item.get(attr)
-        if val is None:
+    if not kcfg:
+        return items
+    bidx_attrs = kms_blind_index_attrs(kcfg)
+    refs, serialized, contexts = [], [], []
+    for i, item in enumerate(items):
+        if item is None:
             continue
-        val = kcfg['pm'].decrypt(val, context)
-        try:
-            val = json.loads(val)
-        except Exception:
-            val = val
-        item[attr] = val
-    return item
+        for bidx_attr in bidx_attrs.values():
+            item.pop(bidx_attr, None)
+        context = {k: item.get(k) for k in kcfg['key_attrs']}
+        # decrypt defined attrs
+        for attr in kcfg['attrs']:
+            val = item.get(attr)
+            if val is None:
+                continue
+            # encrypted values may be stored as binary
+            if isinstance(val, (bytes, bytearray)):
+                val = b64encode(val).decode()
+            refs.append((i, attr))
+            serialized.append(val)
+            contexts.append(context)
+    if len(serialized) and kcfg.get('lazy') is True:
+        pending: t.Dict[int, t.Dict[str, t.Tuple[str, t.Dict]]] = {}
+        for (i, attr), val, context in zip(refs, serialized, contexts):
+            pending.setdefault(i, {})[attr] = (val, context)
+        for i, _pending in pending.items():
+            items[i] = LazyItem(items[i], kcfg['pm'], _pending)
+    elif len(serialized):
+        plaintexts = kcfg['pm'].decrypt_many(serialized, contexts)
+        for (i, attr), val in zip(refs, plaintexts):
+            items[i][attr] = kms_loads(val)
+    return items
+
+
+def kms_loads(val: str) -> t.Any:
+    # decrypted values are JSON serialized unless they were strings
+    try:
+        return json.loads(val)
+    except Exception:
+        return val
+
+
+class LazyItem(dict):
+    """Item dict that decrypts encrypted attributes on first access
+
+    Returned by get_item(), get_items() and query(decrypt=True) when kms
+    `lazy` config is True.  Each encrypted attribute is decrypted (and its
+    data key unwrapped) the first time its value is read, then memoized,
+    so attributes never read are never decrypted.  Reading all values
+    (eg items(), values(), ==, copy() or dict(item)) decrypts them all
+    """
+
+    def __init__(
+        self,
+        item: t.Dict,
+        pm: t.Any,
+        pending: t.Dict[str, t.Tuple[str, t.Dict]]
+    ) -> None:
+        super().__init__(item)
+        self._pm = pm
+        self._pending = dict(pending)
+        self._lock = threading.Lock()
+
+    def _decrypt(self, key: t.Any) -> None:
+        if key not in self._pending:
+            return
+        with self._lock:
+            if key not in self._pending:
+                return
+            (serialized, context) = self._pending[key]
+            val = kms_loads(self._pm.decrypt(serialized, context))
+            super().__setitem__(key, val)
+            del self._pending[key]
+
+    def decrypt(self) -> 'LazyItem':
+        # decrypt any remaining attributes in one go
+        with self._lock:
+            if len(self._pending):
+                attrs = list(self._pending.keys())
+                plaintexts = self._pm.decrypt_many(
+                    [self._pending[_][0] for _ in attrs],
+                    [self._pending[_][1] for _ in attrs]
+                )
+                for attr, val in zip(attrs, plaintexts):
+                    super().__setitem__(attr, kms_loads(val))
+                self._pending = {}
+        return self
+
+    def __getitem__(self, key):
+        self._decrypt(key)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self._decrypt(key)
+        return super().get(key, default)
+
+    def pop(self, key, *args):
+        self._decrypt(key)
+        return super().pop(key, *args)
+
+    def setdefault(self, key, default=None):
+        self._decrypt(key)
+        return super().setdefault(key, default)
+
+    def __setitem__(self, key, val):
+        self._pending.pop(key, None)
+        super().__setitem__(key, val)
+
+    def __delitem__(self, key):
+        self._pending.pop(key, None)
+        super().__delitem__(key)
+
+    def update(self, *args, **kwargs):
+        other = dict(*args, **kwargs)
+        for key in other.keys():
+            self._pending.pop(key, None)
+        super().update(other)
+
+    def __iter__(self):
+        # overridden so dict(item) uses keys() and __getitem__
+        return super().__iter__()
+
+    def items(self):
+        self.decrypt()
+        return super().items()
+
+    def values(self):
+        self.decrypt()
+        return super().values()
+
+    def popitem(self):
+        self.decrypt()
+        return super().popitem()
+
+    def copy(self):
+        return dict(self.decrypt())
+
+    def __eq__(self, other):
+        return dict(self.decrypt().items()) == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return repr(dict(self.decrypt().items()))
+
+    def __reduce__(self):
+        return (dict, (dict(self.decrypt().items()),))
 
 
 def kms_process_query_items(
     config: t.Dict,
-    items: t.List[t.Dict]
+    items: t.List[t.Dict],
+    decrypt: t.Optional[bool] = False
 ) -> t.List[t.Dict]:
-    """Remove encrypted attribute/values from items
+    """Remove encrypted attribute/values from items, or decrypt them
 
     Args:
 
         config: config dictionary
         items: list of item dicts
+        decrypt: decrypt encrypted attributes in place instead of removing
 
     Returns:
         items
@@ -581,14 +1946,181 @@ def kms_process_query_items(
     kcfg = config.get('kms')
     if not isinstance(kcfg, dict):
         return items
+    if decrypt is True:
+        return kms_decrypt_items(config, items)
     _items = []
+    attrs = kcfg['attrs'] + list(kms_blind_index_attrs(kcfg).values())
     for item in items:
-        for attr in kcfg['attrs']:
+        for attr in attrs:
             item.pop(attr, None)
         _items.append(item)
     return _items
 
 
+def kms_blind_index_attrs(kcfg: t.Dict) -> t.Dict[str, str]:
+    """Get blind index companion attribute names
+
+    Args:
+
+        kcfg: kms config dictionary
+
+    Returns:
+        dictionary of encrypted attribute name to blind index attribute name
+
+    """
+    suffix = kcfg.get('blind_index_suffix', '_bidx')
+    return {
+        attr: f'{attr}{suffix}'
+        for attr in kcfg.get('blind_index_attrs') or []
+    }
+
+
+def kms_blind_index(kcfg: t.Dict, attr: str, val: t.Any) -> str:
+    """Get blind index (keyed HMAC-SHA256) of an attribute value
+
+    Args:
+
+        kcfg: kms config dictionary
+        attr: attribute name
+        val: attribute value (non strings are JSON serialized)
+
+    Returns:
+        base64 encoded HMAC
+
+    """
+    if not isinstance(val, str):
+        val = json.dumps(val)
+    # include attribute name so same value in different attributes differs
+    return b64encode(hmac.new(
+        kcfg['blind_index_key'], f'{attr}:{val}'.encode(), hashlib.sha256
+    ).digest()).decode()
+
+
+def kms_blind_index_filters(
+    config: t.Dict,
+    filters: t.Optional[t.Dict[str, t.Any]]
+) -> t.Optional[t.Dict[str, t.Any]]:
+    """Rewrite query() equality filters on blind indexed attributes
+
+    Args:
+
+        config: config dictionary
+        filters: filter dictionary
+
+    Returns:
+        filters with blind indexed attributes replaced by their blind index
+
+    """
+    kcfg = config.get('kms')
+    if not isinstance(kcfg, dict) or not filters:
+        return filters
+    bidx_attrs = kms_blind_index_attrs(kcfg)
+    _filters = {}
+    for k, v in filters.items():
+        if k not in bidx_attrs:
+            _filters[k] = v
+            continue
+        # only (in)equality, in and exists can use the blind index
+        (op, val) = get_query_condition(v)
+        if op not in ['=', '!=', 'in', 'exists']:
+            raise ex.ValidationException(
+                f'{op} not supported on encrypted attribute {k}'
+            )
+        if op == 'in':
+            val = [kms_blind_index(kcfg, k, _) for _ in val]
+        elif op != 'exists':
+            val = kms_blind_index(kcfg, k, val)
+        _filters[bidx_attrs[k]] = val if op == '=' else {op: val}
+    return _filters
+
+
+def kms_blind_index_sql(
+    config: t.Dict,
+    statement: str,
+    parameters: t.Optional[t.Dict[str, t.Any]]
+) -> t.Tuple[str, t.Dict[str, t.Any]]:
+    """Rewrite query_sql() equality conditions on blind indexed attributes
+
+    Conditions of the form `[alias.]attr = @param` are rewritten to
+    `[alias.]attr_bidx = @param_bidx` with the parameter value replaced
+    by its blind index
+
+    Args:
+
+        config: config dictionary
+        statement: SQL statement
+        parameters: dictionary containing @key = value placeholders
+
+    Returns:
+        statement, parameters
+
+    """
+    kcfg = config.get('kms')
+    parameters = dict(parameters or {})
+    if not isinstance(kcfg, dict) or not parameters:
+        return (statement, parameters)
+    replaced = set()
+    for attr, bidx_attr in kms_blind_index_attrs(kcfg).items():
+        pat = re.compile(
+            r'(?<![\w@])((?:\w+\.)?)' + re.escape(attr)
+            + r'(\s*=\s*)(@[a-zA-Z0-9_.-]+)'
+        )
+
+        def _replace(m):
+            param = m.group(3)
+            if param not in parameters:
+                return m.group(0)
+            parameters[f'{param}_bidx'] = kms_blind_index(
+                kcfg, attr, parameters[param]
+            )
+            replaced.add(param)
+            return f'{m.group(1)}{bidx_attr}{m.group(2)}{param}_bidx'
+
+        statement = pat.sub(_replace, statement)
+
+    # remove replaced parameters if no longer used
+    used = set(re.findall(r'\@[a-zA-Z0-9_.-]+', statement))
+    return (
+        statement,
+        {
+            k: v for k, v in parameters.items()
+            if k in used or k not in replaced
+        }
+    )
+
+
+def kms_query_projection(
+    tb,
+    decrypt: t.Optional[bool] = False
+) -> t.Optional[t.List[str]]:
+    """Get attributes to project in query() so encrypted attributes that
+    would be removed by kms_process_query_items() aren't fetched
+
+    No provider supports excluding attributes, so projection is only
+    possible if the unencrypted attributes are listed in kms `plain_attrs`
+
+    Args:
+
+        tb: table instance
+        decrypt: True if encrypted attributes are to be decrypted
+
+    Returns:
+        list of attributes to project or None for all attributes
+
+    """
+    kcfg = tb.config.get('kms')
+    if not isinstance(kcfg, dict) or decrypt is True:
+        return None
+    plain_attrs = kcfg.get('plain_attrs')
+    if not isinstance(plain_attrs, list):
+        return None
+    attrs = tb.key_attrs + kcfg.get('key_attrs', []) + plain_attrs
+    return [
+        attr for attr in dict.fromkeys(attrs)
+        if attr not in kcfg['attrs']
+    ]
+
+
 def add_audit(item: t.Dict, update: bool, user: str) -> t.Dict:
     """Add createdBy + createdDate and/or modifiedBy + modifiedDate to item
 
@@ -618,6 +2150,63 @@ def add_audit(item: t.Dict, update: bool, user: str) -> t.Dict:
     return item
 
 
+def get_ttl_config(tb) -> t.Tuple[t.Optional[str], t.Optional[int]]:
+    """Get TTL attribute and seconds from ttl_attribute and ttl_seconds
+    config or ABNOSQL_TTL_ATTRIBUTE and ABNOSQL_TTL_SECONDS env vars
+
+    The attribute defaults to ttl (and is always ttl for cosmos)
+
+    Args:
+
+        tb: table instance
+
+    Returns:
+
+        tuple of attribute and seconds, (None, None) if not configured
+
+    """
+    attr = tb.config.get(
+        'ttl_attribute', os.environ.get('ABNOSQL_TTL_ATTRIBUTE')
+    )
+    seconds = tb.config.get(
+        'ttl_seconds', os.environ.get('ABNOSQL_TTL_SECONDS')
+    )
+    if attr is None and seconds is None:
+        return (None, None)
+    attr = getattr(tb, 'ttl_attribute', None) or attr or 'ttl'
+    return (attr, int(seconds) if seconds is not None else None)
+
+
+def add_ttl(tb, item: t.Dict) -> t.Dict:
+    """Add expiry to item in the database native TTL form, if ttl_seconds
+    configured (see get_ttl_config()) and item doesn't already have one
+
+    The table ttl_format attribute is epoch (DynamoDB and memory epoch
+    seconds number), seconds (Cosmos seconds since last modified) or
+    datetime (Firestore timestamp for TTL policies)
+
+    Args:
+
+        tb: table instance
+        item: item dict
+
+    Returns:
+        item
+
+    """
+    (attr, seconds) = get_ttl_config(tb)
+    if attr is None or seconds is None or attr in item:
+        return item
+    ttl_format = getattr(tb, 'ttl_format', 'epoch')
+    if ttl_format == 'seconds':
+        item[attr] = seconds
+    elif ttl_format == 'datetime':
+        item[attr] = datetime.now(timezone.utc) + timedelta(seconds=seconds)
+    else:
+        item[attr] = int(time.time()) + seconds
+    return item
+
+
 def add_change_meta(item: t.Dict, event_source: str, event_name: str) -> t.Dict:
     """Add changeMetadata object to item containing eventName and eventSource
 
@@ -761,14 +2350,24 @@ def table(
             'cosmos': 'azure',
             'firestore': 'gcp'
         }
-        provider = kcfg.get('provider')
+        provider = kcfg.get('provider', os.environ.get('ABNOSQL_KMS'))
         if database is not None and provider is None:
             provider = defaults.get(database)
         _kms_module = kms(kcfg, provider)
         config['kms']['pm'] = _kms_module
 
         if 'key_attrs' not in kcfg:
-            config['kms']['key_attrs'] = get_key_attrs(config)
+            config['kms']['key_attrs'] = list(_module.key_attrs)
+
+        if kcfg.get('blind_index_attrs'):
+            key = kcfg.get('blind_index_key')
+            if key is None and 'ABNOSQL_KMS_BLIND_INDEX_KEY' in os.environ:
+                key = b64decode(os.environ['ABNOSQL_KMS_BLIND_INDEX_KEY'])
+            if not isinstance(key, bytes) or len(key) < 16:
+                raise ex.ConfigException(
+                    'kms blind_index_key must be at least 16 bytes'
+                )
+            config['kms']['blind_index_key'] = key
 
         if 'session' in config and 'session' not in kcfg:
             # aws_encryption_sdk uses botocore session
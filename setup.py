@@ -55,6 +55,12 @@ gcp_firestore_deps = [
 gcp_kms_deps = [
     'tink[gcpkms]'
 ]
+local_kms_deps = [
+    'cryptography'
+]
+vault_kms_deps = [
+    'requests'
+]
 all_deps = (
     base_deps
     + cli_deps
@@ -64,6 +70,8 @@ all_deps = (
     + azure_kms_deps
     + gcp_firestore_deps
     + gcp_kms_deps
+    + local_kms_deps
+    + vault_kms_deps
 )
 test_deps = all_deps + [
     'coverage',
@@ -114,6 +122,8 @@ setup(
         'aws-kms': aws_kms_deps,
         'azure-kms': azure_kms_deps,
         'gcp-kms': gcp_kms_deps,
+        'local-kms': local_kms_deps,
+        'vault-kms': vault_kms_deps,
     },
     python_requires='>=3.9,<4.0',
     test_suite='tests',
@@ -7,6 +7,7 @@ import pytest
 import abnosql.exceptions as ex
 from abnosql import plugin
 from abnosql import table
+from abnosql import transact_write
 
 
 def item(hk, rk=None):
@@ -86,6 +87,61 @@ def test_get_item(config=None, tables=None):
     return tb
 
 
+def test_get_items(config=None):
+    tb = table('hash_range', config)
+    tb.put_items(items(['1', '2'], ['a', 'b']))
+    _items = tb.get_items([
+        {'hk': '2', 'rk': 'b'},
+        {'hk': '3', 'rk': 'a'},
+        {'hk': '1', 'rk': 'a'}
+    ])
+    _items = [
+        validate_change_meta(_, 'INSERT') if _ is not None else None
+        for _ in _items
+    ]
+    assert _items == [item('2', 'b'), None, item('1', 'a')]
+    return tb
+
+
+def test_attributes(config=None, decrypt=False):
+    tb = table('hash_range', config)
+    tb.put_items(items(['1', '2'], ['a', 'b']))
+    attrs = ['num', 'obj.foo', 'obj.list']
+
+    def _item(hk, rk):
+        return {
+            'hk': hk, 'rk': rk, 'num': 5,
+            'obj': {'foo': 'bar', 'list': [1, 2, 3]}
+        }
+
+    assert tb.get_item(hk='1', rk='a', attributes=attrs) == _item('1', 'a')
+    assert tb.get_items([
+        {'hk': '2', 'rk': 'b'},
+        {'hk': '3', 'rk': 'a'},
+        {'hk': '1', 'rk': 'a'}
+    ], attributes=attrs) == [_item('2', 'b'), None, _item('1', 'a')]
+    response = tb.query({'hk': '1'}, attributes=attrs, decrypt=decrypt)
+    assert response['items'] == [_item('1', 'a'), _item('1', 'b')]
+
+    # scan, key attributes are always returned
+    response = tb.query(attributes=['hk', 'str'], decrypt=decrypt)
+    assert sorted(
+        response['items'], key=lambda _: (_['hk'], _['rk'])
+    ) == [
+        {'hk': hk, 'rk': rk, 'str': 'str'}
+        for hk in ['1', '2'] for rk in ['a', 'b']
+    ]
+
+    # overlapping paths return the parent
+    assert tb.get_item(
+        hk='1', rk='a', attributes=['obj', 'obj.foo']
+    )['obj'] == item('1', 'a')['obj']
+
+    for attributes in ['num', [], ['obj..foo'], ['obj.f$o']]:
+        with pytest.raises(ex.ValidationException):
+            tb.get_item(hk='1', rk='a', attributes=attributes)
+
+
 def test_check_exists(config=None):
     config = config or {}
     config.update({'key_attrs': ['hk', 'rk'], 'check_exists': True})
@@ -108,7 +164,13 @@ def test_check_exists(config=None):
     # check can override
     tb.put_item({**item('1', 'a'), **{'abnosql_check_exists': False}})
 
-    assert tb.get_item(hk='1', rk='a') is not None
+    _item = tb.get_item(hk='1', rk='a')
+    assert _item is not None
+
+    # get_items() returns None for missing keys
+    assert tb.get_items([
+        {'hk': '1', 'rk': 'a'}, {'hk': '1', 'rk': 'missing'}
+    ]) == [_item, None]
 
     with pytest.raises(ex.ExistsException) as e:
         tb.put_item(item('1', 'a'), update=False)
@@ -303,6 +365,118 @@ def test_update_item(config=None):
     ) == item3
 
 
+def test_update_item_ops(config=None):
+    tb = table('hash_range', config)
+    tb.put_item(item('1', 'a'))
+    key = {'hk': '1', 'rk': 'a'}
+    expected = dict(
+        item('1', 'a'), num=7, count=1, list=[1, 2, 3, 4], tags=['x'],
+        created='c1', title='foo', modifiedBy='bob'
+    )
+    expected.pop('str')
+    updated = tb.update_item(key, {
+        'num': {'increment': 2},
+        'count': {'increment': 1},
+        'list': {'append': [4]},
+        'tags': {'append': ['x']},
+        'str': {'remove': True},
+        'created': {'set_if_not_exists': 'c1'},
+        'title': 'foo'
+    }, audit_user='bob')
+    updated = validate_change_meta(updated, 'MODIFY')
+    assert updated.pop('modifiedDate', None) is not None
+    assert updated == expected
+    _item = validate_change_meta(tb.get_item(**key), 'MODIFY')
+    _item.pop('modifiedDate', None)
+    assert _item == expected
+
+    # set if not exists only sets missing attributes
+    updated = tb.update_item(key, {
+        'num': {'increment': -1.5},
+        'created': {'set_if_not_exists': 'c2'}
+    })
+    assert updated['num'] == 5.5 and updated['created'] == 'c1'
+
+    with pytest.raises(ex.NotFoundException):
+        tb.update_item({'hk': '9', 'rk': 'z'}, {'num': {'increment': 1}})
+    for updates in [
+        {}, {'rk': 'b'}, {'num': {'increment': 'x'}},
+        {'num': {'increment': True}}, {'list': {'append': 'x'}},
+        {'str': {'remove': False}}
+    ]:
+        with pytest.raises(ex.ValidationException):
+            tb.update_item(key, updates)
+
+
+def test_transact_write(config=None, multi_table=True):
+    tb = table('hash_range', config)
+    tb.put_items(items(['1'], ['a', 'b', 'c']))
+    tb.transact_write([
+        {'put': dict(item('1', 'd'), str='new')},
+        {'update': {'hk': '1', 'rk': 'a'}, 'updates': {
+            'num': {'increment': 1},
+            'tags': {'append': ['x']}
+        }},
+        {'delete': {'hk': '1', 'rk': 'b'}},
+        {'check': {'hk': '1', 'rk': 'c'}, 'condition': {
+            'str': 'str',
+            'num': {'between': [1, 5]}
+        }}
+    ], audit_user='bob')
+    _item = validate_change_meta(tb.get_item(hk='1', rk='a'), 'MODIFY')
+    assert _item['num'] == 6 and _item['tags'] == ['x']
+    assert _item['modifiedBy'] == 'bob'
+    assert tb.get_item(hk='1', rk='b') is None
+    _item = validate_change_meta(tb.get_item(hk='1', rk='d'), 'INSERT')
+    assert _item['str'] == 'new' and _item['createdBy'] == 'bob'
+
+    # failed condition or missing item cancels all operations
+    for operation in [
+        {'check': {'hk': '1', 'rk': 'c'}, 'condition': {'str': 'foo'}},
+        {'check': {'hk': '1', 'rk': 'z'}},
+        {'update': {'hk': '1', 'rk': 'z'}, 'updates': {'num': 1}},
+        {'delete': {'hk': '1', 'rk': 'a'}, 'condition': {'num': {'<': 6}}},
+        {'put': item('1', 'a'), 'condition': {'hk': {'exists': False}}}
+    ]:
+        with pytest.raises(ex.TransactionException):
+            tb.transact_write([{'put': item('1', 'e')}, operation])
+        assert tb.get_item(hk='1', rk='e') is None
+    assert tb.get_item(hk='1', rk='a')['num'] == 6
+
+    # conditional put only if item doesn't exist
+    tb.transact_write([
+        {'put': item('1', 'e'), 'condition': {'hk': {'exists': False}}}
+    ])
+    assert tb.get_item(hk='1', rk='e') is not None
+
+    key = {'hk': '1', 'rk': 'a'}
+    for operations in [
+        [],
+        [{'get': key}],
+        [{'put': item('1', 'f'), 'delete': key}],
+        [{'delete': key, 'updates': {'num': 1}}],
+        [{'update': key}],
+        [{'delete': key}, {'check': key}],
+        [{'check': key, 'condition': {'bad name': 1}}],
+        [{'check': key, 'table': 'hash_range'}]
+    ]:
+        with pytest.raises(ex.ValidationException):
+            tb.transact_write(operations)
+
+    if multi_table:
+        tb2 = table('hash_only', dict(config or {}, key_attrs=['hk']))
+        transact_write([
+            {'table': tb, 'update': key, 'updates': {'num': 10}},
+            {'table': tb2, 'put': item('2')}
+        ])
+        assert tb.get_item(**key)['num'] == 10
+        assert validate_change_meta(
+            tb2.get_item(hk='2'), 'INSERT'
+        ) == item('2')
+        with pytest.raises(ex.ValidationException):
+            transact_write([{'put': item('3')}])
+
+
 def test_put_items(config=None):
     tb = table('hash_range', config)
     tb.put_items(items(['1', '2'], ['a', 'b']))
@@ -397,12 +571,13 @@ def test_hooks(config=None):
     plugin.clear_pms()
 
 
-def test_query(config=None, return_response=False):
+def test_query(config=None, return_response=False, decrypt=False):
     tb = table('hash_range', config)
     tb.put_items(items(['1', '2'], ['a', 'b']))
     response = tb.query(
         {'hk': '1'},
-        {'rk': 'a'}
+        {'rk': 'a'},
+        decrypt=decrypt
     )
     if return_response is True:
         return response
@@ -413,13 +588,72 @@ def test_query(config=None, return_response=False):
     }
 
 
-def test_query_sql(config=None, return_response=False):
+def test_query_operators(config=None, missing=True):
+    tb = table('hash_range', config)
+    _items = items(['1', '2'], ['a', 'ab', 'b', 'c'])
+    for _item in _items:
+        _item['tags'] = ['x' + _item['rk']]
+        if _item['rk'] == 'a':
+            _item['opt'] = 'yes'
+    tb.put_items(_items)
+
+    def _query(key, filters=None):
+        response = tb.query(dict({'hk': '1'}, **key), filters)
+        response = validate_change_meta_response(response, 'INSERT')
+        return sorted([_['rk'] for _ in response['items']])
+
+    # range/sort key operators
+    assert _query({'rk': {'begins_with': 'a'}}) == ['a', 'ab']
+    assert _query({'rk': {'between': ['ab', 'b']}}) == ['ab', 'b']
+    assert _query({'rk': {'<': 'b'}}) == ['a', 'ab']
+    assert _query({'rk': {'<=': 'b'}}) == ['a', 'ab', 'b']
+    assert _query({'rk': {'>': 'b'}}) == ['c']
+    assert _query({'rk': {'>=': 'b'}}) == ['b', 'c']
+
+    # filter operators
+    assert _query({}, {'rk': {'!=': 'a'}}) == ['ab', 'b', 'c']
+    assert _query({}, {'rk': {'in': ['a', 'c', 'd']}}) == ['a', 'c']
+    assert _query({}, {'tags': {'contains': 'xab'}}) == ['ab']
+    assert _query({}, {'opt': {'exists': True}}) == ['a']
+    if missing is True:
+        assert _query({}, {'opt': {'exists': False}}) == ['ab', 'b', 'c']
+    assert _query(
+        {'rk': {'begins_with': 'a'}}, {'tags': {'contains': 'xab'}}
+    ) == ['ab']
+
+    # filter only operators and multiple key conditions are invalid
+    for key in [
+        {'rk': {'in': ['a']}},
+        {'hk': {'begins_with': '1'}, 'rk': {'<': 'b'}}
+    ]:
+        with pytest.raises(ex.ValidationException):
+            tb.query(dict({'hk': '1'}, **key))
+    for val in [{'between': ['a']}, {'in': []}, {'exists': 'yes'}]:
+        with pytest.raises(ex.ValidationException):
+            tb.query({'hk': '1'}, {'rk': val})
+
+
+def test_count(config=None):
+    tb = table('hash_range', config)
+    assert tb.count() == 0
+    tb.put_items(items(['1', '2'], ['a', 'b', 'c']))
+    assert tb.count() == 6
+    assert tb.count({'hk': '1'}) == 3
+    assert tb.count({'hk': '1', 'rk': 'b'}) == 1
+    assert tb.count({'hk': '1', 'rk': {'>=': 'b'}}) == 2
+    assert tb.count({'hk': '2'}, {'str': 'str'}) == 3
+    assert tb.count({'hk': '2'}, {'str': 'nope'}) == 0
+    assert tb.count({'hk': '3'}) == 0
+
+
+def test_query_sql(config=None, return_response=False, decrypt=False):
     tb = table('hash_range', config)
     tb.put_items(items(['1', '2'], ['a', 'b']))
     response = tb.query_sql(
         'SELECT * FROM hash_range '
         + 'WHERE hash_range.hk = @hk AND hash_range.num > @num',
-        {'@hk': '1', '@num': 4}
+        {'@hk': '1', '@num': 4},
+        decrypt=decrypt
     )
     if return_response is True:
         return response
@@ -430,6 +664,83 @@ def test_query_sql(config=None, return_response=False):
     }
 
 
+def test_query_sql_many(config=None):
+    tb = table('hash_range', config)
+    tb.put_items(items(['1', '2'], ['a', 'b']))
+    statement = (
+        'SELECT * FROM hash_range '
+        + 'WHERE hash_range.hk = @hk AND hash_range.rk = @rk'
+    )
+    keys = [(hk, rk) for hk in ['1', '2'] for rk in ['a', 'b']] * 8
+    results = tb.query_sql_many([
+        (statement, {'@hk': '3', '@rk': 'a'}),
+        ('UPDATE hash_range SET num = 1', {})
+    ] + [
+        (statement, {'@hk': hk, '@rk': rk}) for (hk, rk) in keys
+    ])
+    assert results[0] == {'items': [], 'next': None, 'error': None}
+    assert results[1]['items'] == []
+    assert isinstance(results[1]['error'], ex.ValidationException)
+    assert len(results) == len(keys) + 2
+    for (hk, rk), result in zip(keys, results[2:]):
+        assert result['error'] is None
+        assert [
+            validate_change_meta(_, 'INSERT') for _ in result['items']
+        ] == [item(hk, rk)]
+    with pytest.raises(ex.ValidationException):
+        tb.query_sql_many([(statement, 'foo')])
+
+
+def test_query_blind_index(config=None):
+    config['kms'].update({
+        'blind_index_attrs': ['str'],
+        'blind_index_key': b'0123456789abcdef'
+    })
+    tb = table('hash_range', config)
+
+    def _get_items():
+        _items = items(['1', '2'], ['a', 'b'])
+        for _item in _items:
+            _item['str'] = _item['hk'] + _item['rk']
+        return _items
+
+    tb.put_items(_get_items())
+    _items = _get_items()
+
+    response = tb.query({'hk': '1'}, {'str': '1b'}, decrypt=True)
+    response = validate_change_meta_response(response, 'INSERT')
+    assert response['items'] == [_items[1]]
+
+    response = tb.query_sql(
+        'SELECT * FROM hash_range '
+        + 'WHERE hash_range.hk = @hk AND hash_range.str = @str',
+        {'@hk': '2', '@str': '2a'},
+        decrypt=True
+    )
+    response = validate_change_meta_response(response, 'INSERT')
+    assert response['items'] == [_items[2]]
+
+    # in and != use the blind index, other operators can't
+    response = tb.query(
+        {'hk': '1'}, {'str': {'in': ['1b', '2a']}}, decrypt=True
+    )
+    response = validate_change_meta_response(response, 'INSERT')
+    assert response['items'] == [_items[1]]
+    response = tb.query({'hk': '1'}, {'str': {'!=': '1b'}}, decrypt=True)
+    response = validate_change_meta_response(response, 'INSERT')
+    assert response['items'] == [_items[0]]
+    with pytest.raises(ex.ValidationException):
+        tb.query({'hk': '1'}, {'str': {'begins_with': '1'}})
+
+    # blind index is removed from results
+    response = tb.query({'hk': '1'}, {'str': 'nope'})
+    assert response['items'] == []
+    response = tb.query({'hk': '1'})
+    for _item in response['items']:
+        assert 'str' not in _item and 'str_bidx' not in _item
+    return tb
+
+
 def test_query_scan(config=None):
     tb = table('hash_range', config)
     tb.put_items(items(['1', '2'], ['a', 'b']))
@@ -453,3 +764,88 @@ def test_query_pagination(config=None):
 
     assert response['items'] == _items[2:4]
     assert response['next'] is None
+
+
+def test_query_fill(config=None):
+    tb = table('hash_range', config)
+    _items = items(['1'], [f'{_:02}' for _ in range(20)])
+    for i, _item in enumerate(_items):
+        _item['num'] = i % 5
+    tb.put_items(_items)
+    matched = [_ for _ in _items if _['num'] == 0]
+
+    # limit items matching the filters are returned, then the remainder
+    response = tb.query({'hk': '1'}, {'num': 0}, limit=3, fill=True)
+    assert response['items'] == matched[:3]
+    assert response['next'] is not None
+    response = tb.query(
+        {'hk': '1'}, {'num': 0}, limit=3, next=response['next'], fill=True
+    )
+    assert response['items'] == matched[3:]
+
+
+def test_consistency(config=None, levels=('eventual', 'session', 'strong')):
+    tb = table('hash_range', config)
+    tb.put_item(item('1', 'a'))
+    key = {'hk': '1', 'rk': 'a'}
+    for consistency in levels:
+        assert tb.get_item(**key, consistency=consistency)['str'] == 'str'
+        assert tb.get_items(
+            [key], consistency=consistency
+        )[0]['str'] == 'str'
+        assert tb.query(
+            {'hk': '1'}, consistency=consistency
+        )['items'][0]['str'] == 'str'
+    with pytest.raises(ex.ValidationException):
+        tb.get_item(**key, consistency='foo')
+
+    # default from config
+    tb = table('hash_range', dict(config or {}, consistency='foo'))
+    with pytest.raises(ex.ValidationException):
+        tb.query({'hk': '1'})
+
+
+def test_write_returns(config=None):
+    tb = table('hash_range', config)
+    item1 = item('1', 'a')
+    assert tb.put_item(item1.copy(), returns='none') is None
+    assert tb.get_item(hk='1', rk='a') == item1
+
+    # updated is the item as written, all the whole item after the write
+    updates = {'hk': '1', 'rk': 'a', 'num': 6}
+    assert tb.put_item(
+        updates.copy(), update=True, returns='updated'
+    ) == updates
+    assert tb.put_item(
+        {'hk': '1', 'rk': 'a', 'str': 'STR'}, update=True, returns='all'
+    ) == dict(item1, num=6, str='STR')
+
+    # put_items() only returns items if updated or all
+    assert tb.put_items(items(['1'], ['b', 'c'])) is None
+    assert tb.put_items(items(['1'], ['d']), returns='none') is None
+    assert tb.put_items([
+        {'hk': '1', 'rk': 'b', 'num': 7}
+    ], update=True, returns='updated') == [{'hk': '1', 'rk': 'b', 'num': 7}]
+    assert tb.put_items([
+        {'hk': '1', 'rk': 'c', 'num': 8}
+    ], update=True, returns='all') == [dict(item('1', 'c'), num=8)]
+    assert tb.get_item(hk='1', rk='b') == dict(item('1', 'b'), num=7)
+
+    with pytest.raises(ex.ValidationException) as e:
+        tb.put_item(item('1', 'e'), returns='foo')
+    assert e.value.title == (
+        'invalid returns: foo, must be one of: none, updated, all'
+    )
+
+    # default from config
+    tb = table('hash_range', dict(config or {}, returns='none'))
+    assert tb.put_item(item('1', 'e')) is None
+    assert tb.get_item(hk='1', rk='e') == item('1', 'e')
+
+
+def test_ttl(config=None):
+    # returns the expiry stamped on put_item() and put_items()
+    tb = table('hash_range', dict(config or {}, ttl_seconds=60))
+    tb.put_item(item('1', 'a'))
+    tb.put_items([item('1', 'b')])
+    return [tb.get_item(hk='1', rk=rk)['ttl'] for rk in ['a', 'b']]
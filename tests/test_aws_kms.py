@@ -2,8 +2,15 @@ from base64 import b64decode
 import os
 
 import boto3  # type: ignore
+from boto3.dynamodb.types import Binary  # type: ignore
 from boto3.dynamodb.types import Decimal  # type: ignore
 from moto import mock_aws  # type: ignore
+import pytest
+
+from abnosql.kms import KeySelector
+from abnosql.kms import kms
+from abnosql.plugins.kms.aws import Kms
+from abnosql.plugins.kms.aws import is_mrk_replicas
 
 from abnosql.mocks import mock_dynamodbx
 from tests import common as cmn
@@ -66,6 +73,45 @@ def test_get_put_item():
     assert item['num'] == Decimal('5')
 
 
+@mock_aws
+def test_put_items_get_items():
+    config = setup_dynamodb()
+    config['kms']['max_workers'] = 4
+    cmn.test_get_items(config)
+
+    # check its encrypted
+    resp = get_table('hash_range').get_item(Key={'hk': '2', 'rk': 'b'})
+    item = resp['Item']
+    assert b'aws-crypto-public-key' in b64decode(item['obj'])
+    assert b'aws-crypto-public-key' in b64decode(item['str'])
+
+
+@mock_dynamodbx
+@mock_aws
+def test_binary():
+    config = setup_dynamodb()
+    config['kms']['binary'] = True
+    cmn.test_get_item(config, 'hash_range')
+
+    # check its encrypted and stored as binary
+    resp = get_table('hash_range').get_item(Key={'hk': '1', 'rk': 'a'})
+    item = resp['Item']
+    assert isinstance(item['obj'], Binary)
+    assert b'aws-crypto-public-key' in item['obj'].value
+    cmn.test_query(config, decrypt=True)
+    cmn.test_query_sql(config, decrypt=True)
+
+
+@mock_dynamodbx
+@mock_aws
+def test_low_level():
+    config = setup_dynamodb()
+    config.update({'low_level': True})
+    config['kms']['binary'] = True
+    cmn.test_get_items(config)
+    cmn.test_query(config, decrypt=True)
+
+
 @mock_aws
 def test_query():
     config = setup_dynamodb()
@@ -83,3 +129,160 @@ def test_query_sql():
     for item in resp['items']:
         assert 'str' not in item and 'obj' not in item
         assert item['num'] == 5
+
+
+@mock_aws
+def test_query_projection():
+    config = setup_dynamodb()
+    config['kms']['plain_attrs'] = ['num', 'list']
+    resp = cmn.test_query(config, return_response=True)
+    assert len(resp['items']) == 1
+    for item in resp['items']:
+        assert item == {'hk': '1', 'rk': 'a', 'num': 5, 'list': [1, 2, 3]}
+
+    # decrypt=True fetches all attributes
+    cmn.test_query(config, decrypt=True)
+
+
+@mock_aws
+def test_query_decrypt():
+    config = setup_dynamodb()
+    cmn.test_query(config, decrypt=True)
+
+
+@mock_dynamodbx
+@mock_aws
+def test_query_sql_decrypt():
+    config = setup_dynamodb()
+    cmn.test_query_sql(config, decrypt=True)
+
+
+@mock_dynamodbx
+@mock_aws
+def test_query_sql_many_decrypt(monkeypatch):
+    config = setup_dynamodb()
+    tb = cmn.table('hash_range', config)
+    tb.put_items(cmn.items(['1', '2'], ['a', 'b']))
+
+    # items of all statements decrypted with a single decrypt_many()
+    calls = []
+    decrypt_many = Kms.decrypt_many
+
+    def _decrypt_many(self, serialized, contexts):
+        calls.append(len(serialized))
+        return decrypt_many(self, serialized, contexts)
+
+    monkeypatch.setattr(Kms, 'decrypt_many', _decrypt_many)
+    keys = [('1', 'a'), ('3', 'a'), ('2', 'b'), ('1', 'b')]
+    results = tb.query_sql_many([
+        ('SELECT * FROM hash_range WHERE hk = @hk AND rk = @rk',
+         {'@hk': hk, '@rk': rk}) for (hk, rk) in keys
+    ], decrypt=True)
+    assert calls == [6]
+    assert [
+        [cmn.validate_change_meta(_, 'INSERT') for _ in result['items']]
+        for result in results
+    ] == [
+        [cmn.item('1', 'a')], [], [cmn.item('2', 'b')], [cmn.item('1', 'b')]
+    ]
+
+
+@mock_dynamodbx
+@mock_aws
+def test_query_blind_index():
+    config = setup_dynamodb()
+    cmn.test_query_blind_index(config)
+    item = get_table('hash_range').get_item(
+        Key={'hk': '1', 'rk': 'a'}
+    )['Item']
+    assert len(item['str_bidx']) == 44
+
+
+def test_key_selector():
+    selector = KeySelector(['k1', 'k2', 'k3'], cooldown=60)
+    assert selector.ordered() == ['k1', 'k2', 'k3']
+
+    # measured keys ordered by latency after unmeasured keys
+    selector.record('k1', latency=0.1)
+    selector.record('k2', latency=0.01)
+    assert selector.ordered() == ['k3', 'k2', 'k1']
+    selector.record('k3', latency=0.05)
+    assert selector.ordered() == ['k2', 'k3', 'k1']
+
+    # unhealthy keys last until cooldown expires
+    for _ in range(3):
+        selector.record('k2', error=True)
+    assert not selector.healthy('k2')
+    assert selector.ordered() == ['k3', 'k1', 'k2']
+    selector.cooldown = 0
+    assert selector.healthy('k2')
+
+    # failover to next key, is_error controls whether errors count
+    selector = KeySelector(['k1', 'k2'])
+
+    def func(key_id):
+        if key_id == 'k1':
+            raise ValueError('k1 down')
+        return key_id
+
+    assert selector.call(func) == 'k2'
+    assert selector.call(func, preferred='k1') == 'k2'
+    assert selector.ordered() == ['k2', 'k1']
+    selector = KeySelector(['k1', 'k2'])
+    selector.call(func, is_error=lambda e: False)
+    assert selector.healthy('k1') and 'k1' not in selector._stats
+    with pytest.raises(ValueError):
+        selector.call(func, key_ids=['k1'])
+
+
+@mock_aws
+def test_multi_region_keys():
+    config = setup_dynamodb()
+    key_ids = [
+        config['kms']['key_ids'][0],
+        boto3.client('kms', region_name='us-west-2').create_key(
+            Policy='test kms'
+        )['KeyMetadata']['Arn']
+    ]
+    _kms1 = kms({'key_ids': key_ids}, 'aws')
+    _kms2 = kms({'key_ids': list(reversed(key_ids))}, 'aws')
+    context = {'hk': '1'}
+
+    # either key decrypts data encrypted with the other
+    assert _kms2.decrypt(_kms1.encrypt('foo', context), context) == 'foo'
+    assert _kms1.decrypt(_kms2.encrypt('bar', context), context) == 'bar'
+
+    # not MRK replicas, so encrypted under every key and each key alone
+    # can decrypt
+    assert _kms1.mrk_replicas is False
+    for key_id in key_ids:
+        _kms = kms({'key_ids': [key_id]}, 'aws')
+        assert _kms.decrypt(_kms1.encrypt('baz', context), context) == 'baz'
+
+    # MRK replicas encrypt under the fastest replica only (moto can't
+    # decrypt MRK ciphertexts)
+    meta = boto3.client('kms').create_key(
+        Policy='test kms', MultiRegion=True
+    )['KeyMetadata']
+    arn = meta['Arn']
+    replica = boto3.client('kms').replicate_key(
+        KeyId=meta['KeyId'], ReplicaRegion='us-west-2'
+    )['ReplicaKeyMetadata']['Arn']
+    _kms1 = kms({'key_ids': [arn, replica]}, 'aws')
+    assert _kms1.mrk_replicas is True
+    assert _kms1.encrypt('foo', context)
+    assert set(_kms1.key_selector._stats.keys()) == {arn}
+
+
+def test_is_mrk_replicas():
+    arn = 'arn:aws:kms:{}:111122223333:key/{}'
+    assert is_mrk_replicas([
+        arn.format('us-east-1', 'mrk-1234'), arn.format('us-west-2', 'mrk-1234')
+    ])
+    assert is_mrk_replicas(['mrk-1234'])
+    assert not is_mrk_replicas([
+        arn.format('us-east-1', 'mrk-1234'), arn.format('us-west-2', 'mrk-5678')
+    ])
+    assert not is_mrk_replicas([
+        arn.format('us-east-1', '1234'), arn.format('us-west-2', '1234')
+    ])
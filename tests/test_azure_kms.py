@@ -4,11 +4,16 @@ import os
 
 import responses  # type: ignore
 
+from abnosql.kms import DekCache
+from abnosql.kms import kms
+from abnosql.kms import unpack_bytes
 from abnosql.mocks import mock_azure_kms
 from abnosql.mocks.mock_azure_kms import AESGCM_KEY
+from abnosql.mocks.mock_azure_kms import LATEST_KEY_VERSION
 from abnosql.mocks import mock_cosmos
 from abnosql.mocks.mock_cosmos import set_keyattrs
 from abnosql.plugins.table.memory import clear_tables
+from abnosql.table import LazyItem
 from abnosql import table
 from tests import common as cmn
 
@@ -57,6 +62,171 @@ def test_get_put_item():
     assert item['num'] == 5
 
 
+@mock_azure_kms
+@mock_cosmos
+@responses.activate
+def test_put_items_get_items():
+    config = setup_cosmos()
+    config['key_attrs'] = ['hk', 'rk']
+    cmn.test_get_items(config)
+
+    # check its encrypted
+    tb = table('hash_range', database='memory')
+    item = tb.get_item(hk='2', rk='b')
+    assert item['obj'].startswith('AAABp')
+    assert item['str'].startswith('AAABf')
+
+
+@mock_azure_kms
+@responses.activate
+def test_encrypt_decrypt_many():
+    setup_cosmos()
+    _kms = kms({'dek_cache': {'max_items': 2}}, 'azure')
+    assert isinstance(_kms.dek_cache, DekCache)
+    contexts = [{'hk': '1', 'rk': 'a'}, {'hk': '1', 'rk': 'b'}]
+    serialized = _kms.encrypt_many(
+        ['foo', 'bar'], contexts, key=b64decode(AESGCM_KEY)
+    )
+    assert len(serialized) == 2 and serialized[0] != serialized[1]
+    assert _kms.decrypt_many(serialized, contexts) == ['foo', 'bar']
+
+    # unwrapped key cached so no further remote calls
+    calls = len(responses.calls)
+    assert _kms.decrypt_many(serialized, contexts) == ['foo', 'bar']
+    assert _kms.decrypt(serialized[1], contexts[1]) == 'bar'
+    assert len(responses.calls) == calls
+
+
+def kv_calls(suffix, method='POST'):
+    return [
+        _ for _ in responses.calls
+        if _.request.method == method
+        and _.request.url.split('?')[0].rstrip('/').endswith(suffix)
+    ]
+
+
+@mock_azure_kms
+@responses.activate
+def test_local_wrap():
+    setup_cosmos()
+    _kms = kms({}, 'azure')
+    contexts = [{'hk': '1', 'rk': 'a'}, {'hk': '1', 'rk': 'b'}]
+    serialized = _kms.encrypt_many(['foo', 'bar'], contexts)
+    _kms.encrypt('baz', contexts[0])
+
+    # public key fetched once and DEKs wrapped locally
+    assert len(kv_calls('/wrapkey')) == 0
+    assert len(kv_calls(KEY_ID, 'GET')) == 1
+    assert len(unpack_bytes(b64decode(serialized[0]))) == 3
+
+
+@mock_azure_kms
+@responses.activate
+def test_local_wrap_rotation():
+    setup_cosmos()
+    # versionless key id, so latest version is used and stored with data
+    key_id = KEY_ID.rsplit('/', 1)[0]
+    _kms = kms({
+        'key_ids': [key_id],
+        'public_key_max_age': 0
+    }, 'azure')
+    context = {'hk': '1', 'rk': 'a'}
+    serialized = _kms.encrypt('foo', context, key=b64decode(AESGCM_KEY))
+    _kms.encrypt('bar', context)
+    assert len(kv_calls(key_id, 'GET')) == 2
+    unpacked = unpack_bytes(b64decode(serialized))
+    assert unpacked[3].decode() == f'{key_id}/{LATEST_KEY_VERSION}'
+
+    # unwrap uses key version stored with data
+    assert _kms.decrypt(serialized, context) == 'foo'
+    assert len(kv_calls(f'{LATEST_KEY_VERSION}/unwrapkey')) == 1
+
+
+@mock_azure_kms
+@responses.activate
+def test_multiple_keys():
+    setup_cosmos()
+    key_id2 = KEY_ID.replace('foo', 'baz')
+    _kms = kms({'key_ids': [KEY_ID, key_id2], 'local_wrap': False}, 'azure')
+    context = {'hk': '1', 'rk': 'a'}
+    key = b64decode(AESGCM_KEY)
+
+    # distinct keys, so the first key wraps even if another is faster
+    _kms.key_selector.record(key_id2, latency=0.001)
+    _kms.key_selector.record(KEY_ID, latency=1)
+    serialized = _kms.encrypt('foo', context, key=key)
+    assert len(kv_calls(KEY_ID, 'GET')) == 1
+    assert len(kv_calls(key_id2, 'GET')) == 0
+
+    # unwrap goes straight to the key that wrapped the DEK
+    assert _kms.decrypt(serialized, context) == 'foo'
+    serialized = _kms.encrypt_local('bar', context, key, b'dek', key_id2)
+    assert _kms.decrypt(serialized, context) == 'bar'
+    assert len(kv_calls(f'{KEY_ID}/unwrapkey')) == 1
+    assert len(kv_calls(f'{key_id2}/unwrapkey')) == 1
+
+    # replicas fail over, a key that didn't wrap the DEK doesn't count
+    # against its health
+    wrong = KEY_ID.replace('/bar/', '/wrong/')
+    _kms = kms({
+        'key_ids': [wrong, KEY_ID], 'key_replicas': True, 'local_wrap': False
+    }, 'azure')
+    serialized = _kms.encrypt('baz', context, key=key)
+    assert _kms.decrypt(serialized, context) == 'baz'
+    assert len(kv_calls(f'{wrong}/unwrapkey')) == 1
+    assert _kms.key_selector._stats[wrong]['errors'] == 0
+
+
+@mock_azure_kms
+@responses.activate
+def test_envelope_v2():
+    setup_cosmos()
+    context = {'hk': '1', 'rk': 'a'}
+    key = b64decode(AESGCM_KEY)
+    _kms = kms({'envelope_version': 2}, 'azure')
+    v1 = kms({}, 'azure').encrypt('foo', context, key=key)
+    v2 = _kms.encrypt('foo', context, key=key)
+    packed = b64decode(v2)
+    assert packed[0] == 2
+    assert len(packed) < len(b64decode(v1)) - 84
+
+    # v1 still readable
+    assert _kms.decrypt_many([v1, v2], [context, context]) == ['foo', 'foo']
+
+    # key version stored if key_id is versionless
+    _kms = kms({
+        'envelope_version': 2,
+        'key_ids': [KEY_ID.rsplit('/', 1)[0]]
+    }, 'azure')
+    v2 = _kms.encrypt('foo', context, key=key)
+    (_, nonce, _, kid) = _kms.unpack(v2)
+    assert len(nonce) == 12 and kid.endswith(LATEST_KEY_VERSION)
+    assert _kms.decrypt(v2, context) == 'foo'
+
+
+@mock_azure_kms
+@mock_cosmos
+@responses.activate
+def test_lazy_decrypt():
+    config = setup_cosmos()
+    config['kms']['lazy'] = True
+    cmn.test_get_item(config, ['hash_range'])
+
+    tb = table('hash_range', config)
+    item = tb.get_item(hk='1', rk='a')
+    assert isinstance(item, LazyItem)
+    calls = len(kv_calls('/unwrapkey'))
+    assert item['num'] == 5 and 'obj' in item
+    assert len(kv_calls('/unwrapkey')) == calls
+
+    # decrypted on first access only
+    assert item['str'] == 'str'
+    assert item.get('str') == 'str'
+    assert len(kv_calls('/unwrapkey')) == calls + 1
+    assert cmn.validate_change_meta(item, 'INSERT') == cmn.item('1', 'a')
+    assert len(kv_calls('/unwrapkey')) == calls + 2
+
+
 @mock_azure_kms
 @mock_cosmos
 @responses.activate
@@ -77,3 +247,44 @@ def test_query_sql():
     for item in resp['items']:
         assert 'str' not in item and 'obj' not in item
         assert item['num'] == 5
+
+
+@mock_azure_kms
+@mock_cosmos
+@responses.activate
+def test_query_projection():
+    config = setup_cosmos()
+    config['kms']['plain_attrs'] = ['num', 'list']
+    resp = cmn.test_query(config, return_response=True)
+    assert len(resp['items']) == 1
+    for item in resp['items']:
+        assert item == {'hk': '1', 'rk': 'a', 'num': 5, 'list': [1, 2, 3]}
+
+    # decrypt=True fetches all attributes
+    cmn.test_query(config, decrypt=True)
+
+
+@mock_azure_kms
+@mock_cosmos
+@responses.activate
+def test_query_decrypt():
+    config = setup_cosmos()
+    cmn.test_query(config, decrypt=True)
+
+
+@mock_azure_kms
+@mock_cosmos
+@responses.activate
+def test_query_sql_decrypt():
+    config = setup_cosmos()
+    cmn.test_query_sql(config, decrypt=True)
+
+
+@mock_azure_kms
+@mock_cosmos
+@responses.activate
+def test_query_blind_index():
+    config = setup_cosmos()
+    cmn.test_query_blind_index(config)
+    item = table('hash_range', database='memory').get_item(hk='1', rk='a')
+    assert len(item['str_bidx']) == 44
@@ -1,4 +1,5 @@
 from base64 import b64encode
+import json
 import os
 import time
 
@@ -9,13 +10,17 @@ import responses  # type: ignore
 import abnosql.exceptions as ex
 from abnosql.mocks import mock_cosmos
 from abnosql.mocks.mock_cosmos import set_keyattrs
+from abnosql.mocks.mock_cosmos import set_partition_key_ranges
 from abnosql.plugins.table import cosmos
 from abnosql.plugins.table.memory import clear_tables
+from abnosql import table
+from abnosql.table import clear_table_metadata
 from tests import common as cmn
 
 
 def setup_cosmos():
     clear_tables()
+    set_partition_key_ranges(1)
     os.environ['ABNOSQL_KEY_ATTRS'] = 'hk,rk'
     set_keyattrs({
         'hash_range': ['hk', 'rk'],
@@ -84,6 +89,13 @@ def test_get_item():
     cmn.test_get_item()
 
 
+@mock_cosmos
+@responses.activate
+def test_get_items():
+    setup_cosmos()
+    cmn.test_get_items()
+
+
 @mock_cosmos
 @responses.activate
 def test_check_exists():
@@ -161,6 +173,215 @@ def test_query():
     cmn.test_query()
 
 
+@mock_cosmos
+@responses.activate
+def test_query_operators():
+    setup_cosmos()
+    cmn.test_query_operators()
+
+
+@mock_cosmos
+@responses.activate
+def test_attributes():
+    setup_cosmos()
+    cmn.test_attributes()
+
+
+@mock_cosmos
+@responses.activate
+def test_count():
+    setup_cosmos()
+    cmn.test_count()
+
+
+@mock_cosmos
+@responses.activate
+def test_update_item_ops():
+    setup_cosmos()
+    cmn.test_update_item_ops()
+
+
+@mock_cosmos
+@responses.activate
+def test_update_item_replace():
+    setup_cosmos()
+    tb = table('hash_range', {'cosmos_change_meta': False})
+    tb.put_item(cmn.item('1', 'a'))
+    key = {'hk': '1', 'rk': 'a'}
+
+    # over 10 patch operations is a single etag guarded replace, not
+    # separate (non atomic) patches
+    start = len(responses.calls)
+    updated = tb.update_item(key, {
+        'list': {'append': list(range(4, 14))},
+        'num': {'increment': 1}
+    })
+    assert updated['list'] == list(range(1, 14))
+    assert updated['num'] == 6
+    methods = [_.request.method for _ in responses.calls[start:]]
+    assert 'PATCH' not in methods and methods.count('PUT') == 1
+
+    # failures don't partially apply the update
+    with pytest.raises(ex.ValidationException):
+        tb.update_item(key, {
+            'list': {'append': list(range(20, 30))},
+            'str': {'increment': 1}
+        })
+    assert tb.get_item(**key) == dict(
+        cmn.item('1', 'a'), list=list(range(1, 14)), num=6
+    )
+
+    # as are set_if_not_exists (including names that aren't identifiers)
+    # and patches that are bad requests (append to a missing list, remove
+    # a missing attribute), without separate conditional patches
+    start = len(responses.calls)
+    updated = tb.update_item(key, {
+        'created-at': {'set_if_not_exists': '2024'},
+        'num': {'set_if_not_exists': 1}
+    })
+    assert updated['created-at'] == '2024' and updated['num'] == 6
+    methods = [_.request.method for _ in responses.calls[start:]]
+    assert 'PATCH' not in methods and methods.count('PUT') == 1
+    start = len(responses.calls)
+    updated = tb.update_item(key, {
+        'tags': {'append': ['a']},
+        'missing': {'remove': True},
+        'num': {'increment': 1}
+    })
+    assert updated['tags'] == ['a'] and updated['num'] == 7
+    methods = [_.request.method for _ in responses.calls[start:]]
+    assert methods.count('PATCH') == 1 and methods.count('PUT') == 1
+
+
+@mock_cosmos
+@responses.activate
+def test_transact_write():
+    setup_cosmos()
+    cmn.test_transact_write(multi_table=False)
+
+    # failed batch operation (append to string) rolls back the batch
+    tb = table('hash_range')
+    with pytest.raises(ex.TransactionException) as e:
+        tb.transact_write([
+            {'put': cmn.item('1', 'x')},
+            {'update': {'hk': '1', 'rk': 'a'}, 'updates': {
+                'str': {'append': ['x']}
+            }}
+        ])
+    assert e.value.detail == 'operation 1 failed with status 400'
+    assert tb.get_item(hk='1', rk='x') is None
+
+    # check reads (not writes) the item, failing if changed since
+    container = tb._container(tb.name)
+    before = container.read_item(item='a', partition_key='1')
+    start = len(responses.calls)
+    tb.transact_write([
+        {'check': {'hk': '1', 'rk': 'a'}},
+        {'put': cmn.item('1', 'y')}
+    ])
+    after = container.read_item(item='a', partition_key='1')
+    assert (after['_etag'], after['_ts']) == (before['_etag'], before['_ts'])
+    batch = [
+        json.loads(_.request.body) for _ in responses.calls[start:]
+        if _.request.headers.get('x-ms-cosmos-is-batch-request') == 'True'
+    ][0]
+    assert batch[0]['operationType'] == 'Read'
+    assert batch[0]['ifMatch'] == before['_etag']
+
+    # batches are within one container and partition key
+    with pytest.raises(ex.ValidationException):
+        tb.transact_write([
+            {'put': cmn.item('1', 'x')},
+            {'put': cmn.item('2', 'x')}
+        ])
+
+
+@mock_cosmos
+@responses.activate
+def test_describe():
+    setup_cosmos()
+    clear_table_metadata()
+
+    # key attrs from partition key path and document id if not configured
+    os.environ.pop('ABNOSQL_KEY_ATTRS')
+    tb = table('hash_range')
+    assert tb.key_attrs == ['hk', 'id']
+    metadata = tb.describe()
+    assert metadata['key_attrs'] == ['hk', 'id']
+    assert metadata['indexes'] == []
+    assert metadata['indexing_policy']['indexingMode'] == 'consistent'
+    clear_table_metadata()
+
+
+@mock_cosmos
+@responses.activate
+def test_consistency():
+    setup_cosmos()
+    cmn.test_consistency()
+
+    # session reads send the session token of the table's last write
+    tb = table('hash_range')
+    assert tb.session_token is None
+    tb.put_item(cmn.item('1', 'b'))
+    assert tb.session_token is not None
+
+    # taken from each write's own response, not the client's last response
+    # (shared with other tables and threads)
+    token = tb.session_token
+    assert token == responses.calls[-1].response.headers['x-ms-session-token']
+    table('hash_range').put_item(cmn.item('1', 'c'))
+    assert tb.session_token == token
+    tb.update_item({'hk': '1', 'rk': 'b'}, {'num': 6})
+    assert tb.session_token != token
+    tb.delete_item(hk='1', rk='b')
+    tb.transact_write([{'put': cmn.item('1', 'b')}])
+    token = tb.session_token
+    assert token == responses.calls[-1].response.headers['x-ms-session-token']
+    tb.get_item(hk='1', rk='b', consistency='session')
+    headers = responses.calls[-1].request.headers
+    assert headers['x-ms-session-token'] == tb.session_token
+    assert headers['x-ms-consistency-level'] == 'Session'
+    tb.query({'hk': '1'}, consistency='eventual')
+    headers = responses.calls[-1].request.headers
+    assert headers['x-ms-consistency-level'] == 'Eventual'
+
+    # levels stronger than the account default use the account default
+    # (the mock returns 400 for a Strong header)
+    assert tb.get_item(hk='1', rk='b', consistency='strong')
+    headers = responses.calls[-1].request.headers
+    assert headers['x-ms-consistency-level'] == 'Session'
+    tb = table('hash_range', {'cosmos_account_consistency': 'eventual'})
+    assert tb.get_item(hk='1', rk='b', consistency='eventual')
+    with pytest.raises(ex.ValidationException) as e:
+        table('hash_range', {'cosmos_account_consistency': 'foo'}).get_item(
+            hk='1', rk='b', consistency='eventual'
+        )
+    assert 'invalid cosmos_account_consistency: foo' in str(e.value)
+
+
+@mock_cosmos
+@responses.activate
+def test_write_returns():
+    setup_cosmos()
+    cmn.test_write_returns({'cosmos_change_meta': False})
+
+    # minimal response (no document) unless returns all
+    tb = table('hash_range')
+    tb.put_item(cmn.item('2', 'a'), returns='none')
+    assert responses.calls[-1].request.headers['Prefer'] == 'return=minimal'
+    assert responses.calls[-1].response.text == ''
+    tb.put_item({'hk': '2', 'rk': 'a', 'num': 6}, update=True, returns='all')
+    assert 'Prefer' not in responses.calls[-1].request.headers
+
+
+@mock_cosmos
+@responses.activate
+def test_ttl():
+    setup_cosmos()
+    # seconds since last modified, always the ttl attribute
+    assert cmn.test_ttl({'ttl_attribute': 'expires'}) == [60, 60]
+
+
 @mock_cosmos
 @responses.activate
 def test_query_sql():
@@ -168,6 +389,13 @@ def test_query_sql():
     cmn.test_query_sql()
 
 
+@mock_cosmos
+@responses.activate
+def test_query_sql_many():
+    setup_cosmos()
+    cmn.test_query_sql_many()
+
+
 @mock_cosmos
 @responses.activate
 def test_query_scan():
@@ -180,3 +408,160 @@ def test_query_scan():
 def test_query_pagination():
     setup_cosmos()
     cmn.test_query_pagination()
+
+
+@mock_cosmos
+@responses.activate
+def test_query_fill():
+    setup_cosmos()
+    cmn.test_query_fill()
+
+
+@mock_cosmos
+@responses.activate
+def test_query_continuation():
+    setup_cosmos()
+    # new container as the SDK caches partition key ranges per container
+    set_keyattrs({'partitioned': ['hk', 'rk']})
+    set_partition_key_ranges(3)
+    tb = table('partitioned')
+    _items = cmn.items(['1', '2', '3', '4'], ['a', 'b', 'c'])
+    tb.put_items(_items)
+
+    def _query_calls(start):
+        return [
+            _.request for _ in responses.calls[start:]
+            if _.request.headers.get('x-ms-documentdb-isquery') == 'true'
+        ]
+
+    # cross partition pages are read one feed range at a time with
+    # continuation tokens, without OFFSET
+    start = len(responses.calls)
+    (found, next) = ([], None)
+    while True:
+        response = tb.query(limit=5, next=next)
+        assert len(response['items']) <= 5
+        found.extend(response['items'])
+        next = response['next']
+        if next is None:
+            break
+        assert not next.isdigit()
+    key = (lambda _: (_['hk'], _['rk']))
+    assert sorted(found, key=key) == sorted(_items, key=key)
+    calls = _query_calls(start)
+    assert len(set(
+        _.headers['x-ms-documentdb-partitionkeyrangeid'] for _ in calls
+    )) == 3
+    assert all('OFFSET' not in _.body for _ in calls)
+
+    # single partition pages with partition key and continuation token
+    start = len(responses.calls)
+    response = tb.query({'hk': '2'}, limit=2)
+    assert response['items'] == _items[3:5]
+    response = tb.query({'hk': '2'}, limit=2, next=response['next'])
+    assert response['items'] == _items[5:6]
+    assert response['next'] is None
+    calls = _query_calls(start)
+    assert [
+        _.headers['x-ms-documentdb-partitionkey'] for _ in calls
+    ] == ['["2"]', '["2"]']
+
+    # merged cross partition results can't use continuation tokens, so
+    # need OFFSET opted into via config (or in the statement)
+    statement = 'SELECT * FROM partitioned ORDER BY partitioned.rk'
+    with pytest.raises(ex.ValidationException) as e:
+        tb.query_sql(statement, limit=2)
+    assert 'cosmos_pagination offset' in str(e.value)
+    assert tb.query_sql(statement + ' OFFSET 0 LIMIT 2')['next'] is None
+    for merged in [
+        'SELECT DISTINCT partitioned.hk FROM partitioned',
+        'SELECT TOP 2 * FROM partitioned',
+        'SELECT VALUE count(1) FROM partitioned',
+        'SELECT * FROM partitioned p GROUP BY p.hk'
+    ]:
+        assert cosmos.MERGED_QUERY_PAT.search(merged)
+    for unmerged in [
+        'SELECT partitioned.top FROM partitioned',
+        'SELECT * FROM partitioned WHERE partitioned["top"] = 1',
+        'SELECT * FROM partitioned WHERE partitioned.count = 1',
+        'SELECT * FROM partitioned WHERE partitioned.distinct = 1'
+    ]:
+        assert not cosmos.MERGED_QUERY_PAT.search(unmerged)
+    tb = table('partitioned', {'cosmos_pagination': 'offset'})
+    assert tb.query_sql(statement, limit=2)['next'] == '2'
+    response = tb.query({'hk': '2'}, limit=2)
+    assert response['items'] == _items[3:5]
+    assert response['next'] == '2'
+    assert response['items'] == tb.query_sql(
+        'SELECT * FROM partitioned WHERE partitioned.hk = @hk',
+        {'@hk': '2'}, limit=2
+    )['items']
+    with pytest.raises(ex.ValidationException):
+        table('partitioned', {'cosmos_pagination': 'foo'}).query(limit=2)
+
+    # next tokens from the other pagination mode (or garbage) are rejected
+    token = table('partitioned').query({'hk': '2'}, limit=2)['next']
+    for _tb, _next, expected in [
+        (tb, token, 'offset'),
+        (table('partitioned'), '2', 'continuation'),
+        (table('partitioned'), 'foo', 'continuation'),
+        (table('partitioned'), 'Zm9v', 'continuation')
+    ]:
+        with pytest.raises(ex.ValidationException) as e:
+            _tb.query({'hk': '2'}, limit=2, next=_next)
+        assert str(e.value) == f'invalid next, expected {expected} token'
+    set_partition_key_ranges(1)
+
+
+@mock_cosmos
+@responses.activate
+def test_query_partition_key():
+    setup_cosmos()
+    tb = table('hash_range')
+    tb.put_items(cmn.items(['1', '2'], ['a', 'b']))
+
+    def _partition_key():
+        headers = responses.calls[-1].request.headers
+        if headers.get('x-ms-documentdb-query-enablecrosspartition'):
+            assert 'x-ms-documentdb-partitionkey' not in headers
+            return None
+        return headers['x-ms-documentdb-partitionkey']
+
+    # partition key equality in key or SQL parameters is single partition
+    assert len(tb.query({'hk': '1'})['items']) == 2
+    assert _partition_key() == '["1"]'
+    assert len(tb.query_sql(
+        'SELECT * FROM hash_range WHERE hash_range.hk = @hk '
+        'AND hash_range.num = @num',
+        {'@hk': '2', '@num': 5}
+    )['items']) == 2
+    assert _partition_key() == '["2"]'
+    assert tb.count({'hk': '1'}) == 2
+    assert _partition_key() == '["1"]'
+    tb = table('hash_range', {'cosmos_pagination': 'offset'})
+    assert len(tb.query({'hk': '2'}, limit=1)['items']) == 1
+    assert _partition_key() == '["2"]'
+
+    # otherwise cross partition
+    assert len(tb.query({'hk': {'begins_with': '1'}})['items']) == 2
+    assert _partition_key() is None
+    assert len(tb.query_sql(
+        'SELECT * FROM hash_range WHERE hash_range.hk = @hk '
+        'OR hash_range.rk = @rk',
+        {'@hk': '1', '@rk': 'a'}
+    )['items']) == 3
+    assert _partition_key() is None
+    assert tb.count() == 4
+    assert _partition_key() is None
+
+    # nested attributes and NOT aren't the partition key
+    tb.query_sql(
+        'SELECT * FROM hash_range WHERE hash_range.obj.hk = @hk',
+        {'@hk': '1'}
+    )
+    assert _partition_key() is None
+    assert len(tb.query_sql(
+        'SELECT * FROM hash_range WHERE NOT (hash_range.hk = @hk)',
+        {'@hk': '1'}
+    )['items']) == 2
+    assert _partition_key() is None
@@ -1,12 +1,27 @@
+from base64 import b64decode
+import json
 import os
+import time
 
 import boto3  # type: ignore
+from boto3.dynamodb.types import Binary  # type: ignore
+from boto3.dynamodb.types import Decimal  # type: ignore
+from boto3.dynamodb.types import TypeSerializer  # type: ignore
+from botocore.exceptions import ClientError  # type: ignore
 from moto import mock_aws  # type: ignore
 import pytest
 
 import abnosql.exceptions as ex
 from abnosql.mocks import mock_dynamodbx
+from abnosql.plugins.table.dynamodb import from_attribute_value
+from abnosql.plugins.table.dynamodb import get_consistent_read_kwargs
+from abnosql.plugins.table.dynamodb import from_dynamodb
+from abnosql.plugins.table.dynamodb import json_serial
+from abnosql.plugins.table.dynamodb import to_attribute_value
+from abnosql.plugins.table.dynamodb import to_dynamodb
 from abnosql import table
+from abnosql.table import clear_table_metadata
+from abnosql.table import get_table_metadata
 from tests import common as cmn
 
 
@@ -66,6 +81,12 @@ def test_get_item():
     cmn.test_get_item()
 
 
+@mock_aws
+def test_get_items():
+    setup_dynamodb()
+    cmn.test_get_items()
+
+
 @mock_aws
 def test_check_exists():
     setup_dynamodb()
@@ -126,6 +147,83 @@ def test_query():
     cmn.test_query()
 
 
+@mock_aws
+def test_query_operators():
+    setup_dynamodb()
+    cmn.test_query_operators()
+
+
+@mock_aws
+def test_attributes():
+    setup_dynamodb()
+    cmn.test_attributes()
+
+
+@mock_aws
+def test_count():
+    setup_dynamodb()
+    cmn.test_count()
+
+
+@mock_aws
+def test_update_item_ops():
+    setup_dynamodb()
+    cmn.test_update_item_ops()
+
+
+@mock_aws
+def test_transact_write():
+    setup_dynamodb()
+    cmn.test_transact_write()
+
+
+@mock_dynamodbx
+@mock_aws
+def test_consistency():
+    setup_dynamodb()
+    cmn.test_consistency()
+    assert get_consistent_read_kwargs(None) == {}
+    assert get_consistent_read_kwargs('eventual') == {'ConsistentRead': False}
+    assert get_consistent_read_kwargs('session') == {'ConsistentRead': True}
+    assert get_consistent_read_kwargs('strong') == {'ConsistentRead': True}
+    results = table('hash_range', {'consistency': 'strong'}).query_sql_many([
+        ('SELECT * FROM hash_range WHERE hk = @hk AND rk = @rk',
+         {'@hk': '1', '@rk': 'a'})
+    ])
+    assert results[0]['items'][0]['str'] == 'str'
+
+
+@mock_aws
+def test_write_returns():
+    setup_dynamodb()
+    cmn.test_write_returns()
+
+    # put_items() doesn't ask for the item back unless it returns it
+    tb = table('hash_range')
+    calls = []
+    _request = tb._request
+
+    def request(method, **kwargs):
+        calls.append(kwargs.get('ReturnValues'))
+        return _request(method, **kwargs)
+
+    tb._request = request  # type: ignore
+    tb.put_items([{'hk': '1', 'rk': 'a', 'num': 9}], update=True)
+    tb.put_items(
+        [{'hk': '1', 'rk': 'a', 'num': 10}], update=True, returns='all'
+    )
+    assert calls == ['NONE', 'ALL_NEW']
+
+
+@mock_aws
+def test_ttl():
+    setup_dynamodb()
+    # epoch seconds number
+    for ttl in cmn.test_ttl():
+        assert isinstance(ttl, int)
+        assert time.time() + 55 < ttl <= time.time() + 60
+
+
 @mock_dynamodbx
 @mock_aws
 def test_query_sql():
@@ -133,6 +231,37 @@ def test_query_sql():
     cmn.test_query_sql()
 
 
+@mock_dynamodbx
+@mock_aws
+def test_query_sql_many():
+    setup_dynamodb()
+    cmn.test_query_sql_many()
+
+    # a failed batch is an error for each of its statements only
+    tb = table('hash_range')
+    execute = tb.client.batch_execute_statement
+    calls = []
+
+    def _batch_execute_statement(**kwargs):
+        calls.append(kwargs)
+        if len(calls) == 1:
+            raise ClientError({'Error': {
+                'Code': 'ThrottlingException', 'Message': 'slow down'
+            }}, 'BatchExecuteStatement')
+        return execute(**kwargs)
+
+    tb.client.batch_execute_statement = _batch_execute_statement
+    tb.config['max_workers'] = 1
+    results = tb.query_sql_many([
+        ('SELECT * FROM hash_range WHERE hk = @hk AND rk = @rk',
+         {'@hk': '1', '@rk': 'a'})
+    ] * 26)
+    assert all(
+        isinstance(_['error'], ex.ValidationException) for _ in results[:25]
+    )
+    assert results[25]['error'] is None
+
+
 @mock_dynamodbx
 @mock_aws
 def test_query_scan():
@@ -145,3 +274,268 @@ def test_query_scan():
 def test_query_pagination():
     setup_dynamodb()
     cmn.test_query_pagination()
+
+
+@mock_dynamodbx
+@mock_aws
+def test_query_fill():
+    setup_dynamodb()
+    cmn.test_query_fill()
+
+    # last page read to the end of the partition
+    tb = table('hash_range')
+    response = tb.query({'hk': '1'}, {'num': 0}, limit=5, fill=True)
+    assert len(response['items']) == 4 and response['next'] is None
+
+    # without fill, limit is applied before filters
+    tb = table('hash_range')
+    response = tb.query({'hk': '1'}, {'num': 0}, limit=3)
+    assert [_['rk'] for _ in response['items']] == ['00']
+    assert response['next'] is not None
+
+    # pages and items scanned can be capped, resuming from where it stopped
+    tb = table('hash_range', {'fill_max_scanned': 7})
+    response = tb.query({'hk': '1'}, {'num': 0}, limit=3, fill=True)
+    assert [_['rk'] for _ in response['items']] == ['00', '05']
+    response = tb.query(
+        {'hk': '1'}, {'num': 0}, limit=3, next=response['next'], fill=True
+    )
+    assert [_['rk'] for _ in response['items']] == ['10']
+    tb = table('hash_range', {'fill_max_pages': 2})
+    response = tb.query({'hk': '1'}, {'num': 0}, limit=3, fill=True)
+    assert [_['rk'] for _ in response['items']] == ['00', '05']
+
+    # pages are sized from the filter selectivity so far, so sparse
+    # filters take fewer round trips.  Items past limit are trimmed and
+    # next resumes after the last returned item
+    tb = table('hash_range')
+    tb.put_items([
+        {'hk': '2', 'rk': f'{_:02}', 'num': 0 if _ == 0 or _ >= 10 else 1}
+        for _ in range(20)
+    ])
+    calls = []
+    _request = tb._request
+
+    def request(method, **kwargs):
+        calls.append(kwargs.get('Limit'))
+        return _request(method, **kwargs)
+
+    tb._request = request  # type: ignore
+    response = tb.query({'hk': '2'}, {'num': 0}, limit=3, fill=True)
+    assert [_['rk'] for _ in response['items']] == ['00', '10', '11']
+    assert calls == [3, 6, 18]
+    response = tb.query(
+        {'hk': '2'}, {'num': 0}, limit=3, next=response['next'], fill=True
+    )
+    assert [_['rk'] for _ in response['items']] == ['12', '13', '14']
+    assert calls[3:] == [3]
+
+
+@mock_aws
+def test_index_routing():
+    setup_dynamodb()
+    clear_table_metadata()
+    boto3.client('dynamodb', region_name='us-east-1').create_table(
+        TableName='indexed',
+        KeySchema=[
+            {'AttributeName': 'hk', 'KeyType': 'HASH'},
+            {'AttributeName': 'rk', 'KeyType': 'RANGE'}
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': _, 'AttributeType': 'S'}
+            for _ in ['hk', 'rk', 'status', 'created', 'email']
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': 'status-created',
+                'KeySchema': [
+                    {'AttributeName': 'status', 'KeyType': 'HASH'},
+                    {'AttributeName': 'created', 'KeyType': 'RANGE'}
+                ],
+                'Projection': {'ProjectionType': 'ALL'}
+            },
+            {
+                'IndexName': 'email',
+                'KeySchema': [{'AttributeName': 'email', 'KeyType': 'HASH'}],
+                'Projection': {'ProjectionType': 'KEYS_ONLY'}
+            }
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+
+    # key attrs from describe() if not configured
+    os.environ.pop('ABNOSQL_KEY_ATTRS')
+    tb = table('indexed')
+    assert tb.key_attrs == ['hk', 'rk']
+    assert tb.describe() == {
+        'key_attrs': ['hk', 'rk'],
+        'indexes': [
+            {
+                'name': 'status-created',
+                'type': 'global',
+                'key_attrs': ['status', 'created'],
+                'projection': 'ALL'
+            },
+            {
+                'name': 'email',
+                'type': 'global',
+                'key_attrs': ['email'],
+                'projection': 'KEYS_ONLY'
+            }
+        ]
+    }
+    assert get_table_metadata(tb) is get_table_metadata(tb)
+
+    _items = [
+        {
+            'hk': str(i), 'rk': 'a', 'status': ['new', 'open'][i % 2],
+            'created': f'2024-0{i + 1}', 'email': f'{i}@x.com'
+        }
+        for i in range(4)
+    ]
+    tb.put_items(_items)
+    requests = []
+    _request = tb._request
+
+    def request(method, **kwargs):
+        requests.append((method, kwargs.get('IndexName')))
+        return _request(method, **kwargs)
+
+    tb._request = request  # type: ignore
+
+    def _query(*args, **kwargs):
+        requests.clear()
+        response = tb.query(*args, **kwargs)
+        return (requests[0], sorted(_['hk'] for _ in response['items']))
+
+    # filters matching an index key query the index
+    assert _query(filters={'status': 'open'}) == (
+        ('query', 'status-created'), ['1', '3']
+    )
+    assert _query(filters={
+        'status': 'new', 'created': {'>': '2024-01'}
+    }) == (('query', 'status-created'), ['2'])
+    assert _query({'status': 'new'}, {'email': '2@x.com'}) == (
+        ('query', 'status-created'), ['2']
+    )
+    assert tb.count(filters={'status': 'open'}) == 2
+    assert requests[-1] == ('query', 'status-created')
+
+    # or table key, otherwise scan (index doesn't project all attributes)
+    assert _query(filters={'hk': '1'}) == (('query', None), ['1'])
+    assert _query(filters={'email': '2@x.com'}) == (('scan', None), ['2'])
+    assert _query(filters={'status': {'!=': 'new'}}) == (
+        ('scan', None), ['1', '3']
+    )
+
+    # strongly consistent reads aren't supported on global indexes
+    assert _query(filters={'status': 'open'}, consistency='strong')[0] == (
+        'scan', None
+    )
+
+    # explicit index or routing disabled
+    assert _query(filters={'status': 'open'}, index='status-created')[0] == (
+        'scan', 'status-created'
+    )
+    tb.config['index_routing'] = False
+    assert _query(filters={'status': 'open'})[0] == ('scan', None)
+
+    # fill next token includes the index keys of the last returned item,
+    # which are projected but not returned
+    tb.put_items([
+        {
+            'hk': str(i), 'rk': 'a', 'status': 'closed',
+            'created': f'2025-{i}', 'email': 'y' if i in [10, 14, 15, 16]
+            else 'n'
+        }
+        for i in range(10, 20)
+    ])
+    response = tb.query(
+        {'status': 'closed'}, {'email': 'y'}, limit=2, index='status-created',
+        attributes=['email'], fill=True
+    )
+    assert response['items'] == [
+        {'hk': '10', 'rk': 'a', 'email': 'y'},
+        {'hk': '14', 'rk': 'a', 'email': 'y'}
+    ]
+    assert json.loads(b64decode(response['next'])) == {
+        'hk': '14', 'rk': 'a', 'status': 'closed', 'created': '2025-14'
+    }
+    response = tb.query(
+        {'status': 'closed'}, {'email': 'y'}, limit=2, index='status-created',
+        next=response['next'], fill=True
+    )
+    assert [_['hk'] for _ in response['items']] == ['15', '16']
+    clear_table_metadata()
+
+
+def test_converters():
+    item = {
+        'hk': '1',
+        'num': 5,
+        'float': 1.5,
+        'bool': True,
+        'null': None,
+        'obj': {'foo': [1, 2.5, {'bar': 'baz'}]},
+        'tuple': (1, 2)
+    }
+
+    # same as JSON round trips they replace
+    converted = to_dynamodb(item)
+    assert converted == json.loads(json.dumps(item), parse_float=Decimal)
+    assert isinstance(converted['obj']['foo'][1], Decimal)
+    assert converted is not item
+    assert from_dynamodb(converted) == json.loads(
+        json.dumps(converted, default=json_serial)
+    )
+    assert from_dynamodb(converted)['num'] == 5
+    assert to_dynamodb({'b': b'\x00', 's': {1.5}}) == {
+        'b': b'\x00', 's': {Decimal('1.5')}
+    }
+    assert from_dynamodb({'b': Binary(b'\x00'), 's': {'a'}}) == {
+        'b': 'AA==', 's': ['a']
+    }
+
+    # low level client attribute values
+    av = TypeSerializer().serialize(converted)['M']
+    av['bin'] = {'B': b'\x00'}
+    av['ns'] = {'NS': ['1', '2.5']}
+    assert {k: from_attribute_value(v) for k, v in av.items()} == dict(
+        from_dynamodb(converted), bin='AA==', ns=[1, 2.5]
+    )
+
+
+def test_low_level():
+    # run common tests using low level client, each with fresh tables
+    for name in [
+        'test_get_item', 'test_get_items', 'test_check_exists',
+        'test_put_item', 'test_update_item', 'test_delete_item',
+        'test_query', 'test_query_sql', 'test_query_pagination',
+        'test_attributes', 'test_count', 'test_update_item_ops',
+        'test_transact_write'
+    ]:
+        @mock_dynamodbx
+        @mock_aws
+        def _test():
+            setup_dynamodb()
+            getattr(cmn, name)({'low_level': True})
+        _test()
+
+
+@mock_aws
+def test_low_level_types():
+    setup_dynamodb()
+    # values written and read via the low level client
+    tb = table('hash_range', {'low_level': True})
+    tb.put_item({'hk': '9', 'rk': 'a', 'f': 1.5, 's': {'a'}, 'b': b'\x00'})
+    assert table('hash_range').get_item(hk='9', rk='a') == {
+        'hk': '9', 'rk': 'a', 'f': 1.5, 's': ['a'], 'b': 'AA=='
+    }
+    assert tb.get_item(hk='9', rk='a') == {
+        'hk': '9', 'rk': 'a', 'f': 1.5, 's': ['a'], 'b': 'AA=='
+    }
+    assert to_attribute_value({'n': [1, 2.5, True, None]}) == {'M': {'n': {
+        'L': [{'N': '1'}, {'N': '2.5'}, {'BOOL': True}, {'NULL': True}]
+    }}}
+    with pytest.raises(TypeError):
+        to_attribute_value(object())
@@ -1,3 +1,5 @@
+from datetime import datetime
+from datetime import timezone
 import os
 from unittest.mock import patch
 
@@ -50,6 +52,10 @@ def test_get_item():
     cmn.test_get_item(config('hash_only'), 'hash_only')
 
 
+def test_get_items():
+    cmn.test_get_items(config())
+
+
 # example of patching get_client with MockFirestore
 # from mockfirestore import MockFirestore
 # from abnosql.plugins.table.firestore import Table as FirestoreTable
@@ -96,13 +102,50 @@ def test_query_base():
     cmn.test_query(config())
 
 
+def test_query_operators():
+    # firestore can't query for missing attributes
+    cmn.test_query_operators(config(), missing=False)
+
+
+def test_update_item_ops():
+    cmn.test_update_item_ops(config())
+
+
+def test_transact_write():
+    cmn.test_transact_write(config())
+
+
 def test_query_sql():
     cmn.test_query_sql(config())
 
 
+def test_query_sql_many():
+    cmn.test_query_sql_many(config())
+
+
 def test_query_scan():
     cmn.test_query_scan(config())
 
 
 def test_query_pagination():
     cmn.test_query_pagination(config())
+
+
+def test_query_fill():
+    cmn.test_query_fill(config())
+
+
+def test_consistency():
+    # MockFirestore doesnt support read_time for eventual (stale) reads
+    cmn.test_consistency(config(), levels=('session', 'strong'))
+
+
+def test_write_returns():
+    cmn.test_write_returns(config())
+
+
+def test_ttl():
+    # timestamp for TTL policies
+    for ttl in cmn.test_ttl(config()):
+        expires = (ttl - datetime.now(timezone.utc)).total_seconds()
+        assert 55 < expires <= 60
@@ -1,15 +1,19 @@
 from base64 import b64decode
+from base64 import b64encode
 import os
 from unittest.mock import patch
 
+from google.api_core import exceptions as gexceptions  # type: ignore
 from mockfirestore import MockFirestore  # type: ignore
 import pytest
+from tink import core  # type: ignore
 from tink.integration import gcpkms  # type: ignore
 
 from tests import common as cmn
 
 from abnosql import exceptions as ex
 from abnosql.kms import kms
+from abnosql.plugins.kms.gcp import is_key_error
 from abnosql.plugins.kms.gcp import mock_remote_aead
 
 ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
@@ -52,6 +56,18 @@ def test_get_put_item():
     assert item['num'] == 5
 
 
+@patch.object(gcpkms.GcpKmsClient, 'get_aead', mock_remote_aead)
+def test_binary():
+    config = setup_gcp()
+    config['kms']['binary'] = True
+    tb = cmn.test_get_item(config, 'hash_range')
+
+    # check its encrypted and stored as bytes
+    item = tb.table.document('1:a').get().to_dict()
+    assert isinstance(item['obj'], bytes) and item['obj'].startswith(b'\x00')
+    cmn.test_query(config, decrypt=True)
+
+
 @patch.object(gcpkms.GcpKmsClient, 'get_aead', mock_remote_aead)
 def test_query():
     config = setup_gcp()
@@ -70,6 +86,18 @@ def test_query_sql():
         assert item['num'] == 5
 
 
+@patch.object(gcpkms.GcpKmsClient, 'get_aead', mock_remote_aead)
+def test_query_decrypt():
+    config = setup_gcp()
+    cmn.test_query(config, decrypt=True)
+
+
+@patch.object(gcpkms.GcpKmsClient, 'get_aead', mock_remote_aead)
+def test_query_sql_decrypt():
+    config = setup_gcp()
+    cmn.test_query_sql(config, decrypt=True)
+
+
 @patch.object(gcpkms.GcpKmsClient, 'get_aead', mock_remote_aead)
 def test_invalid_context():
     config = setup_gcp()
@@ -86,3 +114,50 @@ def test_invalid_context():
         'status': 500,
         'type': None
     }
+
+
+@patch.object(gcpkms.GcpKmsClient, 'get_aead', mock_remote_aead)
+def test_query_blind_index():
+    config = setup_gcp()
+    tb = cmn.test_query_blind_index(config)
+    item = tb.table.document('1:a').get().to_dict()
+    assert len(item['str_bidx']) == 44
+
+
+@patch.object(gcpkms.GcpKmsClient, 'get_aead', mock_remote_aead)
+def test_multiple_keys():
+    config = setup_gcp()
+    key_uri2 = KEY_URI.replace('ck1', 'ck2')
+    _kms = kms(dict(config['kms'], key_ids=[KEY_URI, key_uri2]), 'gcp')
+    context = {'hk': '1'}
+
+    # distinct keys, so the first key encrypts even if another is faster
+    _kms.key_selector.record(key_uri2, latency=0.001)
+    _kms.key_selector.record(KEY_URI, latency=1)
+    serialized = _kms.encrypt('foo', context)
+    assert _kms.env_aeads[KEY_URI].decrypt(
+        b64decode(serialized), b'{"hk": "1"}'
+    ) == b'foo'
+
+    # data encrypted under another key decrypts, the first key failing
+    # doesn't count against its health
+    serialized = b64encode(_kms.env_aeads[key_uri2].encrypt(
+        b'bar', b'{"hk": "1"}'
+    )).decode()
+    assert _kms.decrypt(serialized, context) == 'bar'
+    assert _kms.key_selector._stats[KEY_URI]['errors'] == 0
+    assert is_key_error(core.TinkError(gexceptions.InvalidArgument('')))
+    assert not is_key_error(
+        core.TinkError(gexceptions.ServiceUnavailable(''))
+    )
+
+    # replicas encrypt with the fastest key
+    _kms = kms(dict(
+        config['kms'], key_ids=[KEY_URI, key_uri2], key_replicas=True
+    ), 'gcp')
+    _kms.key_selector.record(key_uri2, latency=0.001)
+    _kms.key_selector.record(KEY_URI, latency=1)
+    serialized = _kms.encrypt('foo', context)
+    assert _kms.env_aeads[key_uri2].decrypt(
+        b64decode(serialized), b'{"hk": "1"}'
+    ) == b'foo'
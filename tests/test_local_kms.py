@@ -0,0 +1,215 @@
+import os
+import time
+
+import pytest
+
+from abnosql import exceptions as ex
+from abnosql.benchmark import kms_benchmark
+from abnosql.kms import kms
+from abnosql.plugins.kms.local import create_key
+from abnosql.plugins.table.memory import clear_tables
+from abnosql.plugins.table.memory import get_table_count
+from abnosql import table
+from tests import common as cmn
+
+
+def setup_local(tmp_path, keys=('k1',)):
+    clear_tables()
+    key_ids = []
+    for key in keys:
+        key_ids.append(str(tmp_path / f'{key}.key'))
+        if not os.path.exists(key_ids[-1]):
+            create_key(key_ids[-1])
+    os.environ.update({
+        'ABNOSQL_DB': 'memory',
+        'ABNOSQL_KEY_ATTRS': 'hk,rk'
+    })
+    return {
+        'kms': {
+            'provider': 'local',
+            'key_ids': key_ids,
+            'key_attrs': ['hk', 'rk'],
+            'attrs': ['obj', 'str']
+        }
+    }
+
+
+def test_get_put_item(tmp_path):
+    config = setup_local(tmp_path)
+    cmn.test_get_item(config, 'hash_range')
+
+    # check its encrypted
+    item = table('hash_range', database='memory').get_item(hk='1', rk='a')
+    assert item['str'] != 'foobar' and item['num'] == 5
+
+
+def test_put_items_get_items(tmp_path):
+    config = setup_local(tmp_path)
+    cmn.test_get_items(config)
+
+
+def test_query_decrypt(tmp_path):
+    config = setup_local(tmp_path)
+    cmn.test_query(config, decrypt=True)
+
+
+def test_attributes(tmp_path):
+    # obj and str are encrypted so projected after decryption
+    config = setup_local(tmp_path)
+    cmn.test_attributes(config, decrypt=True)
+
+
+def test_count(tmp_path):
+    # str is encrypted so filter uses blind index
+    config = setup_local(tmp_path)
+    config['kms'].update({
+        'blind_index_attrs': ['str'],
+        'blind_index_key': b'0123456789abcdef'
+    })
+    cmn.test_count(config)
+
+
+def test_update_item_ops(tmp_path):
+    config = setup_local(tmp_path)
+    config['kms'].update({
+        'blind_index_attrs': ['str'],
+        'blind_index_key': b'0123456789abcdef'
+    })
+    tb = table('hash_range', config)
+    tb.put_item(cmn.item('1', 'a'))
+    key = {'hk': '1', 'rk': 'a'}
+
+    # encrypted attributes can be set (and blind index updated) or removed
+    item = tb.update_item(key, {'str': 'new', 'num': {'increment': 1}})
+    assert item['str'] == 'new' and item['num'] == 6
+    stored = table('hash_range', database='memory').get_item(**key)
+    assert stored['str'] != 'new'
+    assert tb.query({'hk': '1'}, {'str': 'new'})['items'][0]['num'] == 6
+    item = tb.update_item(key, {'str': {'remove': True}})
+    assert 'str' not in item
+    stored = table('hash_range', database='memory').get_item(**key)
+    assert 'str' not in stored and 'str_bidx' not in stored
+    with pytest.raises(ex.ValidationException):
+        tb.update_item(key, {'obj': {'append': [1]}})
+
+
+def test_transact_write(tmp_path):
+    config = setup_local(tmp_path)
+    config['kms'].update({
+        'blind_index_attrs': ['str'],
+        'blind_index_key': b'0123456789abcdef'
+    })
+    cmn.test_transact_write(config, multi_table=False)
+
+    # puts are encrypted and conditions use the blind index
+    clear_tables()
+    tb = table('hash_range', config)
+    tb.put_item(cmn.item('1', 'a'))
+    tb.transact_write([
+        {'put': cmn.item('1', 'b')},
+        {'check': {'hk': '1', 'rk': 'a'}, 'condition': {'str': 'str'}}
+    ])
+    stored = table('hash_range', database='memory').get_item(hk='1', rk='b')
+    assert stored['str'] != 'str'
+    assert tb.get_item(hk='1', rk='b') == cmn.item('1', 'b')
+    with pytest.raises(ex.TransactionException):
+        tb.transact_write([
+            {'check': {'hk': '1', 'rk': 'a'}, 'condition': {'str': 'foo'}}
+        ])
+    with pytest.raises(ex.ValidationException):
+        tb.transact_write([
+            {'check': {'hk': '1', 'rk': 'a'}, 'condition': {
+                'str': {'begins_with': 's'}
+            }}
+        ])
+
+
+def test_write_returns(tmp_path):
+    setup_local(tmp_path)
+    cmn.test_write_returns()
+
+
+def test_ttl(tmp_path):
+    config = setup_local(tmp_path)
+    config['ttl_seconds'] = 60
+    for ttl in cmn.test_ttl(config):
+        assert time.time() + 55 < ttl <= time.time() + 60
+
+    # supplied expiry is kept and expired items are evicted when read
+    tb = table('hash_range', config)
+    tb.put_item(dict(cmn.item('2', 'a'), ttl=int(time.time()) - 1))
+    assert tb.get_item(hk='2', rk='a') is None
+    assert tb.query({'hk': '1'})['items'][0]['num'] == 5
+    tb.put_item(dict(cmn.item('1', 'c'), ttl=int(time.time()) - 1))
+    assert len(tb.query({'hk': '1'})['items']) == 2
+    assert tb.count() == 2
+
+    # queries skip expired items, only reads by key evict them
+    assert get_table_count('hash_range') == 3
+    tb.update_item({'hk': '1', 'rk': 'a'}, {'num': 6})
+    assert get_table_count('hash_range') == 3
+    assert tb.get_items([{'hk': '1', 'rk': 'c'}]) == [None]
+    assert get_table_count('hash_range') == 2
+
+
+def test_dek_modes(tmp_path):
+    config = setup_local(tmp_path)
+    key_ids = config['kms']['key_ids']
+    contexts = [{'hk': '1'}, {'hk': '1'}, {'hk': '2'}]
+    plaintexts = ['foo', 'bar', 'baz']
+
+    def enc_deks(mode):
+        _kms = kms({'key_ids': key_ids, 'dek_mode': mode}, 'local')
+        serialized = _kms.encrypt_many(plaintexts, contexts)
+        assert _kms.decrypt_many(serialized, contexts) == plaintexts
+        serialized += _kms.encrypt_many(plaintexts, contexts)
+        return [_kms.unpack(_)[2] for _ in serialized]
+
+    # 96 bit (12 byte) AES-GCM nonce per value
+    _kms = kms({'key_ids': key_ids}, 'local')
+    assert len(_kms.unpack(_kms.encrypt('foo', contexts[0]))[1]) == 12
+
+    # new DEK per value, per item (context) or reused across calls
+    assert len(set(enc_deks('attr'))) == 6
+    assert len(set(enc_deks('item'))) == 4
+    assert len(set(enc_deks('cached'))) == 1
+
+    # cached DEK rotated after max_uses
+    _kms = kms({
+        'key_ids': key_ids,
+        'dek_mode': 'cached',
+        'dek_reuse': {'max_uses': 3}
+    }, 'local')
+    serialized = _kms.encrypt_many(plaintexts, contexts)
+    serialized.append(_kms.encrypt('foo', {'hk': '1'}))
+    assert len(set(_kms.unpack(_)[2] for _ in serialized)) == 2
+
+    with pytest.raises(ex.ConfigException):
+        kms({'key_ids': key_ids, 'dek_mode': 'foo'}, 'local')
+
+
+def test_key_rotation(tmp_path):
+    config = setup_local(tmp_path)
+    _kms1 = kms(config['kms'], 'local')
+    serialized = _kms1.encrypt('foo', {'hk': '1'})
+
+    # new primary key, old key can still unwrap
+    config = setup_local(tmp_path, ('k2', 'k1'))
+    _kms2 = kms(config['kms'], 'local')
+    assert _kms2.decrypt(serialized, {'hk': '1'}) == 'foo'
+    with pytest.raises(ex.PluginException):
+        _kms1.decrypt(_kms2.encrypt('foo', {'hk': '1'}), {'hk': '1'})
+    with pytest.raises(ex.PluginException):
+        _kms2.decrypt(serialized, {'hk': '2'})
+    with pytest.raises(ex.ConfigException):
+        kms({'key_ids': [str(tmp_path / 'missing.key')]}, 'local')
+
+
+def test_benchmark(monkeypatch):
+    monkeypatch.delenv('ABNOSQL_KMS_KEYS', raising=False)
+    results = kms_benchmark(item_sizes=[100], attr_counts=[1, 2], items=5)
+    assert len(results) == 6
+    assert [_['mode'] for _ in results[:3]] == ['attr', 'item', 'cached']
+    for result in results:
+        assert result['encrypt_ops'] > 0 and result['decrypt_mbps'] > 0
+        assert result['overhead'] > 1
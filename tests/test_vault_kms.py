@@ -0,0 +1,149 @@
+from base64 import b64decode
+import os
+
+import pytest
+import requests  # type: ignore
+import responses  # type: ignore
+
+from abnosql import exceptions as ex
+from abnosql.kms import kms
+from abnosql.mocks import mock_vault
+from abnosql.plugins.kms.vault import deserialize
+from abnosql.plugins.kms.vault import parse_key_id
+from abnosql.plugins.table.memory import clear_tables
+from abnosql import table
+from tests import common as cmn
+
+
+def setup_vault():
+    clear_tables()
+    os.environ.update({
+        'ABNOSQL_DB': 'memory',
+        'ABNOSQL_KEY_ATTRS': 'hk,rk',
+        'VAULT_ADDR': 'https://vault.example.com:8200',
+        'VAULT_TOKEN': 'mytoken'
+    })
+    return {
+        'kms': {
+            'provider': 'vault',
+            'key_ids': ['mykey'],
+            'key_attrs': ['hk', 'rk'],
+            'attrs': ['obj', 'str']
+        }
+    }
+
+
+def vault_calls(operation):
+    return [
+        _ for _ in responses.calls
+        if _.request.url.endswith(f'/v1/transit/{operation}/mykey')
+    ]
+
+
+def test_parse_key_id():
+    assert parse_key_id('mykey') == (None, 'transit', 'mykey')
+    assert parse_key_id(
+        'https://vault.example.com:8200/v1/ns/transit/keys/mykey'
+    ) == ('https://vault.example.com:8200', 'ns/transit', 'mykey')
+    with pytest.raises(ex.ConfigException):
+        parse_key_id('https://vault.example.com:8200/mykey')
+
+
+@mock_vault
+@responses.activate
+def test_get_put_item():
+    config = setup_vault()
+    cmn.test_get_item(config, 'hash_range')
+
+    # check its encrypted
+    item = table('hash_range', database='memory').get_item(hk='1', rk='a')
+    assert deserialize(item['obj']).startswith('vault:v1:')
+    assert deserialize(item['str']).startswith('vault:v1:')
+    assert item['num'] == 5
+
+
+@mock_vault
+@responses.activate
+def test_put_items_get_items():
+    config = setup_vault()
+    config['kms']['batch_size'] = 5
+    cmn.test_get_items(config)
+
+    # 4 items x 2 attrs encrypted in 2 batches, 2 items decrypted in 1
+    assert len(vault_calls('encrypt')) == 2
+    assert len(vault_calls('decrypt')) == 1
+
+
+@mock_vault
+@responses.activate
+def test_query_decrypt():
+    config = setup_vault()
+    cmn.test_query(config, decrypt=True)
+
+
+@mock_vault
+@responses.activate
+def test_derived():
+    setup_vault()
+    _kms = kms({'key_ids': ['mykey'], 'derived': True}, 'vault')
+    contexts = [{'hk': '1', 'rk': 'a'}, {'hk': '1', 'rk': 'b'}]
+    serialized = _kms.encrypt_many(['foo', 'bar'], contexts)
+    assert _kms.decrypt_many(serialized, contexts) == ['foo', 'bar']
+    body = vault_calls('encrypt')[0].request.body
+    assert b'"context"' in body and b'foo' not in b64decode(
+        serialized[0]
+    )
+
+    # context is used for key derivation
+    with pytest.raises(ex.PluginException) as e:
+        _kms.decrypt(serialized[0], contexts[1])
+    assert 'authentication failed' in str(e.value.detail)
+
+
+@mock_vault
+@responses.activate
+def test_invalid_context():
+    setup_vault()
+    _kms = kms({'key_ids': ['mykey']}, 'vault')
+    serialized = _kms.encrypt('foo', {'hk': '1'})
+    assert _kms.decrypt(serialized, {'hk': '1'}) == 'foo'
+    with pytest.raises(ex.PluginException) as e:
+        _kms.decrypt(serialized, {'hk': '2'})
+    assert 'context mismatch' in str(e.value.detail)
+
+
+@mock_vault
+@responses.activate
+def test_permission_denied():
+    setup_vault()
+    _kms = kms({'key_ids': ['mykey']}, 'vault')
+    _kms.token = None
+    with pytest.raises(ex.ConfigException):
+        _kms.encrypt('foo', {'hk': '1'})
+
+
+@mock_vault
+@responses.activate
+def test_replicas():
+    setup_vault()
+    key_ids = [
+        f'https://vault-{_}.example.com:8200/v1/transit/keys/mykey'
+        for _ in ['a', 'b']
+    ]
+    _kms = kms({'key_ids': key_ids}, 'vault')
+    _post = _kms._post
+
+    # replica a is down so fails over to replica b
+    def post(operation, batch_input, key_id):
+        if key_id == key_ids[0]:
+            raise requests.ConnectionError('replica down')
+        return _post(operation, batch_input, key_id)
+
+    _kms._post = post
+    serialized = _kms.encrypt('foo', {'hk': '1'})
+    assert _kms.decrypt(serialized, {'hk': '1'}) == 'foo'
+    assert _kms.key_selector.ordered() == list(reversed(key_ids))
+    assert all(
+        _.request.url.startswith('https://vault-b.')
+        for _ in responses.calls
+    )